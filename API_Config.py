@@ -1,32 +1,17 @@
+import asyncio
 import os
-import firebase_admin
-from firebase_admin import credentials, firestore
-from pyrebase import pyrebase
-from groq import Groq
+import threading
+import time
+import weakref
 import gradio as gr
-import json
+from metrics import gauge
 
 # APITemplate Config
-try:
-    PDF_API_KEY = os.environ["PDF_API_KEY"]
-except KeyError:
-    raise gr.Error("PDF_API_KEY environment variable not set.")
 template_id = "db277b23f34421f2"
 
-# Groq client Config
-try:
-    GROQ_API_KEY = os.environ["GROQ_API_KEY"]
-except KeyError:
-    raise gr.Error("GROQ_API_KEY environment variable not set.")
-client = Groq(api_key=GROQ_API_KEY)
-
 # Firebase Config
-try:
-    PYREBASE_API_KEY = os.environ["PYREBASE_API_KEY"]
-except KeyError:
-    raise gr.Error("PYREBASE_API_KEY environment variable not set.")
 firebaseConfig = {
-  "apiKey": PYREBASE_API_KEY,
+  "apiKey": None,  # Filled from PYREBASE_API_KEY when the Firebase app is first used
   "authDomain": "ai-medical-chatbot-e33f2.firebaseapp.com",
   "projectId": "ai-medical-chatbot-e33f2",
   "storageBucket": "ai-medical-chatbot-e33f2.firebasestorage.app",
@@ -34,14 +19,293 @@ firebaseConfig = {
   "appId": "1:421207447431:web:87a7c6b8c31853a5596522",
   "databaseURL": ""
 }
-firebase = pyrebase.initialize_app(firebaseConfig)
-auth = firebase.auth()
 
-# Firebase_admin Config
-try:
-    cred = credentials.Certificate(r"C:\Users\adils\Downloads\serviceAccountKey.json")
-except ValueError:
-    raise gr.Error("FIREBASE_CERTIFICATE environment variable is not a valid JSON.")
-firebase_admin.initialize_app(cred)
+# Firebase_admin Config, the service account JSON is read from FIREBASE_CREDENTIALS
+DEFAULT_CREDENTIALS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "serviceAccountKey.json")
+
+# How long each backend took to initialize, labelled by service name
+service_init_seconds = gauge("service_init_seconds", "Time taken to initialize each backend service.")
+
+
+def require_env(name):
+    """
+    Reads a required environment variable.
+
+    Args:
+        name (str): The name of the environment variable.
+
+    Returns:
+        str: The value of the environment variable.
+
+    Raises:
+        gr.Error: If the environment variable is not set.
+    """
+    try:
+        return os.environ[name]
+    except KeyError:
+        raise gr.Error(f"{name} environment variable not set.")
+
+
+class ServiceRegistry:
+    """
+    Creates backend clients on first use and reuses them afterwards.
+
+    Each service is registered with a factory. Nothing is created at import time, so the app
+    (or a test) only pays for, and only needs credentials for, the backends it actually uses.
+    Any service can be replaced with a local fake through override().
+    """
+
+    def __init__(self):
+        self._factories = {}
+        self._instances = {}
+        self._loop_instances = {}
+        self._init_times = {}
+        self._lock = threading.RLock()
+
+    def register(self, name, factory):
+        """
+        Registers the factory used to create a service.
+
+        Args:
+            name (str): The name of the service.
+            factory (callable): A function with no arguments returning the service instance.
+        """
+        with self._lock:
+            self._factories[name] = factory
+
+    def get(self, name):
+        """
+        Returns the service instance, creating it on first use.
+
+        Args:
+            name (str): The name of the service.
+
+        Returns:
+            object: The service instance.
+
+        Raises:
+            KeyError: If no service is registered under this name.
+        """
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+        with self._lock:
+            # Another thread may have created it while we waited for the lock
+            if name in self._instances:
+                return self._instances[name]
+            factory = self._factories[name]
+            start = time.perf_counter()
+            instance = factory()
+            elapsed = time.perf_counter() - start
+            self._instances[name] = instance
+            self._init_times[name] = elapsed
+            service_init_seconds.set(elapsed, service=name)
+            return instance
+
+    def get_for_loop(self, name):
+        """
+        Returns the instance of a service bound to the running event loop, creating it on first use.
+
+        Async clients hold connections tied to the loop they were created on, so each loop gets
+        its own instance. An override set with override() is returned for every loop.
+
+        Args:
+            name (str): The name of the service.
+
+        Returns:
+            object: The service instance for the running loop.
+
+        Raises:
+            RuntimeError: If no event loop is running.
+        """
+        if name in self._instances:
+            return self._instances[name]
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            per_loop = self._loop_instances.setdefault(name, weakref.WeakKeyDictionary())
+            instance = per_loop.get(loop)
+            if instance is None:
+                start = time.perf_counter()
+                instance = per_loop[loop] = self._factories[name]()
+                elapsed = time.perf_counter() - start
+                self._init_times[name] = elapsed
+                service_init_seconds.set(elapsed, service=name)
+            return instance
+
+    def override(self, name, instance):
+        """
+        Replaces a service with the given instance, e.g. a local fake.
+
+        Args:
+            name (str): The name of the service.
+            instance (object): The instance to return from get().
+        """
+        with self._lock:
+            self._instances[name] = instance
+            self._init_times[name] = 0.0
+
+    def reset(self, name=None):
+        """
+        Drops created instances so the next get() calls the factory again.
+
+        Args:
+            name (str): The service to reset, or None to reset all of them.
+        """
+        with self._lock:
+            if name is None:
+                self._instances.clear()
+                self._loop_instances.clear()
+                self._init_times.clear()
+            else:
+                self._instances.pop(name, None)
+                self._loop_instances.pop(name, None)
+                self._init_times.pop(name, None)
+
+    def init_times(self):
+        """
+        Returns how long each created service took to initialize.
+
+        Returns:
+            dict: Service name to initialization time in seconds.
+        """
+        with self._lock:
+            return dict(self._init_times)
+
+
+class LazyService:
+    """A stand-in for a registered service that resolves it on first attribute access."""
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(services.get(self._name), attr)
+
+    def __repr__(self):
+        return f"<LazyService {self._name}>"
+
+
+class LoopLocalService(LazyService):
+    """A stand-in for a registered async service that resolves the instance of the running event loop."""
+
+    def __getattr__(self, attr):
+        return getattr(services.get_for_loop(self._name), attr)
+
+
+def _create_groq_client():
+    """Creates the Groq client."""
+    from groq import Groq
+    # Retries are handled by groq_resilience, with backoff, circuit breakers and model fallback
+    return Groq(api_key=require_env("GROQ_API_KEY"), max_retries=0)
+
+
+def _create_async_groq_client():
+    """Creates an asyncio Groq client."""
+    from groq import AsyncGroq
+    return AsyncGroq(api_key=require_env("GROQ_API_KEY"), max_retries=0)
+
+
+def _create_firebase_app():
+    """Creates the pyrebase app."""
+    from pyrebase import pyrebase
+    config = dict(firebaseConfig, apiKey=require_env("PYREBASE_API_KEY"))
+    return pyrebase.initialize_app(config)
+
+
+def _create_firebase_admin_app():
+    """Creates the firebase_admin app from the service account certificate."""
+    import firebase_admin
+    from firebase_admin import credentials
+    try:
+        cred = credentials.Certificate(os.environ.get("FIREBASE_CREDENTIALS", DEFAULT_CREDENTIALS_PATH))
+    except (ValueError, IOError):
+        raise gr.Error("FIREBASE_CREDENTIALS is not a valid service account JSON file.")
+    return firebase_admin.initialize_app(cred)
+
+
+def _create_firestore_client():
+    """Creates the Firestore client."""
+    from firebase_admin import firestore
+    return firestore.client(services.get("firebase_admin"))
+
+
+def _create_report_store():
+    """Creates the report PDF store selected by REPORT_STORE ("firebase" or "local")."""
+    from report_store import REPORT_STORE, FirebaseReportStore, LocalReportStore
+    if REPORT_STORE == "local":
+        return LocalReportStore()
+    from firebase_admin import storage
+    return FirebaseReportStore(storage.bucket(firebaseConfig["storageBucket"], app=services.get("firebase_admin")))
+
+
+def _create_response_cache():
+    """Creates the cache of replies and their TTS audio."""
+    from response_cache import create_response_cache
+    return create_response_cache()
+
+
+def _create_patient_repository():
+    """Creates the patient and report metadata repository selected by PATIENT_STORE ("firestore", "sqlite" or "memory")."""
+    from patient_repository import create_patient_repository
+    return create_patient_repository()
+
+
+def _create_login_cache():
+    """Creates the per-user cache of login dashboard data."""
+    from response_cache import create_login_cache
+    return create_login_cache()
+
+
+def _create_http_session():
+    """Creates the pooled HTTP session for the image and PDF API calls."""
+    from http_client import create_session
+    return create_session()
+
+
+def _create_report_job_queue():
+    """Creates the background report job queue, resuming the jobs a previous run left unfinished."""
+    from report_jobs import create_report_job_queue
+    return create_report_job_queue()
+
+
+def _create_pdf_renderer():
+    """Creates the report PDF renderer selected by PDF_RENDERER ("local" or "remote")."""
+    from pdf_renderer import create_pdf_renderer
+    return create_pdf_renderer()
+
+
+def _create_report_retention():
+    """Creates the policy keeping each user's latest reports."""
+    from retention import ReportRetention
+    return ReportRetention(services.get("patients"), services.get("report_store"))
+
+
+def _create_audio_store():
+    """Creates the store of the TTS reply audio files."""
+    from audio_store import AudioStore
+    return AudioStore()
+
+
+services = ServiceRegistry()
+services.register("groq", _create_groq_client)
+services.register("async_groq", _create_async_groq_client)
+services.register("firebase", _create_firebase_app)
+services.register("auth", lambda: services.get("firebase").auth())
+services.register("firebase_admin", _create_firebase_admin_app)
+services.register("db", _create_firestore_client)
+services.register("report_store", _create_report_store)
+services.register("patients", _create_patient_repository)
+services.register("response_cache", _create_response_cache)
+services.register("login_cache", _create_login_cache)
+services.register("pdf_api_key", lambda: require_env("PDF_API_KEY"))
+services.register("http_session", _create_http_session)
+services.register("report_jobs", _create_report_job_queue)
+services.register("pdf_renderer", _create_pdf_renderer)
+services.register("report_retention", _create_report_retention)
+services.register("audio_store", _create_audio_store)
 
-db = firestore.client()
+# Module level handles kept for existing imports, resolved on first use
+client = LazyService("groq")
+async_client = LoopLocalService("async_groq")
+auth = LazyService("auth")
+db = LazyService("db")
@@ -1,25 +1,61 @@
 import os
-from Voice_of_user import transcription_with_groq
-from Response_voice import text_to_speech
+import asyncio
+import logging
+from Voice_of_user import transcription_with_groq_async
+from Response_voice import text_to_speech, pipelined_text_to_speech_async
 from io import BytesIO
 import gradio as gr
 import base64
 import random
 from PIL import Image
 import urllib.parse
-from API_Config import client
+import time
+from API_Config import async_client, services
+from concurrency import iterate_sync, run_sync, upstream_async
+from groq_resilience import call_groq_async, message_bytes, record_payload
+from metrics import histogram
+from response_cache import cache_key
+from image_asset import ImageAsset
+from conversation import Conversation
+from summarizer import schedule_summary, wait_for_summaries
+
+# Base URL of the pollinations image generation API, the browser and the report load the images from it
+IMAGE_API_BASE_URL = os.environ.get("IMAGE_API_BASE_URL", "https://pollinations.ai").rstrip("/")
+
+# Model used for the doctor's diagnosis and follow-ups
+ANALYZING_MODEL = "meta-llama/llama-4-maverick-17b-128e-instruct"
+
+# System prompt for image analysis
+DOCTOR_SYSTEM_PROMPT = """You are a professional doctor, providing educational advice. Analyze the provided image 
+    (or description) and determine if there are any visible medical concerns. If applicable, suggest possible 
+    differentials and remedies. Respond naturally, in 5 to 6 lines, without using numbers, special characters, 
+    markdown formatting, or any AI disclaimers. Speak directly to the user as if you are a real doctor. If an input 
+    description is provided, start with 'Based on your description...', if the provided image appears to be AI generated 
+    handle it by saying something like 'I have an image here...' and then follow up with 'if your condition is like 
+    this then...', if no input is provided, say 'Please upload an image or provide a description of your condition.' 
+    If you are unsure about the input, politely ask the user for clarification. Start your answer immediately, with 
+    no preamble."""
+
+logger = logging.getLogger(__name__)
+
+# Duration of each stage of the input processing
+stage_seconds = histogram("pipeline_stage_seconds", "Time taken by each stage of the input processing.")
+
+# Time from sending a streaming request until its first text token arrives
+time_to_first_token = histogram(
+    "llm_time_to_first_token_seconds", "Time until the first streamed token of an LLM reply arrives.")
 
 
 def encode_image(image_path):
     """
     Tries to open an image file from the specified file path and
-    encodes it to a base64 string.
+    wraps it in an ImageAsset, which is passed on through the rest of the pipeline.
 
     Args:
         image_path (str): The file path to the image to be encoded.
 
     Returns:
-        str: The base64 encoded string representation of the image.
+        ImageAsset: The image, with its base64 and decoded forms computed on first use.
 
     Raises:
         gr.Error: If the encoding fails for any reason.
@@ -28,10 +64,8 @@ def encode_image(image_path):
               generic gr.Error.
     """
     try:
-        # Try to open the image file
-        with open(image_path, "rb") as image_file:
-            # Encode the image to base64
-            return base64.b64encode(image_file.read()).decode('utf-8')
+        # Try to open the image file, it is only encoded or decoded once something needs it
+        return ImageAsset.from_path(image_path)
     except FileNotFoundError:
         # If the image file is not found, raise a FileNotFoundError
         raise gr.Error(f"Image file not found: {image_path}")
@@ -40,15 +74,38 @@ def encode_image(image_path):
         raise gr.Error(f"Error encoding image: {e}")
 
 
+def encode_image_for_vision(image_path):
+    """
+    Reads an image file and prepares the downscaled, metadata-free version sent to the vision model.
+
+    Args:
+        image_path (str): The file path to the image to be encoded.
+
+    Returns:
+        ImageAsset: The image, with its vision model version already computed.
+
+    Raises:
+        gr.Error: If the image can't be read or decoded.
+    """
+    asset = encode_image(image_path)
+    try:
+        # Computed once here, on a worker thread, and cached on the asset
+        asset.vision
+    except Exception as e:
+        raise gr.Error(f"Error encoding image: {e}")
+    return asset
+
+
 def base64_to_pil(b64_string):
     """
     Decodes a base64 encoded string to a PIL Image object.
 
     Args:
-        b64_string (str): The base64 encoded string representation of the image.
+        b64_string (str or ImageAsset): The base64 encoded string representation of the image.
             This string is expected to be a valid base64 encoded string.
             If the string starts with "data:image/", it is assumed to be a
             data URI and the data is extracted from the string.
+            An ImageAsset returns its cached decoded image.
 
     Returns:
         PIL.Image: The decoded PIL Image object.
@@ -59,6 +116,9 @@ def base64_to_pil(b64_string):
             string, or if the image data is corrupted.
     """
     try:
+        if isinstance(b64_string, ImageAsset):
+            # The asset decodes its bytes at most once
+            return b64_string.pil
         if b64_string.startswith("data:image"):
             # Extract the data from the data URI
             b64_string = b64_string.split(",")[1]
@@ -71,46 +131,215 @@ def base64_to_pil(b64_string):
         raise gr.Error(f"Error decoding base64 string to PIL Image: {e}")
 
 
+def build_messages(query, encoded_image=None):
+    """
+    Builds the chat messages for a query and an optional image.
+
+    Args:
+        query (str): The user's query.
+        encoded_image (ImageAsset or str): The image, or its base64 encoded string representation, if any.
+
+    Returns:
+        list: The messages to send to the chat completion API.
+    """
+    messages = [
+        {
+            "role": "user",
+            "content": [{"type": "text", "text": query}]
+        }
+    ]
+    if encoded_image:
+        # Add the image to the input data if it's provided, downscaled and re-encoded for the vision model
+        if isinstance(encoded_image, ImageAsset):
+            image_url = encoded_image.vision.data_uri
+        else:
+            image_url = f"data:image/jpeg;base64,{encoded_image}"
+        messages[0]["content"].append({"type": "image_url", "image_url": {"url": image_url}})
+    return messages
+
+
+async def analyze_image_async(query, analyzing_model, encoded_image=None):
+    """
+    Analyzes an image using a specified model and generates a text response based on the input query,
+    without blocking the event loop.
+
+    Args:
+        query (str): The user's query.
+        analyzing_model (str): The model to use for image analysis.
+        encoded_image (ImageAsset or str): The image to analyze, or its base64 encoded string representation.
+
+    Returns:
+        str: The response as a string.
+
+    Raises:
+        gr.Error: If the analyzing fails for any reason.
+    """
+    try:
+        # Build the input data for the chat completion
+        messages = build_messages(query, encoded_image)
+        async def request(model):
+            async with upstream_async("llm"):
+                return await async_client.chat.completions.create(messages=messages, model=model)
+
+        # Call the chat completion API, with retries and model fallback
+        chat_completion = await call_groq_async("analyze", analyzing_model, request)
+        response_text = chat_completion.choices[0].message.content
+        record_payload("analyze", message_bytes(messages), len(response_text or ""))
+        # Return the response text
+        return response_text
+    except Exception:
+        # Raise an error if anything goes wrong
+        raise gr.Error("Sorry, our AI service is temporarily unavailable.")
+
+
 def analyze_image(query, analyzing_model, encoded_image=None):
     """
     Analyzes an image using a specified model and generates a text response based on the input query.
 
+    Sync facade over analyze_image_async.
+
     Args:
         query (str): The user's query.
         analyzing_model (str): The model to use for image analysis.
-        encoded_image (str): The base64 encoded string representation of the image to analyze.
+        encoded_image (ImageAsset or str): The image to analyze, or its base64 encoded string representation.
 
     Returns:
         str: The response as a string.
 
+    Raises:
+        gr.Error: If the analyzing fails for any reason.
+    """
+    return run_sync(analyze_image_async(query, analyzing_model, encoded_image))
+
+
+async def analyze_image_stream_async(query, analyzing_model, encoded_image=None):
+    """
+    Streaming variant of analyze_image_async that yields the response text as tokens arrive.
+
+    The delay until the first token is recorded in the llm_time_to_first_token_seconds histogram.
+
+    Args:
+        query (str): The user's query.
+        analyzing_model (str): The model to use for image analysis.
+        encoded_image (ImageAsset or str): The image to analyze, or its base64 encoded string representation.
+
+    Yields:
+        str: The next piece of the response text.
+
     Raises:
         gr.Error: If the analyzing fails for any reason.
     """
     try:
         # Build the input data for the chat completion
-        messages = [
-            {
-                "role": "user",
-                "content": [{"type": "text", "text": query}]
-            }
-        ]
-        if encoded_image:
-            # Add the image to the input data if it's provided
-            messages[0]["content"].append({
-                "type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{encoded_image}"}
-            })
-        # Call the chat completion API
-        chat_completion = client.chat.completions.create(messages=messages, model=analyzing_model)
-        # Return the response text
-        return chat_completion.choices[0].message.content
+        messages = build_messages(query, encoded_image)
+        # The LLM slot is held until the whole reply has been streamed
+        async with upstream_async("llm"):
+            start = time.perf_counter()
+            # Open the stream with retries and model fallback, a reply cut off midway is not retried
+            stream = await call_groq_async(
+                "analyze_stream", analyzing_model,
+                lambda model: async_client.chat.completions.create(messages=messages, model=model, stream=True))
+            first_token = True
+            received = 0
+            async for chunk in stream:
+                # Skip keep-alive and usage chunks that carry no text
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                if first_token:
+                    # Record the time to first token once per reply
+                    time_to_first_token.observe(time.perf_counter() - start, model=analyzing_model)
+                    first_token = False
+                received += len(delta)
+                yield delta
+            record_payload("analyze_stream", message_bytes(messages), received)
     except Exception:
         # Raise an error if anything goes wrong
         raise gr.Error("Sorry, our AI service is temporarily unavailable.")
 
 
-def generate_stt_and_images(multimodal_input):
+def analyze_image_stream(query, analyzing_model, encoded_image=None):
     """
-    Processes multimodal input to generate speech-to-text (STT) and image encodings.
+    Streaming variant of analyze_image that yields the response text as tokens arrive.
+
+    Sync facade over analyze_image_stream_async.
+
+    Args:
+        query (str): The user's query.
+        analyzing_model (str): The model to use for image analysis.
+        encoded_image (ImageAsset or str): The image to analyze, or its base64 encoded string representation.
+
+    Yields:
+        str: The next piece of the response text.
+
+    Raises:
+        gr.Error: If the analyzing fails for any reason.
+    """
+    yield from iterate_sync(analyze_image_stream_async(query, analyzing_model, encoded_image))
+
+
+async def timed_stage(stage, awaitable):
+    """
+    Awaits one stage of the pipeline and records how long it took.
+
+    Args:
+        stage (str): The name of the stage, used as the metric label.
+        awaitable (awaitable): The work of the stage.
+
+    Returns:
+        object: The result of the stage.
+    """
+    start = time.perf_counter()
+    try:
+        return await awaitable
+    finally:
+        elapsed = time.perf_counter() - start
+        stage_seconds.observe(elapsed, stage=stage)
+        logger.info("Stage %s took %.3fs", stage, elapsed)
+
+
+async def generate_image_url_async(stt):
+    """
+    Generates the URL of an illustrative image for a condition described in text.
+
+    Args:
+        stt (str): The user's description of the condition.
+
+    Returns:
+        str: The URL of the generated image.
+    """
+    prompt_suffix = """You are an image prompt generator. Based on the medical condition provided, generate a 
+    **short, descriptive image prompt** of **5 to 6 words**, with no explanation or extra text. **Only return 
+    the prompt**. Do not include quotes, punctuation, or any introductory text."""
+    async def request(model):
+        async with upstream_async("llm"):
+            return await async_client.chat.completions.create(
+                model=model,
+                messages=[{"role": "user", "content": stt + prompt_suffix}]
+            )
+
+    # Call the chat completion API, with retries and model fallback
+    response = await call_groq_async("image_prompt", "compound-beta-mini", request)
+    # Get the generated image prompt
+    selected_prompt = response.choices[0].message.content
+    record_payload("image_prompt", len(stt) + len(prompt_suffix), len(selected_prompt))
+
+    # Generate an image using the image generation API
+    width, height = 256, 256
+    model = 'flux'
+    seed = random.randint(0, 999999)
+    nologo = "true"
+    encoded_prompt = urllib.parse.quote(selected_prompt)
+    return f"{IMAGE_API_BASE_URL}/p/{encoded_prompt}?width={width}&height={height}&seed={seed}&model={model}&nologo={nologo}"
+
+
+async def generate_stt_and_images_async(multimodal_input):
+    """
+    Processes multimodal input to generate speech-to-text (STT) and image encodings, without blocking
+    the event loop. Audio transcription and image encoding run concurrently, and the time of each
+    stage is logged.
 
     Args:
         multimodal_input (dict or str): The input data, which can be a dictionary containing 'text' and 'files' keys,
@@ -119,15 +348,15 @@ def generate_stt_and_images(multimodal_input):
     Returns:
         tuple: A tuple containing:
             - str: The transcribed text from audio input, if available.
-            - str: The base64 encoded string of the image, if available.
+            - ImageAsset: The uploaded image, if available.
             - str: The URL of the image, if available.
 
     Raises:
         gr.Error: If the transcription or encoding services are temporarily unavailable.
     """
     stt = ""
-    encoded_image = None
-    image_url = None
+    audio_path = None
+    image_path = None
 
     if isinstance(multimodal_input, dict):
         # If the input is a dictionary, check for text and files
@@ -136,67 +365,91 @@ def generate_stt_and_images(multimodal_input):
 
         files = multimodal_input.get("files", [])
         for file_path in files:
-            # Check if the file is an audio file
-            if file_path.lower().endswith(('.mp3', '.wav')) and not stt:
-                try:
-                    # Transcribe the audio using Groq
-                    with open(file_path, "rb") as audio_file:
-                        stt = transcription_with_groq("whisper-large-v3-turbo", audio_data=audio_file)
-                except Exception:
-                    raise gr.Error("Sorry, our AI service is temporarily unavailable.")
-
-            # Check if the file is an image file
-            elif file_path.lower().endswith(('.jpg', '.jpeg', '.png')) and not encoded_image:
-                try:
-                    # Encode the image to a base64 string
-                    encoded_image = encode_image(file_path)
-                except Exception:
-                    raise gr.Error("Sorry, our AI service is temporarily unavailable.")
+            # Pick the first audio file, unless the text was typed
+            if file_path.lower().endswith(('.mp3', '.wav')) and not stt and not audio_path:
+                audio_path = file_path
+            # Pick the first image file
+            elif file_path.lower().endswith(('.jpg', '.jpeg', '.png')) and not image_path:
+                image_path = file_path
 
     elif isinstance(multimodal_input, str):
         # If the input is a string, just strip it
         stt = multimodal_input.strip()
 
-    # If we don't have an image, and we have text, generate an image
-    if not encoded_image and stt:
-        prompt_suffix = """You are an image prompt generator. Based on the medical condition provided, generate a 
-        **short, descriptive image prompt** of **5 to 6 words**, with no explanation or extra text. **Only return 
-        the prompt**. Do not include quotes, punctuation, or any introductory text."""
-        try:
-            # Call the chat completion API
-            response = client.chat.completions.create(
-                model="compound-beta-mini",
-                messages=[{"role": "user", "content": stt + prompt_suffix}]
-            )
-            # Get the generated image prompt
-            selected_prompt = response.choices[0].message.content
-
-            # Generate an image using the image generation API
-            width, height = 256, 256
-            model = 'flux'
-            seed = random.randint(0, 999999)
-            nologo = "true"
-            encoded_prompt = urllib.parse.quote(selected_prompt)
-            image_url = f"https://pollinations.ai/p/{encoded_prompt}?width={width}&height={height}&seed={seed}&model={model}&nologo={nologo}"
-        except Exception:
-            raise gr.Error("Sorry, our AI service is temporarily unavailable.")
+    async def transcribe():
+        # Transcribe the audio using Groq
+        with open(audio_path, "rb") as audio_file:
+            return await transcription_with_groq_async("whisper-large-v3-turbo", audio_data=audio_file)
+
+    # Transcription and image encoding don't depend on each other, so they run at the same time
+    tasks = []
+    try:
+        stt_task = image_task = None
+        if audio_path:
+            stt_task = asyncio.create_task(timed_stage("stt", transcribe()))
+            tasks.append(stt_task)
+        if image_path:
+            # Read the image and prepare its vision model version off the event loop
+            image_task = asyncio.create_task(
+                timed_stage("image_encode", asyncio.to_thread(encode_image_for_vision, image_path)))
+            tasks.append(image_task)
+
+        # Wait for both stages, the first failure is raised right away
+        await asyncio.gather(*tasks)
+        if stt_task:
+            stt = stt_task.result()
+        encoded_image = image_task.result() if image_task else None
+
+        # If we don't have an image, and we have text, generate an image as soon as the text is known
+        image_url = None
+        if not encoded_image and stt:
+            image_url = await timed_stage("image_prompt", generate_image_url_async(stt))
+    except Exception:
+        raise gr.Error("Sorry, our AI service is temporarily unavailable.")
+    finally:
+        # Stop the other stage if one of them failed
+        for task in tasks:
+            task.cancel()
 
     # Return the transcribed text, the encoded image, and the image URL
     return stt, encoded_image, image_url
 
 
+def generate_stt_and_images(multimodal_input):
+    """
+    Processes multimodal input to generate speech-to-text (STT) and image encodings.
+
+    Sync facade over generate_stt_and_images_async.
+
+    Args:
+        multimodal_input (dict or str): The input data, which can be a dictionary containing 'text' and 'files' keys,
+                                        or a string.
+
+    Returns:
+        tuple: A tuple containing:
+            - str: The transcribed text from audio input, if available.
+            - ImageAsset: The uploaded image, if available.
+            - str: The URL of the image, if available.
+
+    Raises:
+        gr.Error: If the transcription or encoding services are temporarily unavailable.
+    """
+    return run_sync(generate_stt_and_images_async(multimodal_input))
+
+
 def query_func(stt, encoded_image, image_url):
     """
     Generates a response to a user query based on the input text and/or image.
 
     Args:
         stt (str): The transcribed text from audio input, if available.
-        encoded_image (str): The base64 encoded string of the image, if available.
+        encoded_image (ImageAsset): The uploaded image, if available.
         image_url (str): The URL of the image, if available.
 
     Returns:
         - str: The response as a string.
-        - str: The image to display, either as a base64 encoded string or a URL.
+        - PIL.Image or str: The image to display, either as a decoded image or a URL.
+        - ImageAsset or str: The image for the report, either the uploaded image or a URL.
 
     Raises:
         gr.Error: If the analyzing or encoding services are temporarily unavailable.
@@ -204,7 +457,7 @@ def query_func(stt, encoded_image, image_url):
     try:
         # Determine the image to display based on availability of encoded image
         if encoded_image:
-            # Convert base64 string to a PIL image for display
+            # Use the asset's decoded image for display
             image_display = base64_to_pil(encoded_image)
             # Use the encoded image for reporting
             report_image = encoded_image
@@ -221,17 +474,19 @@ def query_func(stt, encoded_image, image_url):
     return stt, image_display, report_image
 
 
-def generate_response(stt, img_to_display):
+def generate_response(stt, img_to_display, request: gr.Request = None):
     """
     Generates a response to a user query based on the input text and/or image.
 
     Args:
         stt (str): The transcribed text from audio input, if available.
-        img_to_display (str): The image to display, either as a base64 encoded string or a URL.
+        img_to_display (ImageAsset): The uploaded image, if available.
+        request (gr.Request): The Gradio request, whose session owns the audio files.
 
     Returns:
-        - str: The response as a string.
         - str: The audio file to play, as a path to the file.
+        - str: The response as a string.
+        - Conversation: The conversation for the follow-ups, seeded with the query and the response.
 
     Raises:
         gr.Error: If the analyzing or encoding services are temporarily unavailable.
@@ -240,24 +495,13 @@ def generate_response(stt, img_to_display):
         # Default message if speech-to-text is unavailable
         stt = "I'm sorry, I couldn't understand your speech clearly. Please try again."
 
-    # System prompt for image analysis
-    system_prompt = """You are a professional doctor, providing educational advice. Analyze the provided image 
-    (or description) and determine if there are any visible medical concerns. If applicable, suggest possible 
-    differentials and remedies. Respond naturally, in 5 to 6 lines, without using numbers, special characters, 
-    markdown formatting, or any AI disclaimers. Speak directly to the user as if you are a real doctor. If an input 
-    description is provided, start with 'Based on your description...', if the provided image appears to be AI generated 
-    handle it by saying something like 'I have an image here...' and then follow up with 'if your condition is like 
-    this then...', if no input is provided, say 'Please upload an image or provide a description of your condition.' 
-    If you are unsure about the input, politely ask the user for clarification. Start your answer immediately, with 
-    no preamble."""
-
     # Analyze the image if provided
     if img_to_display:
         try:
             # Call analyze_image with the system prompt and image
             response_text = analyze_image(
-                query=system_prompt + stt,
-                analyzing_model="meta-llama/llama-4-maverick-17b-128e-instruct",
+                query=DOCTOR_SYSTEM_PROMPT + stt,
+                analyzing_model=ANALYZING_MODEL,
                 encoded_image=img_to_display)
         except Exception:
             # Raise an error if image analysis fails
@@ -266,28 +510,116 @@ def generate_response(stt, img_to_display):
         try:
             # Call analyze_image with only the system prompt
             response_text = analyze_image(
-                query=system_prompt + stt,
-                analyzing_model="meta-llama/llama-4-maverick-17b-128e-instruct")
+                query=DOCTOR_SYSTEM_PROMPT + stt,
+                analyzing_model=ANALYZING_MODEL)
         except Exception:
             # Raise an error if image analysis fails
             raise gr.Error("Sorry, our AI service is temporarily unavailable.")
 
     try:
         # Convert response text to speech
-        audio_data = text_to_speech(input_text=response_text)
+        audio_data = text_to_speech(input_text=response_text, session=getattr(request, "session_hash", None))
     except Exception:
         # Raise an error if text-to-speech conversion fails
         raise gr.Error("Sorry, our AI service is temporarily unavailable.")
 
-    # For history tracking
-    for_history = response_text
+    # Seed the conversation the follow-ups build on
+    conversation = Conversation.seeded(stt, response_text)
 
-    return audio_data, response_text, for_history
+    return audio_data, response_text, conversation
 
 
-def generate_followup_response(multimodal_input, history):
+async def generate_response_stream_async(stt, img_to_display, request: gr.Request = None):
     """
-    Generate a response to a user query based on the input text and/or image.
+    Streaming variant of generate_response for Gradio async generator events.
+
+    The diagnosis text is yielded as it is generated, and each complete sentence is voiced while
+    the rest of the reply is still being generated, so the first audio only waits for the first
+    sentence instead of the whole answer. Replies to a query and image seen before are served
+    from the reply cache together with their audio.
+
+    Args:
+        stt (str): The transcribed text from audio input, if available.
+        img_to_display (ImageAsset): The uploaded image, if available.
+        request (gr.Request): The Gradio request, whose session owns the audio files.
+
+    Yields:
+        tuple: A tuple containing:
+            - str or bytes: The next audio segment to play, or None if no new segment is ready.
+            - str: The response text generated so far.
+            - Conversation: The conversation seeded with the query and the full response, or gr.skip()
+              while streaming.
+
+    Raises:
+        gr.Error: If the analyzing or text-to-speech services are temporarily unavailable.
+    """
+    if not stt:
+        # Default message if speech-to-text is unavailable
+        stt = "I'm sorry, I couldn't understand your speech clearly. Please try again."
+
+    # Serve identical queries and images from the reply cache
+    cache = services.get("response_cache")
+    key = cache_key(ANALYZING_MODEL, DOCTOR_SYSTEM_PROMPT + stt, getattr(img_to_display, "digest", img_to_display))
+    cached = cache.get_response(key)
+    if cached is not None:
+        response_text, audio_data = cached
+        yield audio_data, response_text, Conversation.seeded(stt, response_text)
+        return
+
+    # Stream the analysis, with the image when one is provided
+    text_stream = analyze_image_stream_async(
+        query=DOCTOR_SYSTEM_PROMPT + stt,
+        analyzing_model=ANALYZING_MODEL,
+        encoded_image=img_to_display or None)
+
+    response_text = ""
+    audio_segments = []
+    # Voice the reply sentence by sentence while it is streaming
+    async for response_text, audio_segment in pipelined_text_to_speech_async(
+            text_stream, getattr(request, "session_hash", None)):
+        if isinstance(audio_segment, bytes):
+            # Keep the audio to cache the whole spoken reply
+            audio_segments.append(audio_segment)
+        elif audio_segment:
+            # A sentence synthesized to a file, when streaming was not available
+            with open(audio_segment, "rb") as segment_file:
+                audio_segments.append(segment_file.read())
+        yield audio_segment, response_text, gr.skip()
+
+    # MP3 frames can be concatenated, so the segments make up the whole reply
+    cache.put_response(key, response_text, b"".join(audio_segments))
+
+    # Seed the conversation the follow-ups build on, the empty audio chunk also ends the audio stream
+    yield None, response_text, Conversation.seeded(stt, response_text)
+
+
+def generate_response_stream(stt, img_to_display, request: gr.Request = None):
+    """
+    Streaming variant of generate_response for Gradio generator events.
+
+    Sync facade over generate_response_stream_async.
+
+    Args:
+        stt (str): The transcribed text from audio input, if available.
+        img_to_display (ImageAsset): The uploaded image, if available.
+        request (gr.Request): The Gradio request, whose session owns the audio files.
+
+    Yields:
+        tuple: A tuple containing:
+            - str or bytes: The next audio segment to play, or None if no new segment is ready.
+            - str: The response text generated so far.
+            - Conversation: The conversation seeded with the query and the full response, or gr.skip()
+              while streaming.
+
+    Raises:
+        gr.Error: If the analyzing or text-to-speech services are temporarily unavailable.
+    """
+    yield from iterate_sync(generate_response_stream_async(stt, img_to_display, request))
+
+
+async def generate_followup_response_async(multimodal_input, conversation):
+    """
+    Generate a response to a user query based on the input text and/or image, without blocking the event loop.
 
     Args:
         multimodal_input (dict): A dictionary containing the user's query.
@@ -295,16 +627,18 @@ def generate_followup_response(multimodal_input, history):
                 - text (str): The user's query as a string.
                 - files (list): A list of file paths to the audio/image files.
                 - image_url (str): The URL of the image.
-        history (str): The conversation history.
+        conversation (Conversation): The conversation of the session, seeded by the diagnosis.
 
     Returns:
-        list: The updated conversation history.
+        Conversation: The conversation, with the query and the response appended.
         str: The response as a string.
 
     Raises:
         gr.Error: If the analyzing or encoding services are temporarily unavailable.
     """
-    followup_his = [{"role": "assistant", "content": history}]
+    if conversation is None:
+        # A follow-up before any diagnosis starts the conversation
+        conversation = Conversation()
 
     try:
         user_query = ""
@@ -320,43 +654,43 @@ def generate_followup_response(multimodal_input, history):
                 if file_path.lower().endswith(('.mp3', '.wav')) and not user_query:
                     try:
                         with open(file_path, "rb") as audio_file:
-                            user_query = transcription_with_groq("whisper-large-v3-turbo", audio_file)
+                            user_query = await transcription_with_groq_async("whisper-large-v3-turbo", audio_file)
                     except FileNotFoundError:
-                        return followup_his, "Audio file not found. Please try again."
+                        return conversation, "Audio file not found. Please try again."
                     except Exception:
-                        return followup_his, "Error transcribing audio. Please try again."
+                        return conversation, "Error transcribing audio. Please try again."
         elif isinstance(multimodal_input, str):
             # Handle simple string input
             user_query = multimodal_input.strip()
 
         if not user_query:
             # Return error if no valid input is found
-            return followup_his, "I couldn't understand your input. Could you please try again?"
-
-        # Append user input to conversation history
-        followup_his.append({"role": "user", "content": user_query})
-
-        # Clean and format chat history for processing
-        clean_history = []
-        for msg in followup_his:
-            content = msg.get("content", "")
-            if not isinstance(content, str):
-                content = str(content)
-            clean_history.append({
-                "role": msg.get("role", "user"),
-                "content": content
-            })
+            return conversation, "I couldn't understand your input. Could you please try again?"
+
+        # Send the diagnosis and the latest turns that fit the token budget, with the new query
+        messages = conversation.context(user_query)
 
         try:
-            # Generate a response using the chat model
-            response = client.chat.completions.create(
-                model="meta-llama/llama-4-maverick-17b-128e-instruct",
-                messages=clean_history
-            )
+            async def request(model):
+                async with upstream_async("llm"):
+                    return await async_client.chat.completions.create(
+                        model=model,
+                        messages=messages
+                    )
+
+            # Generate a response using the chat model, with retries and model fallback
+            response = await call_groq_async("followup", ANALYZING_MODEL, request)
             reply = response.choices[0].message.content.strip()
-            followup_his.append({"role": "assistant", "content": reply})
+            record_payload("followup", message_bytes(messages), len(reply))
+
+            # Record the turn only once it succeeded, so a failed call leaves no unanswered query behind
+            conversation.append("user", user_query)
+            conversation.append("assistant", reply)
 
-            return clean_history, reply
+            # Fold the older follow-ups into the running summary, without delaying the reply
+            schedule_summary(conversation)
+
+            return conversation, reply
         except Exception:
             # Handle errors during response generation
             raise gr.Error("Sorry, something went wrong while generating a response.")
@@ -364,3 +698,34 @@ def generate_followup_response(multimodal_input, history):
     except Exception:
         # Handle unforeseen processing errors
         raise gr.Error("Sorry, something went wrong while processing your follow-up.")
+
+
+def generate_followup_response(multimodal_input, conversation):
+    """
+    Generate a response to a user query based on the input text and/or image.
+
+    Sync facade over generate_followup_response_async. The running summary is updated before
+    returning, its private event loop would cancel it otherwise.
+
+    Args:
+        multimodal_input (dict): A dictionary containing the user's query.
+            The dictionary should contain the following keys:
+                - text (str): The user's query as a string.
+                - files (list): A list of file paths to the audio/image files.
+                - image_url (str): The URL of the image.
+        conversation (Conversation): The conversation of the session, seeded by the diagnosis.
+
+    Returns:
+        Conversation: The conversation, with the query and the response appended.
+        str: The response as a string.
+
+    Raises:
+        gr.Error: If the analyzing or encoding services are temporarily unavailable.
+    """
+    async def followup():
+        result = await generate_followup_response_async(multimodal_input, conversation)
+        # The loop closes once this returns, so the summary scheduled in the background is awaited here
+        await wait_for_summaries()
+        return result
+
+    return run_sync(followup())
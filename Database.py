@@ -1,7 +1,122 @@
-import os
+import json
+import threading
+import time
 import gradio as gr
-from firebase_admin import firestore
-from API_Config import auth, db
+from API_Config import auth, services
+from metrics import counter, histogram
+from patient_repository import RING_FIELD, user_key
+from report_store import render_report_link
+from response_cache import cache_key
+
+auth_request_seconds = histogram("firebase_auth_seconds", "Latency of Firebase auth calls, by operation and outcome.")
+auth_errors = counter("firebase_auth_errors_total", "Failed Firebase auth calls, by operation and error type.")
+
+# Invalidation counters of the login cache, one per stripe of users, so their number stays bounded
+DASHBOARD_STRIPES = 1024
+_dashboard_generations = [0] * DASHBOARD_STRIPES
+_generations_lock = threading.Lock()
+
+
+def _call_auth(operation, email, password):
+    """
+    Calls a Firebase auth operation, recording its latency and errors.
+
+    Args:
+        operation (str): The pyrebase auth method, e.g. "sign_in_with_email_and_password".
+        email (str): The email of the user.
+        password (str): The password of the user.
+
+    Returns:
+        dict: The pyrebase user.
+    """
+    start = time.perf_counter()
+    try:
+        user = getattr(auth, operation)(email, password)
+    except Exception as e:
+        auth_request_seconds.observe(time.perf_counter() - start, operation=operation, outcome="error")
+        auth_errors.inc(operation=operation, error=type(e).__name__)
+        raise
+    auth_request_seconds.observe(time.perf_counter() - start, operation=operation, outcome="ok")
+    return user
+
+
+def _dashboard_key(user_doc_name):
+    """Returns the login cache key of a user."""
+    return cache_key("login", user_doc_name)
+
+
+def _dashboard_stripe(user_doc_name):
+    """Returns the index of the invalidation counter covering a user."""
+    return hash(user_doc_name) % DASHBOARD_STRIPES
+
+
+def load_dashboard(user_doc_name):
+    """
+    Reads a user's name and latest report metadata, from the login cache when possible.
+
+    A dashboard read while the user's data was invalidated may predate the change, so it is
+    returned but not cached.
+
+    Args:
+        user_doc_name (str): The patient document id.
+
+    Returns:
+        dict: The user's "name", and the metadata of their latest 5 "reports", newest first.
+
+    Raises:
+        gr.Error: If the user document does not exist.
+    """
+    cache = services.get("login_cache")
+    key = _dashboard_key(user_doc_name)
+    cached = cache.get(key)
+    if cached is not None:
+        return json.loads(cached)
+
+    stripe = _dashboard_stripe(user_doc_name)
+    generation = _dashboard_generations[stripe]
+    dashboard = fetch_dashboard(user_doc_name)
+    # Firestore may return timestamps in legacy documents, which are cached as strings
+    encoded = json.dumps(dashboard, default=str).encode("utf-8")
+    with _generations_lock:
+        # Checked and cached atomically, so an invalidation either skips this put or deletes its entry
+        if _dashboard_generations[stripe] == generation:
+            cache.put(key, encoded)
+    return dashboard
+
+
+def fetch_dashboard(user_doc_name):
+    """
+    Reads a user's name and latest report metadata from the patient repository, in one combined call.
+
+    With Firestore, both reads run at the same time.
+
+    Args:
+        user_doc_name (str): The patient document id.
+
+    Returns:
+        dict: The user's "name", and the metadata of their latest 5 "reports", newest first.
+
+    Raises:
+        gr.Error: If the user document does not exist.
+    """
+    # Get user data (name + email) and the latest 5 reports ordered by date
+    patient, reports = services.get("patients").get_dashboard(user_doc_name, 5)
+    if patient is None:
+        raise gr.Error("User data not found. Please contact support.")
+    return {"name": patient.get('name', ''), "reports": reports}
+
+
+def invalidate_dashboard(user_doc_name):
+    """
+    Drops a user's cached login data, after their profile or reports changed.
+
+    Args:
+        user_doc_name (str): The patient document id.
+    """
+    with _generations_lock:
+        # Logins reading the dashboard right now won't cache what they read
+        _dashboard_generations[_dashboard_stripe(user_doc_name)] += 1
+    services.get("login_cache").delete(_dashboard_key(user_doc_name))
 
 
 def register(name, email, password, verify_pass):
@@ -25,14 +140,17 @@ def register(name, email, password, verify_pass):
         # Check if password verification matches
         if verify_pass == password:
             # Create a new user with email and password
-            user = auth.create_user_with_email_and_password(email, password)
+            user = _call_auth("create_user_with_email_and_password", email, password)
 
-            # Firestore: Create user document using email as document ID
-            user_doc_name = email.replace(".com", "").lower()
-            db.collection("Patients").document(user_doc_name).set({
+            # Create the patient record, keyed by email, with an empty ring of kept reports so that
+            # saving a report never needs the legacy compaction
+            user_doc_name = user_key(email)
+            services.get("patients").put_patient(user_doc_name, {
                 'name': name,
-                'email': email
+                'email': email,
+                RING_FIELD: []
             })
+            invalidate_dashboard(user_doc_name)
 
             # Inform user of successful registration
             gr.Info("Account registered, Login to continue.")
@@ -70,33 +188,22 @@ def login_auth(email=None, password=None):
 
     # Perform login with Firebase
     try:
-        user = auth.sign_in_with_email_and_password(email, password)
+        user = _call_auth("sign_in_with_email_and_password", email, password)
 
         # Inform user of successful login
         gr.Info("Login successful.")
 
-        # Firestore: Get user document using email as document ID
-        user_doc_name = email.replace(".com", "").lower()
-        user_ref = db.collection("Patients").document(user_doc_name)
-
-        # Get user data (name + email)
-        user_doc = user_ref.get()
-        if user_doc.exists:
-            user_data = user_doc.to_dict()
-            name = user_data.get('name', '')
-        else:
-            raise gr.Error("User data not found in Firestore. Please contact support.")
-
-        # Get latest 5 reports ordered by Firestore's document ID (timestamp part)
-        reports_ref = user_ref.collection("Reports").order_by("date", direction=firestore.Query.DESCENDING).limit(5)
-        reports = reports_ref.stream()
+        # Get the user's name and latest reports using email as the key, cached between logins
+        user_doc_name = user_key(email)
+        dashboard = load_dashboard(user_doc_name)
+        name = dashboard["name"]
 
-        # Build a list of report links
+        # Build a list of report links from the report metadata, signed links are made fresh on each login
         links_html = ""
         report_list = []
-        for r in reports:
-            report_data = r.to_dict()
-            report_list.append(report_data.get("report_link", ""))
+        store = services.get("report_store")
+        for report_data in dashboard["reports"]:
+            report_list.append(render_report_link(report_data, store))
 
         # Handle no reports
         if not report_list:
@@ -1,15 +1,47 @@
 # Setup Text to Speech TTS (gtts) and use Pygame for Voice output
 import os
 import gradio as gr
-import tempfile
-from API_Config import client
+import asyncio
+import re
+import time
+from collections import deque
+from API_Config import async_client, services
+from concurrency import run_sync, upstream_async
+from groq_resilience import call_groq_async, record_payload
+from metrics import counter, histogram
 
+# Sentence chunks shorter than this are merged with the next one to avoid tiny TTS calls
+MIN_SENTENCE_CHARS = 20
+
+# A sentence ends at '.', '!' or '?' (optionally followed by closing quotes/brackets) and whitespace
+SENTENCE_END = re.compile(r'[.!?]+["\')\]]*\s+')
+
+# Whether the TTS audio is streamed to the client from memory, instead of written to a file first
+TTS_STREAMING = os.environ.get("TTS_STREAMING", "1") != "0"
+
+# Least bytes of whole MP3 frames handed to Gradio at once, each chunk is decoded on its own
+STREAM_CHUNK_BYTES = int(os.environ.get("TTS_STREAM_CHUNK_BYTES", 16 * 1024))
+
+# Bitrates (kbps) and sample rates (Hz) of MPEG audio Layer III frames, by header index
+MP3_BITRATES = {
+    1: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),  # MPEG-1
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),  # MPEG-2 and 2.5
+}
+MP3_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+# Time from the start of a streamed reply until its first audio segment is ready
+time_to_first_audio = histogram(
+    "tts_time_to_first_audio_seconds", "Time until the first synthesized audio segment of a reply is ready.")
+tts_stream_fallbacks = counter(
+    "tts_stream_fallbacks_total", "Sentences synthesized to a file because streaming the audio failed.")
 
-def text_to_speech(input_text):
-    """Generate an audio file from given text using Groq's TTS service.
+
+async def text_to_speech_async(input_text, session=None):
+    """Generate an audio file from given text using Groq's TTS service, without blocking the event loop.
 
     Args:
         input_text (str): The text to be converted to speech.
+        session (str): The Gradio session hash the audio belongs to, deleted with the session.
 
     Returns:
         str: The path to the generated audio file.
@@ -18,24 +50,330 @@ def text_to_speech(input_text):
         gr.Error: if the TTS service is temporarily unavailable.
     """
     try:
-        # Create speech synthesis request with Groq's TTS service
-        response = client.audio.speech.create(
-            model="playai-tts",
-            voice="Aaliyah-PlayAI",
-            response_format="mp3",
-            input=input_text
-        )
-
-        # Get the audio data
-        mp3_data = response.read()
-
-        # Create a temporary file to store the audio data
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as tmpfile:
-            tmpfile.write(mp3_data)
-            tmpfile_path = tmpfile.name
-
-        # Return the path to the temporary file
-        return tmpfile_path
+        async def request(model):
+            async with upstream_async("tts"):
+                response = await async_client.audio.speech.create(
+                    model=model,
+                    voice="Aaliyah-PlayAI",
+                    response_format="mp3",
+                    input=input_text
+                )
+                # Get the audio data
+                return await response.read()
+
+        # Create speech synthesis request with Groq's TTS service, with retries
+        mp3_data = await call_groq_async("tts", "playai-tts", request)
+        record_payload("tts", len(input_text), len(mp3_data))
+
+        # Store the audio data in the managed audio store, which deletes it once it is no longer needed
+        return services.get("audio_store").write(mp3_data, session)
     except Exception:
         # If there is any error, raise a gr.Error, indicating that the AI service is unavailable
         raise gr.Error("Sorry, our AI service is temporarily unavailable.")
+
+
+def text_to_speech(input_text, session=None):
+    """Generate an audio file from given text using Groq's TTS service.
+
+    Sync facade over text_to_speech_async.
+
+    Args:
+        input_text (str): The text to be converted to speech.
+        session (str): The Gradio session hash the audio belongs to, deleted with the session.
+
+    Returns:
+        str: The path to the generated audio file.
+
+    Raises:
+        gr.Error: if the TTS service is temporarily unavailable.
+    """
+    return run_sync(text_to_speech_async(input_text, session))
+
+
+def mp3_frame_length(header):
+    """Returns the length of the MPEG Layer III frame starting with a 4-byte header, or None if it is not one.
+
+    Args:
+        header (bytes): The first 4 bytes of the frame.
+
+    Returns:
+        int: The frame length in bytes, or None.
+    """
+    if len(header) < 4 or header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        return None
+    version = (header[1] >> 3) & 0x03
+    layer = (header[1] >> 1) & 0x03
+    bitrate_index = header[2] >> 4
+    sample_rate_index = (header[2] >> 2) & 0x03
+    # Reserved version, not Layer III, free or bad bitrate, reserved sample rate
+    if version == 1 or layer != 1 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+    bitrate = MP3_BITRATES[1 if version == 3 else 2][bitrate_index] * 1000
+    sample_rate = MP3_SAMPLE_RATES[version][sample_rate_index]
+    padding = (header[2] >> 1) & 0x01
+    return (144 if version == 3 else 72) * bitrate // sample_rate + padding
+
+
+class Mp3FrameSplitter:
+    """Cuts a streamed MP3 into chunks of whole frames, which Gradio can decode one by one.
+
+    Data that does not parse as MP3 frames is held back and returned whole by flush().
+    """
+
+    def __init__(self, min_bytes=STREAM_CHUNK_BYTES):
+        self.min_bytes = min_bytes
+        self._buffer = bytearray()
+        self._offset = 0  # end of the whole frames parsed so far
+        self._parsable = True
+
+    def _skip_id3(self):
+        """Steps over an ID3v2 tag at the start of the stream. Returns False until the whole tag is buffered."""
+        if self._offset or not self._buffer.startswith(b"ID3"):
+            return True
+        if len(self._buffer) < 10:
+            return False
+        size = 0
+        for byte in self._buffer[6:10]:
+            # The tag size is a "syncsafe" integer, 7 bits per byte
+            size = (size << 7) | (byte & 0x7F)
+        size += 20 if self._buffer[5] & 0x10 else 10
+        if len(self._buffer) < size:
+            return False
+        self._offset = size
+        return True
+
+    def feed(self, data):
+        """Adds data, and returns the whole frames buffered once they reach min_bytes, or b"".
+
+        Args:
+            data (bytes): The next bytes of the stream.
+
+        Returns:
+            bytes: A chunk of whole frames, or b"" if not enough data is buffered yet.
+        """
+        self._buffer += data
+        if not self._parsable or not self._skip_id3():
+            return b""
+        # Walk the frame headers as far as the buffered data goes
+        while self._offset + 4 <= len(self._buffer):
+            length = mp3_frame_length(self._buffer[self._offset:self._offset + 4])
+            if length is None:
+                # Not a frame header, give up on splitting and hand over the audio in one piece
+                self._parsable = False
+                return b""
+            if self._offset + length > len(self._buffer):
+                break
+            self._offset += length
+        if self._offset < self.min_bytes:
+            return b""
+        chunk = bytes(self._buffer[:self._offset])
+        del self._buffer[:self._offset]
+        self._offset = 0
+        return chunk
+
+    def flush(self):
+        """Returns everything still buffered, at the end of the stream."""
+        chunk = bytes(self._buffer)
+        self._buffer.clear()
+        self._offset = 0
+        return chunk
+
+
+async def text_to_speech_stream_async(input_text, session=None):
+    """Streams the speech for a text from Groq's TTS service, as chunks of whole MP3 frames.
+
+    The audio goes to the client as it arrives, without a temporary file or buffering the whole
+    reply. If streaming is disabled, or fails before any audio arrived, the audio is written to
+    a file instead and its path is yielded.
+
+    Args:
+        input_text (str): The text to be converted to speech.
+        session (str): The Gradio session hash the audio file belongs to, if one is written.
+
+    Yields:
+        bytes or str: The next chunk of MP3 audio, or the path to the whole audio file.
+
+    Raises:
+        gr.Error: if the TTS service is temporarily unavailable.
+    """
+    if not TTS_STREAMING:
+        yield await text_to_speech_async(input_text, session)
+        return
+
+    async with upstream_async("tts"):
+        async def request(model):
+            # The request is sent when the response context is entered, errors are retried from here
+            manager = async_client.audio.speech.with_streaming_response.create(
+                model=model,
+                voice="Aaliyah-PlayAI",
+                response_format="mp3",
+                input=input_text
+            )
+            return manager, await manager.__aenter__()
+
+        try:
+            manager, response = await call_groq_async("tts_stream", "playai-tts", request)
+        except Exception:
+            response = None
+
+        if response is not None:
+            splitter = Mp3FrameSplitter()
+            streamed = False
+            received = 0
+            try:
+                async for data in response.iter_bytes():
+                    received += len(data)
+                    chunk = splitter.feed(data)
+                    if chunk:
+                        streamed = True
+                        yield chunk
+                chunk = splitter.flush()
+                if chunk:
+                    yield chunk
+                record_payload("tts_stream", len(input_text), received)
+                return
+            except Exception:
+                if streamed:
+                    # Part of the sentence was played already, it can't be synthesized again
+                    raise gr.Error("Sorry, our AI service is temporarily unavailable.")
+            finally:
+                await manager.__aexit__(None, None, None)
+
+    # Streaming is not available, synthesize the sentence to a file instead
+    tts_stream_fallbacks.inc()
+    yield await text_to_speech_async(input_text, session)
+
+
+def split_sentences(buffer):
+    """Splits the complete sentences off the front of a streamed text buffer.
+
+    Sentences shorter than MIN_SENTENCE_CHARS are joined with the following ones.
+
+    Args:
+        buffer (str): The text received so far that has not been sent to TTS yet.
+
+    Returns:
+        tuple: A tuple containing:
+            - list: The complete sentence chunks, in order.
+            - str: The trailing text that does not end a sentence yet.
+    """
+    sentences = []
+    start = 0
+    for match in SENTENCE_END.finditer(buffer):
+        chunk = buffer[start:match.end()].strip()
+        # Keep short sentences in the buffer so they are spoken with the next one
+        if len(chunk) < MIN_SENTENCE_CHARS:
+            continue
+        sentences.append(chunk)
+        start = match.end()
+    return sentences, buffer[start:]
+
+
+class _SentenceAudio:
+    """The audio of one sentence, streamed into a queue by a background task."""
+
+    _END = object()
+
+    def __init__(self, sentence, session):
+        self.queue = asyncio.Queue()
+        self.task = asyncio.create_task(self._produce(sentence, session))
+
+    async def _produce(self, sentence, session):
+        try:
+            async for chunk in text_to_speech_stream_async(sentence, session):
+                self.queue.put_nowait(chunk)
+        except Exception as e:
+            # Handed over to the consumer, which raises it in sentence order
+            self.queue.put_nowait(e)
+        self.queue.put_nowait(self._END)
+
+    def _unwrap(self, item):
+        """Returns the chunk, None at the end of the sentence, or raises the error of the task."""
+        if item is self._END:
+            return None
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def ready(self):
+        """Returns the chunks received so far without waiting, and whether the sentence is complete."""
+        chunks = []
+        while not self.queue.empty():
+            chunk = self._unwrap(self.queue.get_nowait())
+            if chunk is None:
+                return chunks, True
+            chunks.append(chunk)
+        return chunks, False
+
+    async def next(self):
+        """Waits for the next chunk, or returns None at the end of the sentence."""
+        return self._unwrap(await self.queue.get())
+
+
+async def pipelined_text_to_speech_async(text_stream, session=None):
+    """Synthesizes a streamed reply sentence by sentence while the text is still being generated.
+
+    Each complete sentence is sent to TTS as its own task as soon as it arrives, and its audio is
+    yielded as it streams in, in sentence order. The number of concurrent TTS calls is bounded
+    by the "tts" upstream limiter.
+
+    Args:
+        text_stream (async iterable): The reply text, as a stream of string pieces.
+        session (str): The Gradio session hash the audio belongs to, deleted with the session.
+
+    Yields:
+        tuple: A tuple containing:
+            - str: The reply text received so far.
+            - bytes or str: The next chunk of MP3 audio or path to an audio file, or None if no
+              new audio is ready.
+
+    Raises:
+        gr.Error: if the TTS service is temporarily unavailable.
+    """
+    start = time.perf_counter()
+    first_audio = True
+    pending = deque()  # The audio of the sentences, in sentence order
+    text = ""
+    buffer = ""
+
+    def audio_ready(chunk):
+        nonlocal first_audio
+        if first_audio:
+            time_to_first_audio.observe(time.perf_counter() - start)
+            first_audio = False
+        return chunk
+
+    try:
+        async for delta in text_stream:
+            text += delta
+            buffer += delta
+            # Send every complete sentence to TTS right away
+            sentences, buffer = split_sentences(buffer)
+            for sentence in sentences:
+                pending.append(_SentenceAudio(sentence, session))
+            yield text, None
+
+            # Hand over the audio that already arrived, keeping the sentence order
+            while pending:
+                chunks, complete = pending[0].ready()
+                for chunk in chunks:
+                    yield text, audio_ready(chunk)
+                if not complete:
+                    break
+                pending.popleft()
+
+        # Speak whatever is left after the last sentence boundary
+        if buffer.strip():
+            pending.append(_SentenceAudio(buffer.strip(), session))
+
+        # Stream the remaining audio in order
+        while pending:
+            chunk = await pending[0].next()
+            if chunk is None:
+                pending.popleft()
+                continue
+            yield text, audio_ready(chunk)
+    finally:
+        # Drop queued work if the consumer went away before the reply finished
+        for sentence_audio in pending:
+            sentence_audio.task.cancel()
@@ -1,10 +1,20 @@
 import gradio as gr
 import os
-from API_Config import client
+from API_Config import async_client
+from concurrency import run_sync, upstream_async
+from groq_resilience import call_groq_async, record_payload
 
 
-def transcription_with_groq(stt_model, audio_data):
-    """Transcribes audio data using the specified speech-to-text model.
+def _audio_size(audio_data):
+    """Returns the size of an audio file in bytes, or None if it is not a file."""
+    try:
+        return os.fstat(audio_data.fileno()).st_size
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+async def transcription_with_groq_async(stt_model, audio_data):
+    """Transcribes audio data using the specified speech-to-text model, without blocking the event loop.
 
     Args:
         stt_model (str): The speech-to-text model to use for transcription.
@@ -17,13 +27,39 @@ def transcription_with_groq(stt_model, audio_data):
         gr.Error: If the transcription service is temporarily unavailable.
     """
     try:
-        # Attempt to create a transcription using the specified model and audio data
-        transcription = client.audio.transcriptions.create(
-            model=stt_model,  # Specify the model for transcription
-            file=audio_data,  # Provide the audio file for transcription
-            language="en"     # Set the language to English
-        )
+        async def request(model):
+            # Rewind the audio, a retry must upload it again from the start
+            if hasattr(audio_data, "seek"):
+                audio_data.seek(0)
+            async with upstream_async("stt"):
+                return await async_client.audio.transcriptions.create(
+                    model=model,      # Specify the model for transcription
+                    file=audio_data,  # Provide the audio file for transcription
+                    language="en"     # Set the language to English
+                )
+
+        # Attempt to create a transcription, with retries and model fallback
+        transcription = await call_groq_async("transcription", stt_model, request)
+        record_payload("transcription", _audio_size(audio_data), len(transcription.text))
         return transcription.text  # Return the transcribed text
     except Exception:
         # Raise an error if the transcription service is unavailable
         raise gr.Error("Sorry, our AI service is temporarily unavailable.")
+
+
+def transcription_with_groq(stt_model, audio_data):
+    """Transcribes audio data using the specified speech-to-text model.
+
+    Sync facade over transcription_with_groq_async.
+
+    Args:
+        stt_model (str): The speech-to-text model to use for transcription.
+        audio_data (file-like object): The audio data to transcribe.
+
+    Returns:
+        str: The transcribed text from the audio data.
+
+    Raises:
+        gr.Error: If the transcription service is temporarily unavailable.
+    """
+    return run_sync(transcription_with_groq_async(stt_model, audio_data))
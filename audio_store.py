@@ -0,0 +1,193 @@
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+import gradio as gr
+from API_Config import services
+from metrics import gauge
+
+# Directory holding the synthesized replies, one subdirectory per session
+AUDIO_DIR = os.environ.get("TTS_AUDIO_DIR") or os.path.join(tempfile.gettempdir(), "drchat-audio")
+
+# Most bytes of audio kept on disk, the oldest files are deleted beyond it
+AUDIO_MAX_BYTES = int(os.environ.get("TTS_AUDIO_MAX_BYTES", 256 * 1024 * 1024))
+
+# Seconds an audio file is kept, long enough for the reply to be played and replayed
+AUDIO_MAX_AGE = float(os.environ.get("TTS_AUDIO_MAX_AGE", 3600))
+
+# Seconds between two sweeps of the expired files
+AUDIO_SWEEP_INTERVAL = float(os.environ.get("TTS_AUDIO_SWEEP_INTERVAL", 300))
+
+# Files written outside of a Gradio session, e.g. by the sync facades
+SHARED_SESSION = "shared"
+
+logger = logging.getLogger(__name__)
+
+audio_bytes = gauge("tts_audio_bytes", "Bytes of synthesized audio kept on disk.")
+audio_files = gauge("tts_audio_files", "Synthesized audio files kept on disk.")
+
+
+class AudioStore:
+    """
+    Owns the mp3 files of the synthesized replies, and deletes them when they are no longer needed.
+
+    Files are deleted when their session is cleared or closed, when they are older than max_age,
+    and, oldest first, when the store holds more than max_bytes. Files left by a previous run are
+    picked up on start, so the sweeper deletes them too.
+    """
+
+    def __init__(self, root=AUDIO_DIR, max_bytes=AUDIO_MAX_BYTES, max_age=AUDIO_MAX_AGE,
+                 sweep_interval=AUDIO_SWEEP_INTERVAL):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._files = OrderedDict()  # path -> (size, created), oldest first
+        self._size = 0
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._adopt_existing()
+        audio_bytes.set_function(lambda: self._size)
+        audio_files.set_function(lambda: len(self._files))
+        if sweep_interval:
+            threading.Thread(target=self._sweep_forever, args=(sweep_interval,), name="audio-sweeper",
+                             daemon=True).start()
+
+    def _adopt_existing(self):
+        """Indexes the files left by a previous run, oldest first."""
+        found = []
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                found.append((stat.st_mtime, path, stat.st_size))
+        for created, path, size in sorted(found):
+            self._files[path] = (size, created)
+            self._size += size
+
+    def _session_dir(self, session):
+        """Returns a session's directory. The session hash comes from the browser, so it is never used as is."""
+        if not session:
+            return os.path.join(self.root, SHARED_SESSION)
+        if not re.fullmatch(r"[A-Za-z0-9_-]{1,64}", session):
+            session = hashlib.sha256(session.encode("utf-8")).hexdigest()
+        return os.path.join(self.root, session)
+
+    def write(self, data, session=None, suffix=".mp3"):
+        """
+        Writes an audio file for a session.
+
+        Args:
+            data (bytes): The audio.
+            session (str): The Gradio session hash, if any.
+            suffix (str): The file extension.
+
+        Returns:
+            str: The path to the file.
+        """
+        directory = self._session_dir(session)
+        path = os.path.join(directory, uuid.uuid4().hex + suffix)
+        try:
+            f = open(path, "wb")
+        except FileNotFoundError:
+            # First file of the session, or its directory was removed by a release meanwhile
+            os.makedirs(directory, exist_ok=True)
+            f = open(path, "wb")
+        with f:
+            f.write(data)
+        with self._lock:
+            self._files[path] = (len(data), time.time())
+            self._size += len(data)
+            # Keep within the size budget, the oldest files go first
+            evicted = []
+            while self._size > self.max_bytes and len(self._files) > 1:
+                evicted.append(self._forget(next(iter(self._files))))
+        self._delete(evicted)
+        return path
+
+    def release_session(self, session):
+        """
+        Deletes every file of a session, when it is cleared or closed.
+
+        Args:
+            session (str): The Gradio session hash.
+
+        Returns:
+            int: The number of files deleted.
+        """
+        if not session:
+            return 0
+        directory = self._session_dir(session)
+        with self._lock:
+            paths = [self._forget(path) for path in list(self._files) if os.path.dirname(path) == directory]
+        self._delete(paths)
+        return len(paths)
+
+    def sweep(self):
+        """
+        Deletes the files older than max_age.
+
+        Returns:
+            int: The number of files deleted.
+        """
+        cutoff = time.time() - self.max_age
+        with self._lock:
+            expired = []
+            # Files are indexed oldest first, so the sweep stops at the first fresh one
+            for path, (_, created) in self._files.items():
+                if created > cutoff:
+                    break
+                expired.append(path)
+            expired = [self._forget(path) for path in expired]
+        self._delete(expired)
+        return len(expired)
+
+    def _forget(self, path):
+        """Removes a file from the index. The caller holds the lock."""
+        size, _ = self._files.pop(path)
+        self._size -= size
+        return path
+
+    def _delete(self, paths):
+        """Deletes files outside of the lock, and the session directories they leave empty."""
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                logger.exception("Could not delete audio file %s", path)
+        for directory in {os.path.dirname(path) for path in paths} - {self.root}:
+            try:
+                # Fails, and keeps the directory, while the session still has files
+                os.rmdir(directory)
+            except OSError:
+                pass
+
+    def _sweep_forever(self, interval):
+        """Sweeps the expired files periodically, on the background thread."""
+        while True:
+            time.sleep(interval)
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception("Audio sweep failed")
+
+
+def release_session_audio(request: gr.Request = None):
+    """
+    Deletes the audio files of the session making a Gradio request.
+
+    Args:
+        request (gr.Request): The request, or None outside of Gradio.
+    """
+    session = getattr(request, "session_hash", None)
+    if session:
+        services.get("audio_store").release_session(session)
@@ -0,0 +1,396 @@
+"""
+Offline benchmarks for the app's hot paths, run against local stub servers.
+
+Usage:
+    python benchmark.py vision [IMAGE ...] [--bandwidth-mbps 20] [--runs 5]
+    python benchmark.py pdf [--latency 0.5] [--runs 10]
+    python benchmark.py login [--latency 0.05] [--runs 20]
+    python benchmark.py persistence [--users 200] [--reports 20]
+"""
+import argparse
+import base64
+import json
+import os
+import statistics
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+from PIL import Image, ImageFilter
+from image_asset import ImageAsset
+
+
+class StubServer:
+    """
+    A local HTTP server answering requests from a route table, with simulated latency and bandwidth.
+
+    Each route maps (method, path) to a function taking the request body and returning
+    (status, content_type, body), or (status, content_type, body, headers) to send extra headers.
+    A path ending with "/*" matches every path under it. The body is bytes, or an iterable of
+    bytes chunks streamed as they are produced.
+    """
+
+    def __init__(self, routes, latency=0.0, upload_bandwidth=None):
+        self.routes = routes
+        self.latency = latency
+        self.upload_bandwidth = upload_bandwidth  # bytes per second, None for unlimited
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        """The base URL of the running server."""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _handle(self, method):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                # Simulate the client's uplink and the service's processing time
+                delay = stub.latency
+                if stub.upload_bandwidth:
+                    delay += len(body) / stub.upload_bandwidth
+                if delay:
+                    time.sleep(delay)
+                path = self.path.split("?")[0]
+                route = stub.routes.get((method, path)) or stub.routes.get((method, path.rsplit("/", 1)[0] + "/*"))
+                if route is None:
+                    status, content_type, payload, headers = 404, "text/plain", b"not found", {}
+                else:
+                    status, content_type, payload, *extra = route(body)
+                    headers = extra[0] if extra else {}
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                if isinstance(payload, bytes):
+                    self.send_header("Content-Length", str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+                    return
+                # A streamed body has no length, closing the connection ends it
+                self.send_header("Connection", "close")
+                self.end_headers()
+                for chunk in payload:
+                    self.wfile.write(chunk)
+                    self.wfile.flush()
+                self.close_connection = True
+
+            def do_GET(self):
+                self._handle("GET")
+
+            def do_POST(self):
+                self._handle("POST")
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def json_route(payload):
+    """Returns a route answering every request with the given JSON payload."""
+    encoded = json.dumps(payload).encode("utf-8")
+    return lambda body: (200, "application/json", encoded)
+
+
+def synthetic_photo(directory, width=4000, height=3000):
+    """
+    Writes a 12 MP photo-like JPEG with EXIF data to a directory.
+
+    Args:
+        directory (str): The directory to write to, e.g. a TemporaryDirectory removed after the benchmark.
+        width (int): The image width.
+        height (int): The image height.
+
+    Returns:
+        str: The path to the image.
+    """
+    image = Image.effect_noise((width // 8, height // 8), 40).convert("RGB")
+    image = image.resize((width, height), Image.BICUBIC).filter(ImageFilter.GaussianBlur(2))
+    exif = Image.Exif()
+    exif[0x0110] = "Phone Camera"  # Model
+    exif[0x0112] = 6  # Orientation: rotate 90 degrees
+    path = os.path.join(directory, f"synthetic_{width}x{height}.jpg")
+    image.save(path, format="JPEG", quality=95, exif=exif)
+    return path
+
+
+def percentile(values, p):
+    """Returns the p-th percentile of the values, using the nearest rank."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))]
+
+
+def bench_vision(paths, bandwidth_mbps, runs, model_latency):
+    """
+    Compares vision request payloads built from the original upload with the preprocessed image.
+
+    Each run builds the chat completion request from the image file and posts it to a stub
+    endpoint that simulates the uplink bandwidth and the model latency. Building the request,
+    which includes the preprocessing, and sending it are timed separately.
+    """
+    completion = {"choices": [{"message": {"role": "assistant", "content": "ok"}}]}
+    routes = {("POST", "/openai/v1/chat/completions"): json_route(completion)}
+    with StubServer(routes, latency=model_latency, upload_bandwidth=bandwidth_mbps * 125000) as stub, \
+            requests.Session() as session:
+        url = stub.url + "/openai/v1/chat/completions"
+
+        def original_uri(path):
+            # The previous behaviour: the uploaded file, base64 encoded as is
+            with open(path, "rb") as f:
+                return f"data:image/jpeg;base64,{base64.b64encode(f.read()).decode('utf-8')}"
+
+        def vision_uri(path):
+            return ImageAsset.from_path(path).vision.data_uri
+
+        print(f"{'image':<28} {'mode':<10} {'payload KB':>11} {'prep p50 s':>11} {'send p50 s':>11} "
+              f"{'p50 s':>8} {'max s':>8}")
+        for path in paths:
+            for mode, build_uri in (("original", original_uri), ("prepared", vision_uri)):
+                preps, sends, timings = [], [], []
+                for _ in range(runs):
+                    start = time.perf_counter()
+                    body = json.dumps({
+                        "model": "meta-llama/llama-4-maverick-17b-128e-instruct",
+                        "messages": [{"role": "user", "content": [
+                            {"type": "text", "text": "Describe the image."},
+                            {"type": "image_url", "image_url": {"url": build_uri(path)}}]}]
+                    }).encode("utf-8")
+                    built = time.perf_counter()
+                    # The upload and the model time, as the stub simulates them
+                    session.post(url, data=body, headers={"Content-Type": "application/json"}).raise_for_status()
+                    end = time.perf_counter()
+                    preps.append(built - start)
+                    sends.append(end - built)
+                    timings.append(end - start)
+                name = path if len(path) <= 28 else "..." + path[-25:]
+                print(f"{name:<28} {mode:<10} {len(body) / 1024:>11.1f} {statistics.median(preps):>11.3f} "
+                      f"{statistics.median(sends):>11.3f} {statistics.median(timings):>8.3f} {max(timings):>8.3f}")
+
+
+def sample_report_payload(image):
+    """Returns a report payload like the one generate_report builds, with the given image embedded."""
+    paragraph = ("The patient reports an itchy, red rash on the forearm that appeared three days ago "
+                 "after gardening, with mild swelling and no fever. ")
+    return {
+        "name": "Jane Doe",
+        "email": "jane@example.com",
+        "date": "October 17, 2026",
+        "Symptoms": f"<p>{paragraph * 3}</p><ul><li>Itching</li><li>Redness</li><li>Mild swelling</li></ul>",
+        "Observations": f"<p>{paragraph * 4}</p>",
+        "Recommendations": f"<p>{paragraph * 2}</p><ol><li>Wash the area</li><li>Apply a cold compress</li></ol>",
+        "Image": f'<img src="data:image/jpeg;base64,{image.jpeg_base64}">',
+    }
+
+
+def bench_pdf(latency, runs):
+    """
+    Compares the remote PDF API, served by a stub with the given latency per request, with local rendering.
+
+    Each renderer is timed without its cache, then once more through the cache with the same payload.
+    """
+    from API_Config import services
+    from pdf_renderer import CachedPdfRenderer, LocalPdfRenderer, RemotePdfRenderer
+    from response_cache import ContentCache
+
+    with tempfile.TemporaryDirectory() as directory:
+        photo = ImageAsset.from_path(synthetic_photo(directory, 1600, 1200))
+    payload = sample_report_payload(photo)
+    local = LocalPdfRenderer()
+    # The stub answers with a PDF of the same size as the local one
+    pdf_bytes = local.render(payload, photo)
+    routes = {("GET", "/download.pdf"): lambda body: (200, "application/pdf", pdf_bytes)}
+    with StubServer(routes, latency=latency) as stub:
+        routes[("POST", "/v2/create-pdf")] = json_route({"status": "success", "download_url": stub.url + "/download.pdf"})
+        services.override("pdf_api_key", "benchmark")
+        remote = RemotePdfRenderer(base_url=stub.url)
+
+        print(f"{'renderer':<16} {'PDF KB':>8} {'p50 s':>8} {'p95 s':>8}")
+        for name, renderer in (("remote", remote), ("local", local),
+                               ("local, cached", CachedPdfRenderer(local, ContentCache("pdf-benchmark")))):
+            timings = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                output = renderer.render(payload, photo)
+                timings.append(time.perf_counter() - start)
+            print(f"{name:<16} {len(output) / 1024:>8.1f} {statistics.median(timings):>8.4f} "
+                  f"{percentile(timings, 95):>8.4f}")
+
+
+class FakeFirestore:
+    """
+    A stand-in for the Firestore client, holding documents in memory and adding a round-trip
+    latency to every read, like the Firestore emulator or a nearby region would.
+    """
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.docs = {}  # path tuple -> document data
+        self.reads = 0
+        self._lock = threading.Lock()
+
+    def _read(self):
+        with self._lock:
+            self.reads += 1
+        time.sleep(self.latency)
+
+    def collection(self, name, parent=()):
+        firestore = self
+
+        class Query:
+            def __init__(self, path, order=None, count=None):
+                self.path, self.order, self.count = path, order, count
+
+            def document(self, doc_id):
+                return Document(self.path + (doc_id,))
+
+            def order_by(self, field, direction="ASCENDING"):
+                return Query(self.path, (field, direction == "DESCENDING"), self.count)
+
+            def limit(self, count):
+                return Query(self.path, self.order, count)
+
+            def stream(self):
+                firestore._read()
+                docs = [Snapshot(Document(p), data) for p, data in firestore.docs.items() if p[:-1] == self.path]
+                if self.order:
+                    docs.sort(key=lambda d: d.to_dict()[self.order[0]], reverse=self.order[1])
+                return iter(docs[:self.count])
+
+        class Snapshot:
+            def __init__(self, reference, data):
+                self.reference, self._data, self.id = reference, data, reference.path[-1]
+                self.exists = data is not None
+
+            def to_dict(self):
+                return dict(self._data) if self._data is not None else None
+
+        class Document:
+            def __init__(self, path):
+                self.path = path
+
+            def collection(self, name):
+                return Query(self.path + (name,))
+
+            def get(self):
+                firestore._read()
+                return Snapshot(self, firestore.docs.get(self.path))
+
+        return Query(parent + (name,))
+
+
+def bench_login(latency, runs):
+    """
+    Compares reading the login data one read after the other, as login_auth did, with the parallel
+    fan-out of Database.fetch_dashboard, against a Firestore stand-in with the given read latency.
+    """
+    from API_Config import services
+    from Database import fetch_dashboard
+    from patient_repository import FirestorePatientRepository
+
+    firestore = FakeFirestore(latency)
+    firestore.docs[("Patients", "jane@example")] = {"name": "Jane Doe", "email": "jane@example.com"}
+    for i in range(12):
+        firestore.docs[("Patients", "jane@example", "Reports", f"Report_{i:02}")] = {
+            "report_id": f"Report_{i:02}", "filename": f"Report_{i:02}.pdf", "date": f"2026-10-{i + 1:02}"}
+    services.override("patients", FirestorePatientRepository(firestore))
+
+    def sequential(user_doc_name):
+        # The previous login_auth read path
+        user_ref = firestore.collection("Patients").document(user_doc_name)
+        name = user_ref.get().to_dict().get("name", "")
+        reports_ref = user_ref.collection("Reports").order_by("date", direction="DESCENDING").limit(5)
+        return {"name": name, "reports": [r.to_dict() for r in reports_ref.stream()]}
+
+    print(f"{'path':<12} {'reads':>6} {'p50 s':>8} {'p95 s':>8}")
+    for name, fetch in (("sequential", sequential), ("parallel", fetch_dashboard)):
+        timings = []
+        firestore.reads = 0
+        for _ in range(runs):
+            start = time.perf_counter()
+            dashboard = fetch("jane@example")
+            timings.append(time.perf_counter() - start)
+        assert len(dashboard["reports"]) == 5
+        print(f"{name:<12} {firestore.reads / runs:>6.1f} {statistics.median(timings):>8.4f} "
+              f"{percentile(timings, 95):>8.4f}")
+
+
+def bench_persistence(users, reports):
+    """
+    Measures the cost of the report saves and login reads of the offline patient repository backends.
+    """
+    from patient_repository import MemoryPatientRepository, SQLitePatientRepository
+
+    print(f"{'backend':<8} {'save p50 ms':>12} {'save p95 ms':>12} {'login p50 ms':>13} {'login p95 ms':>13}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, repository in (("memory", MemoryPatientRepository()),
+                                 ("sqlite", SQLitePatientRepository(f"{tmp}/patients.db"))):
+            saves, logins = [], []
+            for u in range(users):
+                key = f"user{u}@example"
+                repository.put_patient(key, {"name": f"User {u}", "email": f"user{u}@example.com"})
+                for r in range(reports):
+                    report_data = {"report_id": f"Report_{r:03}", "blob_key": f"reports/{key}/Report_{r:03}.pdf",
+                                   "filename": f"Report_{r:03}.pdf", "date": f"2026-10-17T10:{r // 60:02}:{r % 60:02}"}
+                    start = time.perf_counter()
+                    repository.save_report(key, report_data, 5)
+                    saves.append(time.perf_counter() - start)
+            for u in range(users):
+                start = time.perf_counter()
+                patient, latest = repository.get_dashboard(f"user{u}@example", 5)
+                logins.append(time.perf_counter() - start)
+            assert patient and [r["report_id"] for r in latest][0] == f"Report_{reports - 1:03}" and len(latest) == 5
+            print(f"{name:<8} {statistics.median(saves) * 1000:>12.3f} {percentile(saves, 95) * 1000:>12.3f} "
+                  f"{statistics.median(logins) * 1000:>13.3f} {percentile(logins, 95) * 1000:>13.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    vision = subparsers.add_parser("vision", help="Vision request payload size and latency, before and after preprocessing.")
+    vision.add_argument("images", nargs="*", help="Images to send, defaults to a synthetic 12 MP photo and 'test image.jpg'.")
+    vision.add_argument("--bandwidth-mbps", type=float, default=20.0, help="Simulated uplink bandwidth.")
+    vision.add_argument("--model-latency", type=float, default=0.0, help="Simulated model processing time in seconds.")
+    vision.add_argument("--runs", type=int, default=5)
+
+    pdf = subparsers.add_parser("pdf", help="Report PDF rendering time, remote PDF API against local rendering.")
+    pdf.add_argument("--latency", type=float, default=0.5, help="Simulated PDF API time per request in seconds.")
+    pdf.add_argument("--runs", type=int, default=10)
+
+    login = subparsers.add_parser("login", help="Login data reads, one after the other against in parallel.")
+    login.add_argument("--latency", type=float, default=0.05, help="Simulated Firestore read latency in seconds.")
+    login.add_argument("--runs", type=int, default=20)
+
+    persistence = subparsers.add_parser("persistence", help="Report saves and login reads of the offline repository backends.")
+    persistence.add_argument("--users", type=int, default=200)
+    persistence.add_argument("--reports", type=int, default=20, help="Reports saved per user, 5 are kept.")
+
+    args = parser.parse_args()
+    if args.benchmark == "vision":
+        with tempfile.TemporaryDirectory() as directory:
+            bench_vision(args.images or [synthetic_photo(directory), "test image.jpg"], args.bandwidth_mbps,
+                         args.runs, args.model_latency)
+    elif args.benchmark == "pdf":
+        bench_pdf(args.latency, args.runs)
+    elif args.benchmark == "login":
+        bench_login(args.latency, args.runs)
+    elif args.benchmark == "persistence":
+        bench_persistence(args.users, args.reports)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from metrics import gauge, histogram
+
+# Concurrent runs allowed per Gradio event, keyed by concurrency_id
+EVENT_CONCURRENCY = {
+    "query": int(os.environ.get("QUERY_CONCURRENCY_LIMIT", 4)),
+    "followup": int(os.environ.get("FOLLOWUP_CONCURRENCY_LIMIT", 4)),
+}
+
+# Events waiting beyond this are rejected by Gradio with a "queue full" message
+MAX_QUEUE_SIZE = int(os.environ.get("MAX_QUEUE_SIZE", 64))
+
+# Concurrent calls allowed per upstream service, shared by every session in the process
+UPSTREAM_LIMITS = {
+    "llm": int(os.environ.get("LLM_CONCURRENCY_LIMIT", 8)),
+    "stt": int(os.environ.get("STT_CONCURRENCY_LIMIT", 4)),
+    "tts": int(os.environ.get("TTS_CONCURRENCY_LIMIT", 6)),
+    "pdf": int(os.environ.get("PDF_CONCURRENCY_LIMIT", 2)),
+}
+
+upstream_wait_seconds = histogram(
+    "upstream_wait_seconds", "Time spent waiting for a free slot to an upstream service.",
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0))
+upstream_in_flight = gauge("upstream_in_flight", "Calls currently running against an upstream service.")
+upstream_waiting = gauge("upstream_waiting", "Calls waiting for a free slot to an upstream service.")
+event_queue_depth = gauge("event_queue_depth", "Gradio events waiting in the queue, by concurrency id.")
+event_in_flight = gauge("event_in_flight", "Gradio events currently running, by concurrency id.")
+event_queue_wait_seconds = histogram(
+    "event_queue_wait_seconds", "Time Gradio events waited in the queue before running, by concurrency id.",
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0))
+
+
+class _ThreadWaiter:
+    """A thread blocked on an upstream slot."""
+
+    def __init__(self):
+        self.event = threading.Event()
+
+    def grant(self):
+        """Hands the slot to the waiting thread."""
+        self.event.set()
+        return True
+
+
+class _TaskWaiter:
+    """An asyncio task awaiting an upstream slot, possibly on another thread's event loop."""
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self.loop = asyncio.get_running_loop()
+        self.future = self.loop.create_future()
+
+    def grant(self):
+        """Hands the slot to the waiting task, returns False if the task already gave up."""
+        if self.future.done():
+            return False
+        self.loop.call_soon_threadsafe(self._wake)
+        return True
+
+    def _wake(self):
+        """Resolves the future on its own loop, passing the slot on if the task was cancelled meanwhile."""
+        if self.future.cancelled():
+            self.limiter._release()
+        else:
+            self.future.set_result(None)
+
+
+class UpstreamLimiter:
+    """
+    Caps the number of concurrent calls to one upstream service, e.g. the LLM or TTS API.
+
+    Callers beyond the limit wait in line instead of flooding the service with requests it
+    would rate-limit. Threads and asyncio tasks share the same slots and the same first-in,
+    first-out line. In-flight and waiting calls are exposed as gauges and the time spent
+    waiting as a histogram.
+    """
+
+    def __init__(self, name, limit):
+        self.name = name
+        self.limit = limit
+        self.in_use = 0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+        upstream_in_flight.set_function(lambda: self.in_use, upstream=name)
+        upstream_waiting.set_function(lambda: len(self._waiters), upstream=name)
+
+    def _acquire_or_enqueue(self, waiter_factory):
+        """Takes a free slot, or queues a waiter and returns it."""
+        with self._lock:
+            if self.in_use < self.limit and not self._waiters:
+                self.in_use += 1
+                return None
+            waiter = waiter_factory()
+            self._waiters.append(waiter)
+            return waiter
+
+    def _release(self):
+        """Hands the slot to the next live waiter, or frees it."""
+        with self._lock:
+            while self._waiters:
+                if self._waiters.popleft().grant():
+                    return
+            self.in_use -= 1
+
+    @contextmanager
+    def slot(self):
+        """Holds one of the upstream's slots for the duration of the wrapped block."""
+        start = time.perf_counter()
+        waiter = self._acquire_or_enqueue(_ThreadWaiter)
+        if waiter is not None:
+            waiter.event.wait()
+        upstream_wait_seconds.observe(time.perf_counter() - start, upstream=self.name)
+        try:
+            yield
+        finally:
+            self._release()
+
+    @asynccontextmanager
+    async def slot_async(self):
+        """Awaits one of the upstream's slots and holds it for the duration of the wrapped block."""
+        start = time.perf_counter()
+        waiter = self._acquire_or_enqueue(lambda: _TaskWaiter(self))
+        if waiter is not None:
+            try:
+                await waiter.future
+            except asyncio.CancelledError:
+                with self._lock:
+                    queued = waiter in self._waiters
+                    if queued:
+                        self._waiters.remove(waiter)
+                # A slot that was already handed over must be passed on
+                if not queued and waiter.future.done() and not waiter.future.cancelled():
+                    self._release()
+                raise
+        upstream_wait_seconds.observe(time.perf_counter() - start, upstream=self.name)
+        try:
+            yield
+        finally:
+            self._release()
+
+
+limiters = {name: UpstreamLimiter(name, limit) for name, limit in UPSTREAM_LIMITS.items()}
+
+
+def upstream(name):
+    """
+    Returns a context manager holding a slot to the given upstream service.
+
+    Args:
+        name (str): The upstream service, one of "llm", "stt", "tts" or "pdf".
+
+    Returns:
+        contextmanager: The slot of the upstream's limiter.
+    """
+    return limiters[name].slot()
+
+
+def upstream_async(name):
+    """
+    Returns an async context manager holding a slot to the given upstream service.
+
+    Args:
+        name (str): The upstream service, one of "llm", "stt", "tts" or "pdf".
+
+    Returns:
+        asynccontextmanager: The slot of the upstream's limiter.
+    """
+    return limiters[name].slot_async()
+
+
+def run_sync(coroutine):
+    """
+    Runs a coroutine to completion from synchronous code, on a private event loop.
+
+    Used by the sync facades of the async pipeline. Must not be called from a running event loop.
+
+    Args:
+        coroutine (coroutine): The coroutine to run.
+
+    Returns:
+        object: The coroutine's result.
+    """
+    return asyncio.run(coroutine)
+
+
+def iterate_sync(async_generator):
+    """
+    Iterates an async generator from synchronous code, on a private event loop.
+
+    Used by the sync facades of the streaming async pipeline. Must not be called from a running
+    event loop.
+
+    Args:
+        async_generator (async generator): The async generator to iterate.
+
+    Yields:
+        object: The items of the async generator.
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                item = loop.run_until_complete(async_generator.__anext__())
+            except StopAsyncIteration:
+                return
+            yield item
+    finally:
+        loop.run_until_complete(async_generator.aclose())
+        loop.close()
+
+
+def watch_event_queue(demo):
+    """
+    Exposes the depth and in-flight count of every Gradio event queue as gauges, and the time
+    events wait in it as a histogram.
+
+    The gauges are read from the queue only when they are sampled. The wait is measured from
+    the time Gradio queued the event to the time it started processing it.
+
+    Args:
+        demo (gr.Blocks): The app whose queue to watch, after demo.queue() was called.
+    """
+    def depth(concurrency_id):
+        event_queue = demo._queue.event_queue_per_concurrency_id.get(concurrency_id)
+        return len(event_queue.queue) if event_queue else 0
+
+    def running(concurrency_id):
+        event_queue = demo._queue.event_queue_per_concurrency_id.get(concurrency_id)
+        return event_queue.current_concurrency if event_queue else 0
+
+    for concurrency_id in EVENT_CONCURRENCY:
+        event_queue_depth.set_function(lambda cid=concurrency_id: depth(cid), concurrency_id=concurrency_id)
+        event_in_flight.set_function(lambda cid=concurrency_id: running(cid), concurrency_id=concurrency_id)
+
+    queue = demo._queue
+    process_events = queue.process_events
+
+    async def timed_process_events(events, batch, begin_time):
+        for event in events:
+            # Gradio records when each event was queued, begin_time is when its processing starts
+            queued_at = queue.event_analytics.get(event._id, {}).get("time")
+            if queued_at is not None:
+                event_queue_wait_seconds.observe(
+                    max(0.0, begin_time - queued_at), concurrency_id=event.concurrency_id)
+        return await process_events(events, batch, begin_time)
+
+    # The queue's worker loop looks the method up on the instance, so every event goes through the timer
+    queue.process_events = timed_process_events
@@ -0,0 +1,197 @@
+import math
+import os
+from metrics import counter, histogram
+
+# Most tokens of conversation sent with a follow-up, older turns beyond it are left out
+CONVERSATION_TOKEN_BUDGET = int(os.environ.get("CONVERSATION_TOKEN_BUDGET", 3000))
+
+# Tokens the chat format adds around each message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# The first turns, the patient's query and the diagnosis, are always sent as they are
+HEAD_TURNS = 2
+
+# Latest turns always kept verbatim, older ones are folded into the running summary
+RECENT_TURNS = int(os.environ.get("CONVERSATION_RECENT_TURNS", 6))
+
+# Tokens of older turns that trigger folding them into the summary
+SUMMARY_TRIGGER_TOKENS = int(os.environ.get("CONVERSATION_SUMMARY_TRIGGER_TOKENS", 600))
+
+prompt_tokens = histogram(
+    "conversation_prompt_tokens", "Estimated tokens of conversation sent with a follow-up.",
+    buckets=(250, 500, 1000, 2000, 3000, 4000, 8000, 16000))
+tokens_saved = counter(
+    "conversation_tokens_saved_total", "Estimated prompt tokens saved by sending the summary instead of the turns, by use.")
+
+
+def count_tokens(text):
+    """
+    Estimates the number of tokens of a text.
+
+    No tokenizer for the Groq models ships with the app, so this uses the usual estimate of
+    four characters per token, which is close enough to keep prompts within a budget.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    return math.ceil(len(text) / 4) + MESSAGE_OVERHEAD_TOKENS
+
+
+class Conversation:
+    """
+    The conversation of one session: the diagnosis, then the follow-up questions and replies.
+
+    Kept in a gr.State. Each turn's token count is computed once when it is appended, so building
+    the context of a follow-up only walks back over the turns that fit the budget. Older turns are
+    folded into a running summary by summarizer.py, and sent as that summary from then on.
+    """
+
+    def __init__(self, budget=CONVERSATION_TOKEN_BUDGET):
+        self.budget = budget
+        self.turns = []  # {"role", "content", "tokens"} dicts, oldest first
+        self.summary = ""  # the running summary of turns[HEAD_TURNS:summary_upto]
+        self.summary_upto = HEAD_TURNS
+        self.summary_tokens = 0
+        self.folded_tokens = 0  # tokens of the turns the summary replaces
+        self.summarizing = False  # whether a summary is being generated
+
+    @classmethod
+    def seeded(cls, query, diagnosis, budget=CONVERSATION_TOKEN_BUDGET):
+        """
+        Starts a conversation from the patient's query and the doctor's diagnosis.
+
+        Args:
+            query (str): The patient's transcribed or typed query.
+            diagnosis (str): The diagnosis reply.
+            budget (int): The token budget of the follow-up context.
+
+        Returns:
+            Conversation: The conversation.
+        """
+        conversation = cls(budget)
+        if query:
+            conversation.append("user", query)
+        conversation.append("assistant", diagnosis)
+        return conversation
+
+    def append(self, role, content):
+        """
+        Adds a turn to the conversation.
+
+        Args:
+            role (str): "user" or "assistant".
+            content (str): The message.
+        """
+        content = content if isinstance(content, str) else str(content)
+        self.turns.append({"role": role, "content": content, "tokens": count_tokens(content)})
+
+    @property
+    def total_tokens(self):
+        """The estimated tokens of the whole conversation."""
+        return sum(turn["tokens"] for turn in self.turns)
+
+    def pending_fold(self):
+        """
+        Returns the turns due to be folded into the summary.
+
+        Returns:
+            tuple: The (start, end) indexes of the turns, or None if the unsummarized older turns
+            are still below SUMMARY_TRIGGER_TOKENS.
+        """
+        start, end = self.summary_upto, len(self.turns) - RECENT_TURNS
+        if end <= start:
+            return None
+        if sum(turn["tokens"] for turn in self.turns[start:end]) < SUMMARY_TRIGGER_TOKENS:
+            return None
+        return start, end
+
+    def apply_summary(self, summary, upto):
+        """
+        Replaces the turns before upto with a summary of them.
+
+        Args:
+            summary (str): The summary of the turns since the diagnosis, up to upto.
+            upto (int): The index of the first turn not covered by the summary.
+        """
+        if upto <= self.summary_upto:
+            # A newer summary was applied already
+            return
+        self.summary = summary
+        self.summary_upto = upto
+        self.summary_tokens = count_tokens(summary)
+        self.folded_tokens = sum(turn["tokens"] for turn in self.turns[HEAD_TURNS:upto])
+
+    def _summary_message(self, use):
+        """Returns the summary as a message, and counts the tokens it saves."""
+        tokens_saved.inc(max(0, self.folded_tokens - self.summary_tokens), use=use)
+        return {"role": "system", "content": f"Summary of the earlier conversation: {self.summary}"}
+
+    def context(self, query=None):
+        """
+        Builds the messages for the next model call, within the token budget.
+
+        The first turns, which hold the diagnosis, are kept whenever they fit, then the summary of
+        the older follow-ups, then as many of the latest turns as the rest of the budget allows.
+        The turns in between are left out.
+
+        Args:
+            query (str): The new user message, always included, if any.
+
+        Returns:
+            list: The messages, as role and content dicts.
+        """
+        remaining = self.budget
+        tail = []
+        if query:
+            tail.append({"role": "user", "content": query})
+            remaining -= count_tokens(query)
+
+        # Keep the diagnosis exchange, the follow-ups are about it
+        head_length = 0
+        for turn in self.turns[:HEAD_TURNS]:
+            if turn["tokens"] > remaining:
+                break
+            remaining -= turn["tokens"]
+            head_length += 1
+
+        # The summary stands in for the older follow-ups
+        summary = []
+        if self.summary and self.summary_tokens <= remaining:
+            remaining -= self.summary_tokens
+            summary.append(self._summary_message("followup"))
+
+        # Walk back from the latest turn until the budget is spent
+        recent = []
+        for turn in reversed(self.turns[max(head_length, self.summary_upto if summary else 0):]):
+            if turn["tokens"] > remaining:
+                break
+            remaining -= turn["tokens"]
+            recent.append(turn)
+        recent.reverse()
+
+        head = [{"role": t["role"], "content": t["content"]} for t in self.turns[:head_length]]
+        recent = [{"role": t["role"], "content": t["content"]} for t in recent]
+        prompt_tokens.observe(self.budget - remaining)
+        return head + summary + recent + tail
+
+    def __iter__(self):
+        """
+        Iterates over the conversation as role and content dicts, as the report expects.
+
+        The follow-ups covered by the summary are replaced by a "system" message holding it.
+        """
+        messages = [{"role": t["role"], "content": t["content"]} for t in self.turns[:HEAD_TURNS]]
+        if self.summary:
+            messages.append(self._summary_message("report"))
+        start = self.summary_upto if self.summary else HEAD_TURNS
+        messages += [{"role": t["role"], "content": t["content"]} for t in self.turns[start:]]
+        return iter(messages)
+
+    def __len__(self):
+        return len(self.turns)
+
+    def __repr__(self):
+        return f"Conversation({len(self.turns)} turns, ~{self.total_tokens} tokens)"
@@ -1,11 +1,25 @@
+import os
 import gradio as gr
-from Brain import generate_stt_and_images, generate_response, generate_followup_response, query_func
-from report import generate_report
+import uvicorn
+from fastapi import FastAPI, Response
+from Brain import generate_stt_and_images_async, generate_response_stream_async, generate_followup_response_async, \
+    query_func
+from report_jobs import submit_report, watch_report_async
 from Database import login_auth, register
 from ui_config import theme, landing_page_text, css, js_func
+from report_store import LOCAL_REPORT_DIR, REPORT_STORE
+from conversation import Conversation
+from audio_store import AUDIO_MAX_AGE, AUDIO_SWEEP_INTERVAL, release_session_audio
+from concurrency import EVENT_CONCURRENCY, MAX_QUEUE_SIZE, watch_event_queue
+from API_Config import services
+from metrics import PROMETHEUS_CONTENT_TYPE, render_prometheus
 
+# Address the app is served on, read from the same variables as demo.launch
+SERVER_NAME = os.environ.get("GRADIO_SERVER_NAME", "127.0.0.1")
+SERVER_PORT = int(os.environ.get("GRADIO_SERVER_PORT", 7860))
 
-def login_success(is_logged_in):
+
+def login_success(is_logged_in, request: gr.Request = None):
     """
     Handles the UI after a user logs in or logs out.
 
@@ -15,21 +29,25 @@ def login_success(is_logged_in):
 
     Args:
         is_logged_in (bool): Whether the user is logged in or not.
+        request (gr.Request): The Gradio request, whose session is cleared.
 
     Returns:
         A list of UI elements to update.
     """
     if is_logged_in:
         # Show the UI for a logged-in user
-        return clear_all() + view_with_login()
+        return clear_all(request) + view_with_login()
     else:
         # Show the login section
-        return clear_all() + toggle_sections(login=True)
+        return clear_all(request) + toggle_sections(login=True)
 
 
-def clear_all():
+def clear_all(request: gr.Request = None):
     """
-    Resets all UI elements and states to their initial values.
+    Resets all UI elements and states to their initial values, and deletes the session's reply audio.
+
+    Args:
+        request (gr.Request): The Gradio request, whose session is cleared.
 
     Returns:
         tuple: A tuple containing initial values for various UI components
@@ -42,8 +60,11 @@ def clear_all():
             - stt_state (None): Initial state for speech-to-text.
             - enc_img_state (None): Initial state for encoded image.
             - img_url_state (None): Initial state for image URL.
-            - followup_history (list): Empty list for follow-up conversation history.
+            - followup_history (Conversation): An empty conversation for the follow-ups.
     """
+    # The replies of the session are cleared, so their audio files are no longer needed
+    release_session_audio(request)
+
     return (
         "",  # stt_output
         None,  # generated_image
@@ -53,7 +74,7 @@ def clear_all():
         None,  # stt_state
         None,  # enc_img_state
         None,  # img_url_state
-        [],    # followup_history
+        Conversation(),  # followup_history
     )
 
 
@@ -124,26 +145,31 @@ def go_to_signup():
     return toggle_sections(signup=True)
 
 
-def continue_as_guest():
+def continue_as_guest(request: gr.Request = None):
     """
     Clears all sections and shows the login section.
+    Args:
+        request (gr.Request): The Gradio request, whose session is cleared.
     Returns:
         tuple: A tuple of gr.update objects that clears all sections and shows the login section.
     """
-    return clear_all() + no_login_view()
+    return clear_all(request) + no_login_view()
 
 
-def back_to_login():
+def back_to_login(request: gr.Request = None):
     """
     Clears all sections and shows the login section.
+    Args:
+        request (gr.Request): The Gradio request, whose session is cleared.
     Returns:
         tuple: A tuple of gr.update objects that clears all sections and shows the login section.
     """
-    return clear_all() + show_login_page()
+    return clear_all(request) + show_login_page()
 
 
 # Create a gradio interface with a theme, CSS styling, and custom JS to switch themes
-with gr.Blocks(theme=theme, css=css, js=js_func) as demo:
+# 'delete_cache' also expires Gradio's own copies of the reply audio files
+with gr.Blocks(theme=theme, css=css, js=js_func, delete_cache=(AUDIO_SWEEP_INTERVAL, AUDIO_MAX_AGE)) as demo:
     # Create the landing section
     with gr.Column(elem_id="landing-section", elem_classes="section-container") as landing_section:
         # Add a header with the Dr. Chat logo and tagline
@@ -214,9 +240,9 @@ with gr.Blocks(theme=theme, css=css, js=js_func) as demo:
                                                    format="pil", show_label=False)
                     # The column for the output
                     with gr.Column(scale=3):
-                        # The audio area where the diagnosis audio is played
+                        # The audio area where the diagnosis audio is played, one sentence at a time
                         response_audio = gr.Audio(label="Diagnosis Voice", interactive=False,
-                                                  type="filepath", autoplay=True)
+                                                  type="filepath", autoplay=True, streaming=True)
                         # The text area where the diagnosis text is displayed
                         response_output = gr.TextArea(placeholder="Diagnosis appears here", interactive=False,
                                                       show_label=False)
@@ -281,9 +307,10 @@ with gr.Blocks(theme=theme, css=css, js=js_func) as demo:
             img_url_state = gr.State()  # The state of the image URL
             generated_img_state = gr.State()  # The state of the generated image
             login_status = gr.State()  # The state of the login status
-            followup_history = gr.State([])  # The state of the follow-up conversation history
+            followup_history = gr.State(Conversation())  # The conversation of the session, for follow-ups and reports
             name_state = gr.State()  # The state of the user's name
             email_state = gr.State()  # The state of the user's email
+            report_job_state = gr.State()  # The id of the latest report job
 
             # When the get started button is clicked, show the login page
             get_started_btn.click(
@@ -335,11 +362,14 @@ with gr.Blocks(theme=theme, css=css, js=js_func) as demo:
                          followup_section, signup_section, signup_main_btn, report_section]
             )
 
-            # When the user submits a query, generate the speech-to-text and image encodings
+            # When the user submits a query, generate the speech-to-text and image encodings.
+            # The pipeline steps are coroutines awaited on Gradio's event loop, not worker threads.
             query_input.submit(
-                fn=generate_stt_and_images,
+                fn=generate_stt_and_images_async,
                 inputs=[query_input],
-                outputs=[stt_state, enc_img_state, img_url_state]
+                outputs=[stt_state, enc_img_state, img_url_state],
+                concurrency_limit=EVENT_CONCURRENCY["query"],
+                concurrency_id="query"
             ).then(
                 # Then, update the UI to show the main section
                 lambda: gr.update(visible=True), None, [in_main]
@@ -352,10 +382,12 @@ with gr.Blocks(theme=theme, css=css, js=js_func) as demo:
                 inputs=[stt_state, enc_img_state, img_url_state],
                 outputs=[stt_output, generated_image, generated_img_state]
             ).then(
-                # Generate the response to the query
-                fn=generate_response,
+                # Stream the response to the query into the diagnosis box as it is generated
+                fn=generate_response_stream_async,
                 inputs=[stt_state, enc_img_state],
-                outputs=[response_audio, response_output, followup_history]
+                outputs=[response_audio, response_output, followup_history],
+                concurrency_limit=EVENT_CONCURRENCY["query"],
+                concurrency_id="query"
             ).then(
                 # Then, set the query input back to interactive=True
                 lambda: gr.MultimodalTextbox(interactive=True), None, [query_input]
@@ -363,9 +395,11 @@ with gr.Blocks(theme=theme, css=css, js=js_func) as demo:
 
             # When the user submits a follow-up query, generate the response to the follow-up query
             followup_input.submit(
-                fn=generate_followup_response,
+                fn=generate_followup_response_async,
                 inputs=[followup_input, followup_history],
-                outputs=[followup_history, followup_output]
+                outputs=[followup_history, followup_output],
+                concurrency_limit=EVENT_CONCURRENCY["followup"],
+                concurrency_id="followup"
             ).then(
                 # Then, clear the follow-up input and set it to interactive=False
                 lambda: gr.MultimodalTextbox(value="", interactive=False), None, [followup_input]
@@ -374,11 +408,19 @@ with gr.Blocks(theme=theme, css=css, js=js_func) as demo:
                 lambda: gr.MultimodalTextbox(interactive=True), None, [followup_input]
             )
 
-            # When the report button is clicked, generate the report
+            # When the report button is clicked, queue the report on the background workers
             report_btn.click(
-                fn=generate_report,
+                fn=submit_report,
                 inputs=[followup_history, name_state, email_state, generated_img_state],
-                outputs=[report_preview, download_pdf]
+                outputs=[report_job_state, report_preview, download_pdf],
+                concurrency_limit=None
+            ).then(
+                # Then, poll the job and show the report once it is ready
+                # The workers bound the number of reports generated at once, so polling is not limited
+                fn=watch_report_async,
+                inputs=[report_job_state],
+                outputs=[report_preview, download_pdf],
+                concurrency_limit=None
             )
 
             # When the logout button is clicked, go back to the login page
@@ -421,7 +463,43 @@ with gr.Blocks(theme=theme, css=css, js=js_func) as demo:
             lambda: ("", "", "", ""), None, [user_name, signup_email, signup_password, confirm_password]
         )
 
-# Launch the Gradio demo interface
-# 'debug=True' enables debug mode for more verbose output
-# 'inbrowser=True' opens the demo in the default web browser
-demo.launch(debug=True, inbrowser=True)
+    # When the browser tab is closed, delete the session's reply audio
+    demo.unload(release_session_audio)
+
+# Bound the number of waiting events, and expose the queue depth of each event as gauges
+demo.queue(max_size=MAX_QUEUE_SIZE)
+watch_event_queue(demo)
+
+
+def metrics_endpoint():
+    """
+    Serves every metric of the process in the Prometheus text format.
+
+    Returns:
+        Response: The metrics, rendered only when scraped.
+    """
+    return Response(render_prometheus(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+
+def create_app():
+    """
+    Creates the web app serving the Gradio interface, with the /metrics endpoint next to it.
+
+    Returns:
+        FastAPI: The app.
+    """
+    app = FastAPI()
+    # Registered before the Gradio mount, so it is matched first
+    app.add_api_route("/metrics", metrics_endpoint, methods=["GET"], include_in_schema=False)
+    # 'allowed_paths' lets Gradio serve report PDFs kept by the local report store, Firebase ones use signed URLs
+    allowed_paths = [LOCAL_REPORT_DIR] if REPORT_STORE == "local" else []
+    return gr.mount_gradio_app(app, demo, path="", allowed_paths=allowed_paths)
+
+
+# Importing the module only builds the interface, e.g. for load_test.py, running it starts the app
+if __name__ == "__main__":
+    # Start the report workers now, so report jobs left unfinished by a previous run are resumed
+    services.get("report_jobs")
+
+    # Serve the Gradio interface and the metrics endpoint
+    uvicorn.run(create_app(), host=SERVER_NAME, port=SERVER_PORT)
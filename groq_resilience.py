@@ -0,0 +1,298 @@
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+import groq
+from metrics import SIZE_BUCKETS, counter, gauge, histogram
+
+# Lighter models to fail over to, in order, when a model keeps failing or its circuit is open
+MODEL_FALLBACKS = {
+    "meta-llama/llama-4-maverick-17b-128e-instruct": ["meta-llama/llama-4-scout-17b-16e-instruct"],
+    "compound-beta-mini": ["llama-3.1-8b-instant"],
+    "whisper-large-v3-turbo": ["distil-whisper-large-v3-en"],
+}
+MODEL_FALLBACKS.update(json.loads(os.environ.get("GROQ_MODEL_FALLBACKS", "{}")))
+
+# Retries per model after the first attempt, and the jittered exponential backoff between them
+MAX_RETRIES = int(os.environ.get("GROQ_MAX_RETRIES", 2))
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 10.0
+
+# Consecutive failures that open a model's circuit, and how long it stays open before a trial call
+FAILURE_THRESHOLD = int(os.environ.get("GROQ_BREAKER_THRESHOLD", 5))
+RESET_TIMEOUT = float(os.environ.get("GROQ_BREAKER_RESET_SECONDS", 30))
+
+# Errors worth retrying: rate limits, timeouts, dropped connections and server errors
+RETRYABLE_ERRORS = (groq.RateLimitError, groq.APIConnectionError, groq.InternalServerError)
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+
+groq_calls = counter("groq_calls_total", "Groq calls by operation, model and outcome.")
+groq_retries = counter("groq_retries_total", "Groq calls retried, by operation, model and error type.")
+groq_fallbacks = counter("groq_fallbacks_total", "Groq calls failed over to another model.")
+groq_circuit_state = gauge("groq_circuit_state", "Circuit breaker state per model: 0 closed, 1 half open, 2 open.")
+groq_request_seconds = histogram(
+    "groq_request_seconds", "Latency of each Groq call attempt, by operation, model and outcome.")
+groq_errors = counter("groq_errors_total", "Failed Groq call attempts, by operation, model and error type.")
+groq_payload_bytes = histogram(
+    "groq_payload_bytes", "Size of Groq request and response payloads, by operation and direction.",
+    buckets=SIZE_BUCKETS)
+
+
+class CircuitOpenError(Exception):
+    """Raised when every model of a call has its circuit open."""
+
+
+class CircuitBreaker:
+    """
+    Stops calling a model after FAILURE_THRESHOLD consecutive failures.
+
+    After RESET_TIMEOUT seconds one trial call is let through: success closes the circuit,
+    failure opens it again.
+    """
+
+    def __init__(self, model, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        self.model = model
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+        groq_circuit_state.set_function(lambda: (CLOSED, HALF_OPEN, OPEN).index(self.state), model=model)
+
+    def allow(self):
+        """Returns whether a call to the model may go ahead now."""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self._trial_running = False
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        """Closes the circuit after a successful call."""
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._trial_running = False
+
+    def release(self):
+        """Frees the trial slot after a call that ended without an outcome, e.g. cancelled, so the next call can try."""
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self):
+        """Counts a failed call, opening the circuit at the threshold or after a failed trial."""
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self._trial_running = False
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker(model):
+    """Returns the circuit breaker of a model."""
+    with _breakers_lock:
+        if model not in _breakers:
+            _breakers[model] = CircuitBreaker(model)
+        return _breakers[model]
+
+
+def breaker_states():
+    """
+    Returns the state of every model's circuit breaker.
+
+    Returns:
+        dict: Model name to {"state", "failures"}.
+    """
+    with _breakers_lock:
+        return {model: {"state": b.state, "failures": b.failures} for model, b in _breakers.items()}
+
+
+def retry_delay(error, attempt):
+    """
+    Returns how long to wait before retrying after an error.
+
+    Args:
+        error (Exception): The error of the failed attempt.
+        attempt (int): The number of the attempt that failed, starting at 0.
+
+    Returns:
+        float: The delay in seconds, from Retry-After when the API gave one, else with full jitter.
+    """
+    response = getattr(error, "response", None)
+    if response is not None:
+        try:
+            return min(BACKOFF_MAX, float(response.headers.get("retry-after")))
+        except (TypeError, ValueError):
+            pass
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def record_payload(operation, sent=None, received=None):
+    """
+    Records the payload sizes of a Groq call.
+
+    Args:
+        operation (str): The name of the call, as passed to call_groq.
+        sent (int): The size of the request payload in bytes, if known.
+        received (int): The size of the response payload in bytes, if known.
+    """
+    if sent is not None:
+        groq_payload_bytes.observe(sent, operation=operation, direction="sent")
+    if received is not None:
+        groq_payload_bytes.observe(received, operation=operation, direction="received")
+
+
+def message_bytes(messages):
+    """
+    Estimates the payload size of chat messages from their text and image URLs, without serializing them.
+
+    Args:
+        messages (list): The chat messages.
+
+    Returns:
+        int: The size in characters, which is the size in bytes for ASCII text and data URIs.
+    """
+    size = 0
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, str):
+            size += len(content)
+            continue
+        for part in content:
+            size += len(part.get("text") or part.get("image_url", {}).get("url", ""))
+    return size
+
+
+def _record_attempt(operation, model, start, error=None):
+    """Records the outcome and latency of one call attempt."""
+    outcome = "ok" if error is None else "error"
+    groq_calls.inc(operation=operation, model=model, outcome=outcome)
+    groq_request_seconds.observe(time.perf_counter() - start, operation=operation, model=model, outcome=outcome)
+    if error is not None:
+        groq_errors.inc(operation=operation, model=model, error=type(error).__name__)
+
+
+def _models(model):
+    """Returns the model followed by its fallbacks."""
+    return [model] + MODEL_FALLBACKS.get(model, [])
+
+
+def call_groq(operation, model, request):
+    """
+    Calls Groq with retries, a per-model circuit breaker and failover to lighter models.
+
+    Retryable errors (see RETRYABLE_ERRORS) are retried up to MAX_RETRIES times per model, then
+    the next model in MODEL_FALLBACKS is tried. Models with an open circuit are skipped. Other
+    errors, such as invalid requests, are raised right away.
+
+    Args:
+        operation (str): The name of the call, used as the metric label.
+        model (str): The preferred model.
+        request (callable): Makes the call, taking the model name and returning the result.
+
+    Returns:
+        object: The result of request.
+
+    Raises:
+        CircuitOpenError: If every model has its circuit open.
+        Exception: The last error if every model failed.
+    """
+    last_error = None
+    for index, candidate in enumerate(_models(model)):
+        circuit = breaker(candidate)
+        if not circuit.allow():
+            continue
+        if index:
+            groq_fallbacks.inc(operation=operation, model=candidate)
+        for attempt in range(MAX_RETRIES + 1):
+            start = time.perf_counter()
+            try:
+                result = request(candidate)
+            except RETRYABLE_ERRORS as e:
+                last_error = e
+                circuit.record_failure()
+                _record_attempt(operation, candidate, start, e)
+                if attempt == MAX_RETRIES or not circuit.allow():
+                    break
+                groq_retries.inc(operation=operation, model=candidate, error=type(e).__name__)
+                time.sleep(retry_delay(e, attempt))
+            except Exception as e:
+                # Invalid requests say nothing about the model's health, neither closing nor opening its circuit
+                circuit.release()
+                _record_attempt(operation, candidate, start, e)
+                raise
+            except BaseException:
+                # A cancelled call, e.g. after a client disconnect, says nothing either, but must not hold the trial
+                circuit.release()
+                raise
+            else:
+                circuit.record_success()
+                _record_attempt(operation, candidate, start)
+                return result
+    raise last_error or CircuitOpenError(f"All models for {operation} are unavailable.")
+
+
+async def call_groq_async(operation, model, request):
+    """
+    Async variant of call_groq, where request returns an awaitable.
+
+    Args:
+        operation (str): The name of the call, used as the metric label.
+        model (str): The preferred model.
+        request (callable): Makes the call, taking the model name and returning an awaitable.
+
+    Returns:
+        object: The result of request.
+
+    Raises:
+        CircuitOpenError: If every model has its circuit open.
+        Exception: The last error if every model failed.
+    """
+    last_error = None
+    for index, candidate in enumerate(_models(model)):
+        circuit = breaker(candidate)
+        if not circuit.allow():
+            continue
+        if index:
+            groq_fallbacks.inc(operation=operation, model=candidate)
+        for attempt in range(MAX_RETRIES + 1):
+            start = time.perf_counter()
+            try:
+                result = await request(candidate)
+            except RETRYABLE_ERRORS as e:
+                last_error = e
+                circuit.record_failure()
+                _record_attempt(operation, candidate, start, e)
+                if attempt == MAX_RETRIES or not circuit.allow():
+                    break
+                groq_retries.inc(operation=operation, model=candidate, error=type(e).__name__)
+                await asyncio.sleep(retry_delay(e, attempt))
+            except Exception as e:
+                # Invalid requests say nothing about the model's health, neither closing nor opening its circuit
+                circuit.release()
+                _record_attempt(operation, candidate, start, e)
+                raise
+            except BaseException:
+                # A cancelled call, e.g. after a client disconnect, says nothing either, but must not hold the trial
+                circuit.release()
+                raise
+            else:
+                circuit.record_success()
+                _record_attempt(operation, candidate, start)
+                return result
+    raise last_error or CircuitOpenError(f"All models for {operation} are unavailable.")
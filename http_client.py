@@ -0,0 +1,154 @@
+import os
+import random
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from API_Config import services
+from metrics import SIZE_BUCKETS, counter, histogram
+
+# (connect, read) timeouts in seconds per endpoint
+ENDPOINT_TIMEOUTS = {
+    "image": (3.05, 15),
+    "pdf_create": (3.05, 60),
+    "pdf_download": (3.05, 30),
+    "default": (3.05, 30),
+}
+
+# Retries after the first attempt, and the jittered exponential backoff between them
+MAX_RETRIES = int(os.environ.get("HTTP_MAX_RETRIES", 3))
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8.0
+
+# Responses worth retrying. Non-idempotent requests are only retried when the server asked to
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+RETRY_STATUSES_NON_IDEMPOTENT = {429, 503}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "PUT", "DELETE", "OPTIONS"}
+
+http_request_seconds = histogram("http_request_seconds", "Latency of outgoing HTTP requests, by endpoint and status.")
+http_retries = counter("http_retries_total", "Outgoing HTTP requests retried, by endpoint and reason.")
+http_errors = counter("http_errors_total", "Outgoing HTTP request attempts that failed, by endpoint and error type or status.")
+http_payload_bytes = histogram(
+    "http_payload_bytes", "Size of outgoing HTTP request and response bodies, by endpoint and direction.",
+    buckets=SIZE_BUCKETS)
+
+
+def create_session():
+    """
+    Creates the shared HTTP session with keep-alive connection pools.
+
+    Returns:
+        requests.Session: The session.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=8, pool_maxsize=32)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def backoff_delay(attempt, retry_after=None):
+    """
+    Returns how long to wait before the next attempt.
+
+    Args:
+        attempt (int): The number of the attempt that just failed, starting at 0.
+        retry_after (str): The Retry-After header of the response, if any.
+
+    Returns:
+        float: The delay in seconds, with full jitter unless the server gave one.
+    """
+    if retry_after:
+        try:
+            return min(BACKOFF_MAX, float(retry_after))
+        except ValueError:
+            pass
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def failed_to_connect(error):
+    """
+    Returns whether a request failed before a connection was made, so the server never saw it.
+
+    Args:
+        error (requests.RequestException): The error raised by the request.
+
+    Returns:
+        bool: True for connect timeouts, refused connections and failed DNS lookups.
+    """
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    # requests wraps urllib3's MaxRetryError, whose reason is the error of the connection attempt
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def request(endpoint, method, url, **kwargs):
+    """
+    Sends an HTTP request through the shared session, with the endpoint's timeouts and bounded retries.
+
+    Connection errors and retryable statuses (see RETRY_STATUSES) are retried up to MAX_RETRIES
+    times. Non-idempotent requests are only retried when they never reached the server (see
+    failed_to_connect) or it asked to, so e.g. a PDF is not created and billed twice after a
+    dropped connection or a read timeout.
+
+    Args:
+        endpoint (str): The endpoint name, used for its timeouts and as the metric label.
+        method (str): The HTTP method.
+        url (str): The URL.
+        **kwargs: Passed on to requests.Session.request.
+
+    Returns:
+        requests.Response: The last response, which may still have an error status.
+
+    Raises:
+        requests.RequestException: If the last attempt failed without a response.
+    """
+    session = services.get("http_session")
+    method = method.upper()
+    idempotent = method in IDEMPOTENT_METHODS
+    retry_statuses = RETRY_STATUSES if idempotent else RETRY_STATUSES_NON_IDEMPOTENT
+    kwargs.setdefault("timeout", ENDPOINT_TIMEOUTS.get(endpoint, ENDPOINT_TIMEOUTS["default"]))
+
+    for attempt in range(MAX_RETRIES + 1):
+        start = time.perf_counter()
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            http_request_seconds.observe(time.perf_counter() - start, endpoint=endpoint, status=type(e).__name__)
+            http_errors.inc(endpoint=endpoint, error=type(e).__name__)
+            # After a read timeout or a dropped connection, the server may have the request already
+            retryable = idempotent or failed_to_connect(e)
+            if attempt == MAX_RETRIES or not retryable:
+                raise
+            http_retries.inc(endpoint=endpoint, reason=type(e).__name__)
+            time.sleep(backoff_delay(attempt))
+            continue
+
+        http_request_seconds.observe(time.perf_counter() - start, endpoint=endpoint, status=response.status_code)
+        if response.status_code >= 400:
+            http_errors.inc(endpoint=endpoint, error=response.status_code)
+        _record_payload(endpoint, response, kwargs.get("stream"))
+        if response.status_code not in retry_statuses or attempt == MAX_RETRIES:
+            return response
+        http_retries.inc(endpoint=endpoint, reason=response.status_code)
+        time.sleep(backoff_delay(attempt, response.headers.get("Retry-After")))
+
+
+def _record_payload(endpoint, response, stream):
+    """Records the request and response body sizes, without reading a streamed body."""
+    body = response.request.body
+    if isinstance(body, (bytes, str)):
+        http_payload_bytes.observe(len(body), endpoint=endpoint, direction="sent")
+    if not stream:
+        http_payload_bytes.observe(len(response.content), endpoint=endpoint, direction="received")
+
+
+def get(endpoint, url, **kwargs):
+    """Sends a GET request, see request()."""
+    return request(endpoint, "GET", url, **kwargs)
+
+
+def post(endpoint, url, **kwargs):
+    """Sends a POST request, see request()."""
+    return request(endpoint, "POST", url, **kwargs)
@@ -0,0 +1,207 @@
+import base64
+import hashlib
+import os
+from functools import cached_property
+from io import BytesIO
+from PIL import Image, ImageOps
+
+# Longest side of the image sent to the vision model, enough for skin and wound detail
+VISION_MAX_SIDE = int(os.environ.get("VISION_MAX_SIDE", 1536))
+
+# Upper bound on the encoded size of the image sent to the vision model
+VISION_MAX_BYTES = int(os.environ.get("VISION_MAX_BYTES", 800 * 1024))
+
+# Format and starting quality of the re-encoded image, "JPEG" or "WEBP"
+VISION_FORMAT = os.environ.get("VISION_FORMAT", "JPEG").upper()
+VISION_QUALITY = int(os.environ.get("VISION_QUALITY", 90))
+
+# Quality is lowered in steps down to this floor to meet VISION_MAX_BYTES, then the image is shrunk
+VISION_MIN_QUALITY = 70
+
+# Quality of the JPEG embedded in the report, when the upload has to be re-encoded
+REPORT_QUALITY = int(os.environ.get("REPORT_IMAGE_QUALITY", 90))
+
+
+def sniff_mime(data):
+    """
+    Detects the image type from its first bytes, without decoding the image.
+
+    Args:
+        data (bytes): The encoded image.
+
+    Returns:
+        str: The MIME type of the image, or None if it is not a JPEG, PNG or WebP image.
+    """
+    if data.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def has_metadata(image):
+    """
+    Returns whether an opened image carries EXIF (e.g. GPS position, camera) or ICC profile metadata.
+
+    Args:
+        image (PIL.Image.Image): The image, only its header needs to be read.
+
+    Returns:
+        bool: True if the image has metadata.
+    """
+    return bool(image.info.get("exif") or image.info.get("icc_profile") or image.getexif())
+
+
+class ImageAsset:
+    """
+    One uploaded image, carried through Brain, the UI and the report.
+
+    Holds the original encoded bytes and computes every other form (decoded PIL image, base64,
+    data URI, JPEG) at most once, on first use.
+    """
+
+    def __init__(self, data, mime=None):
+        self.data = data
+        # Unknown formats are decoded by PIL when a JPEG is needed, which also validates them
+        self.mime = mime or sniff_mime(data) or "application/octet-stream"
+
+    @classmethod
+    def from_path(cls, path):
+        """
+        Reads an image file.
+
+        Args:
+            path (str): The path to the image file.
+
+        Returns:
+            ImageAsset: The image.
+        """
+        with open(path, "rb") as f:
+            return cls(f.read())
+
+    @classmethod
+    def from_base64(cls, b64_string):
+        """
+        Decodes a base64 string or data URI.
+
+        Args:
+            b64_string (str): The base64 encoded image, optionally as a data URI.
+
+        Returns:
+            ImageAsset: The image.
+        """
+        if b64_string.startswith("data:image"):
+            # Extract the data from the data URI
+            b64_string = b64_string.split(",")[1]
+        return cls(base64.b64decode(b64_string))
+
+    @property
+    def nbytes(self):
+        """The size of the encoded image in bytes."""
+        return len(self.data)
+
+    @cached_property
+    def digest(self):
+        """The hex SHA-256 digest of the encoded image, used as its content address."""
+        return hashlib.sha256(self.data).hexdigest()
+
+    @cached_property
+    def pil(self):
+        """The decoded PIL image."""
+        image = Image.open(BytesIO(self.data))
+        image.load()
+        return image
+
+    @cached_property
+    def base64(self):
+        """The base64 encoded image."""
+        return base64.b64encode(self.data).decode("utf-8")
+
+    @property
+    def data_uri(self):
+        """The image as a data URI, as sent to the vision model."""
+        return f"data:{self.mime};base64,{self.base64}"
+
+    @cached_property
+    def jpeg_bytes(self):
+        """
+        The image as JPEG without metadata, as embedded in the report.
+
+        JPEGs without metadata are kept as they are, other images are re-encoded, so the EXIF
+        (GPS position, camera, capture time) of phone photos never reaches the report.
+        """
+        if self.mime == "image/jpeg" and not has_metadata(Image.open(BytesIO(self.data))):
+            return self.data
+        # Apply the EXIF orientation before the metadata is dropped
+        image = ImageOps.exif_transpose(self.pil)
+        buffered = BytesIO()
+        # No exif/icc_profile arguments, so the output carries no metadata
+        image = image if image.mode in ("RGB", "L") else image.convert("RGB")
+        image.save(buffered, format="JPEG", quality=REPORT_QUALITY)
+        return buffered.getvalue()
+
+    @cached_property
+    def jpeg_base64(self):
+        """The base64 encoded JPEG image, as embedded in the report."""
+        if self.jpeg_bytes is self.data:
+            return self.base64
+        return base64.b64encode(self.jpeg_bytes).decode("utf-8")
+
+    @cached_property
+    def vision(self):
+        """The image as sent to the vision model, see prepare_for_vision()."""
+        return prepare_for_vision(self)
+
+    def __repr__(self):
+        return f"<ImageAsset {self.mime} {self.nbytes} bytes>"
+
+
+def prepare_for_vision(asset, max_side=VISION_MAX_SIDE, max_bytes=VISION_MAX_BYTES,
+                       image_format=VISION_FORMAT, quality=VISION_QUALITY):
+    """
+    Downscales and re-encodes an image before it is sent to the vision model.
+
+    The EXIF orientation is applied and all metadata (EXIF, GPS, ICC profiles) is stripped. The
+    longest side is capped at max_side, and the quality is lowered step by step down to
+    VISION_MIN_QUALITY, then the image is shrunk further, until the encoding fits max_bytes.
+    Images that are already small JPEGs without metadata are returned unchanged.
+
+    Args:
+        asset (ImageAsset): The uploaded image.
+        max_side (int): The maximum width or height in pixels.
+        max_bytes (int): The maximum size of the encoded image.
+        image_format (str): The output format, "JPEG" or "WEBP".
+        quality (int): The starting encoder quality.
+
+    Returns:
+        ImageAsset: The image to send to the vision model.
+    """
+    # Opening only reads the header, pixels are decoded if the image needs re-encoding
+    image = Image.open(BytesIO(asset.data))
+    if (asset.mime == "image/jpeg" and max(image.size) <= max_side
+            and asset.nbytes <= max_bytes and not has_metadata(image)):
+        return asset
+
+    # Apply the EXIF orientation before the metadata is dropped
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ("RGB", "L"):
+        # Flatten transparency on white, JPEG has no alpha channel
+        background = Image.new("RGB", image.size, "white")
+        background.paste(image, mask=image.convert("RGBA").getchannel("A"))
+        image = background
+    image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    mime = "image/webp" if image_format == "WEBP" else "image/jpeg"
+    while True:
+        buffered = BytesIO()
+        # No exif/icc_profile arguments, so the output carries no metadata
+        image.save(buffered, format=image_format, quality=quality, optimize=True)
+        data = buffered.getvalue()
+        if len(data) <= max_bytes or max(image.size) <= 256:
+            return ImageAsset(data, mime)
+        if quality > VISION_MIN_QUALITY:
+            quality = max(VISION_MIN_QUALITY, quality - 10)
+        else:
+            image.thumbnail((int(max(image.size) * 0.8),) * 2, Image.LANCZOS)
@@ -0,0 +1,437 @@
+"""
+Load test replaying user sessions through the event handlers wired in gradio_ui.py, against local stubs.
+
+Each session logs in (or continues as a guest), submits a text, voice or image query, reads the
+streamed diagnosis, asks follow-up questions and generates a report, calling the same functions,
+with the same concurrency limits, as the Gradio events do. Groq, pollinations, apitemplate and
+Firebase are replaced by local stubs with configurable latencies.
+
+Usage:
+    python load_test.py [--sessions 40] [--concurrency 8] [--followups 2] [--llm-latency 0.3] ...
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import wave
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+from io import BytesIO
+from PIL import Image
+from benchmark import StubServer, percentile, synthetic_photo
+
+# Queries the sessions pick from, with the number of days the condition lasted
+QUERIES = [
+    "I have an itchy red rash on my forearm since {days} days, it started after gardening.",
+    "My throat has been sore for {days} days and it hurts to swallow, I also have a mild fever.",
+    "There is a small painful bump on my eyelid that appeared {days} days ago.",
+    "My knee is swollen and stiff for {days} days after a run, it hurts when I climb stairs.",
+    "I have dry, flaky patches of skin on my elbows for {days} days that sometimes bleed.",
+]
+
+FOLLOWUPS = [
+    "Should I see a doctor in person?",
+    "Can I take ibuprofen for the pain?",
+    "Is it contagious for my family?",
+    "What should I avoid eating meanwhile?",
+    "How long does it usually take to heal?",
+]
+
+DIAGNOSIS = ("Based on your description, this looks like a mild contact dermatitis, an irritation of the skin. "
+             "Wash the area with lukewarm water and a gentle soap, and avoid scratching it. "
+             "A cold compress and an over the counter hydrocortisone cream can ease the itching. "
+             "Keep the skin moisturized and wear gloves when you garden. "
+             "If the rash spreads, blisters or does not improve within a week, please see a doctor.")
+
+FOLLOWUP_REPLY = ("That is a sensible question. In most cases rest and the measures I mentioned are enough, "
+                  "but see a doctor if the symptoms get worse or new ones appear.")
+
+REPORT_JSON = json.dumps({
+    "Symptoms": "<p>Itchy red rash on the forearm, mild swelling, no fever.</p>",
+    "Observations": "<p>Presentation consistent with contact dermatitis after exposure to plants.</p>",
+    "Recommendations": "<ul><li>Wash the area</li><li>Cold compress</li><li>Hydrocortisone cream</li></ul>",
+})
+
+# A 128 kbps, 44.1 kHz MPEG-1 Layer III frame header, frames are 417 bytes, 26 ms of audio each
+MP3_FRAME = b"\xff\xfb\x90\x64" + bytes(413)
+
+
+class GroqStub:
+    """
+    Answers the Groq API endpoints the app calls, with a latency per call and per streamed token.
+
+    Chat replies are chosen from the request: streamed diagnoses, JSON reports, image prompts,
+    and follow-up or summary replies.
+    """
+
+    def __init__(self, llm_latency, token_interval, stt_latency, tts_latency):
+        self.llm_latency = llm_latency
+        self.token_interval = token_interval
+        self.stt_latency = stt_latency
+        self.tts_latency = tts_latency
+        self.calls = defaultdict(int)
+        self._lock = threading.Lock()
+
+    @property
+    def routes(self):
+        """The stub routes, for StubServer."""
+        return {
+            ("POST", "/openai/v1/chat/completions"): self.chat,
+            ("POST", "/openai/v1/audio/transcriptions"): self.transcription,
+            ("POST", "/openai/v1/audio/speech"): self.speech,
+        }
+
+    def _count(self, endpoint):
+        with self._lock:
+            self.calls[endpoint] += 1
+
+    def chat(self, body):
+        request = json.loads(body)
+        if request.get("stream"):
+            self._count("chat_stream")
+            return 200, "text/event-stream", self._stream(request["model"], DIAGNOSIS)
+        self._count("chat")
+        time.sleep(self.llm_latency)
+        if request.get("response_format", {}).get("type") == "json_object":
+            content = REPORT_JSON
+        elif request["model"] == "compound-beta-mini":
+            content = "red itchy skin rash on forearm"
+        else:
+            content = FOLLOWUP_REPLY
+        completion = {
+            "id": "stub", "object": "chat.completion", "created": int(time.time()), "model": request["model"],
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        }
+        return 200, "application/json", json.dumps(completion).encode("utf-8")
+
+    def _stream(self, model, text):
+        """Streams a reply as server-sent events, one word at a time."""
+        time.sleep(self.llm_latency)
+        for word in text.split(" "):
+            chunk = {"id": "stub", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                     "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}]}
+            yield f"data: {json.dumps(chunk)}\n\n".encode("utf-8")
+            time.sleep(self.token_interval)
+        yield b"data: [DONE]\n\n"
+
+    def transcription(self, body):
+        self._count("transcription")
+        time.sleep(self.stt_latency)
+        text = random.choice(QUERIES).format(days=random.randint(1, 30))
+        return 200, "application/json", json.dumps({"text": text}).encode("utf-8")
+
+    def speech(self, body):
+        self._count("speech")
+        # About 15 characters of text per second of speech
+        frames = 38 * max(1, len(json.loads(body).get("input", "")) // 15)
+
+        def stream():
+            time.sleep(self.tts_latency)
+            # Sent in chunks that don't line up with the frames, like a real stream
+            audio = MP3_FRAME * frames
+            for start in range(0, len(audio), 4000):
+                yield audio[start:start + 4000]
+
+        return 200, "audio/mpeg", stream()
+
+
+class LatencyRepository:
+    """Wraps a patient repository, adding a round-trip latency to each call, like Firestore would."""
+
+    def __init__(self, repository, latency):
+        self.repository = repository
+        self.latency = latency
+
+    def __getattr__(self, name):
+        method = getattr(self.repository, name)
+
+        def call(*args, **kwargs):
+            time.sleep(self.latency)
+            return method(*args, **kwargs)
+
+        return call
+
+
+class AuthStub:
+    """Stands in for the pyrebase auth client, accepting every sign in after a latency."""
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def sign_in_with_email_and_password(self, email, password):
+        time.sleep(self.latency)
+        return {"email": email}
+
+    def create_user_with_email_and_password(self, email, password):
+        time.sleep(self.latency)
+        return {"email": email}
+
+
+class EventLimits:
+    """
+    Applies the concurrency limits Gradio's queue applies to the events.
+
+    Events sharing a concurrency_id share a limit, events without a concurrency_limit get
+    Gradio's default limit of 1, and a limit of None removes it.
+    """
+
+    def __init__(self):
+        self._semaphores = {}
+
+    @asynccontextmanager
+    async def slot(self, concurrency_id, limit=1):
+        if limit is None:
+            yield
+            return
+        semaphore = self._semaphores.setdefault(concurrency_id, asyncio.Semaphore(limit))
+        async with semaphore:
+            yield
+
+
+class Recorder:
+    """Collects the duration and outcome of each stage."""
+
+    def __init__(self):
+        self.timings = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    @asynccontextmanager
+    async def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.errors[name] += 1
+            raise
+        self.timings[name].append(time.perf_counter() - start)
+
+    def mark(self, name, start):
+        """Records a duration measured from start, e.g. the time to the first streamed chunk."""
+        self.timings[name].append(time.perf_counter() - start)
+
+
+def peak_rss_mb():
+    """Returns the peak resident set size of the process, in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes
+    return peak / 1024 if sys.platform != "darwin" else peak / 1024 / 1024
+
+
+def write_voice_query(path, seconds=3):
+    """Writes a silent WAV recording standing in for a voice query."""
+    with wave.open(path, "wb") as recording:
+        recording.setnchannels(1)
+        recording.setsampwidth(2)
+        recording.setframerate(16000)
+        recording.writeframes(bytes(32000 * seconds))
+
+
+async def run_session(number, ui, limits, recorder, args, inputs):
+    """Replays one session through the Gradio event handlers, in the order the UI triggers them."""
+    from concurrency import EVENT_CONCURRENCY
+    rng = random.Random(args.seed + number)
+    request = SimpleNamespace(session_hash=f"load-test-{number}")
+    email = f"patient{number % args.patients}@example.com"
+    logged_in = rng.random() < args.login_ratio
+
+    if logged_in:
+        async with recorder.stage("login"):
+            async with limits.slot("login_auth"):
+                _, email, name, _ = await asyncio.to_thread(ui.login_auth, email, "password")
+        async with limits.slot("login_success"):
+            await asyncio.to_thread(ui.login_success, True, request)
+    else:
+        name = None
+        async with limits.slot("continue_as_guest"):
+            await asyncio.to_thread(ui.continue_as_guest, request)
+
+    # A typed, spoken or photographed query
+    kind = rng.choices(("text", "voice", "image"), weights=args.mix)[0]
+    query = {"text": rng.choice(QUERIES).format(days=rng.randint(1, 30)), "files": []}
+    if kind == "voice":
+        query = {"text": "", "files": [inputs["voice"]]}
+    elif kind == "image":
+        query["files"] = [inputs["image"]]
+
+    async with recorder.stage(f"stt_and_images[{kind}]"):
+        async with limits.slot("query", EVENT_CONCURRENCY["query"]):
+            stt, encoded_image, image_url = await ui.generate_stt_and_images_async(query)
+    async with recorder.stage("query_func"):
+        async with limits.slot("query_func"):
+            _, _, report_image = await asyncio.to_thread(ui.query_func, stt, encoded_image, image_url)
+
+    conversation = None
+    async with recorder.stage("response"):
+        async with limits.slot("query", EVENT_CONCURRENCY["query"]):
+            start = time.perf_counter()
+            first_text = first_audio = True
+            async for audio, text, history in ui.generate_response_stream_async(stt, encoded_image, request):
+                if text and first_text:
+                    recorder.mark("response_first_text", start)
+                    first_text = False
+                if audio and first_audio:
+                    recorder.mark("response_first_audio", start)
+                    first_audio = False
+                if isinstance(history, ui.Conversation):
+                    conversation = history
+
+    for _ in range(args.followups):
+        async with recorder.stage("followup"):
+            async with limits.slot("followup", EVENT_CONCURRENCY["followup"]):
+                conversation, _ = await ui.generate_followup_response_async(
+                    {"text": rng.choice(FOLLOWUPS), "files": []}, conversation)
+
+    if logged_in:
+        async with recorder.stage("report"):
+            async with limits.slot("submit_report", None):
+                job_id, _, _ = await asyncio.to_thread(ui.submit_report, conversation, name, email, report_image)
+            link = ""
+            async with limits.slot("watch_report", None):
+                async for _, link in ui.watch_report_async(job_id):
+                    pass
+            if "<a" not in link:
+                raise RuntimeError(f"Report job {job_id} failed")
+
+    async with limits.slot("back_to_login"):
+        await asyncio.to_thread(ui.back_to_login, request)
+
+
+async def run_load(ui, args, inputs):
+    """Runs the sessions, at most args.concurrency at a time."""
+    limits, recorder = EventLimits(), Recorder()
+    users = asyncio.Semaphore(args.concurrency)
+    failed = 0
+
+    async def user(number):
+        nonlocal failed
+        async with users:
+            try:
+                await run_session(number, ui, limits, recorder, args, inputs)
+            except Exception as e:
+                failed += 1
+                if failed <= 3:
+                    print(f"session {number} failed: {e!r}", file=sys.stderr)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user(number) for number in range(args.sessions)))
+    return recorder, time.perf_counter() - start, failed
+
+
+def configure(args, stubs, tmp):
+    """Points the app at the stubs and temporary directories, before any of its modules is imported."""
+    groq, images, pdf = stubs
+    os.environ.update({
+        "GROQ_API_KEY": "load-test",
+        "GROQ_BASE_URL": groq.url,
+        "IMAGE_API_BASE_URL": images.url,
+        "PDF_API_BASE_URL": pdf.url,
+        "PDF_RENDERER": args.pdf,
+        "PATIENT_STORE": "memory",
+        "REPORT_STORE": "local",
+        "REPORT_STORE_DIR": os.path.join(tmp, "reports"),
+        "TTS_AUDIO_DIR": os.path.join(tmp, "audio"),
+        "RESPONSE_CACHE_DIR": os.path.join(tmp, "cache"),
+        # Poll the report jobs often enough that polling doesn't dominate the report time
+        "REPORT_JOB_POLL_SECONDS": str(args.poll),
+    })
+
+
+def install_fakes(args):
+    """Replaces the Firebase services with latency-configurable stubs, and registers the patients."""
+    from API_Config import services
+    from patient_repository import InstrumentedPatientRepository, MemoryPatientRepository, user_key
+    repository = MemoryPatientRepository()
+    for number in range(args.patients):
+        email = f"patient{number}@example.com"
+        repository.put_patient(user_key(email), {"name": f"Patient {number}", "email": email})
+    services.override("patients", InstrumentedPatientRepository(LatencyRepository(repository, args.db_latency), "memory"))
+    services.override("auth", AuthStub(args.db_latency))
+    services.override("pdf_api_key", "load-test")
+
+
+def print_results(recorder, elapsed, failed, args, groq, rss_before):
+    """Prints the throughput, the latency percentiles of each stage and the peak memory."""
+    events = sum(len(timings) for name, timings in recorder.timings.items() if not name.startswith("response_first"))
+    print(f"{args.sessions} sessions, {args.concurrency} concurrent, {failed} failed, in {elapsed:.2f} s: "
+          f"{(args.sessions - failed) / elapsed:.2f} sessions/s, {events / elapsed:.2f} events/s")
+    print(f"{'stage':<26} {'count':>6} {'errors':>7} {'p50 s':>8} {'p95 s':>8} {'p99 s':>8} {'max s':>8}")
+    results = {}
+    for name in sorted(set(recorder.timings) | set(recorder.errors)):
+        timings = recorder.timings.get(name) or [0.0]
+        results[name] = {"count": len(recorder.timings.get(name, [])), "errors": recorder.errors.get(name, 0),
+                         "p50": statistics.median(timings), "p95": percentile(timings, 95),
+                         "p99": percentile(timings, 99), "max": max(timings)}
+        row = results[name]
+        print(f"{name:<26} {row['count']:>6} {row['errors']:>7} {row['p50']:>8.3f} {row['p95']:>8.3f} "
+              f"{row['p99']:>8.3f} {row['max']:>8.3f}")
+    rss = peak_rss_mb()
+    print(f"peak RSS {rss:.1f} MB ({rss_before:.1f} MB before the load)")
+    print("upstream calls: " + ", ".join(f"{endpoint} {count}" for endpoint, count in sorted(groq.calls.items())))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"sessions": args.sessions, "failed": failed, "seconds": elapsed,
+                       "sessions_per_second": (args.sessions - failed) / elapsed, "peak_rss_mb": rss,
+                       "stages": results}, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=40, help="Sessions to replay.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Sessions running at the same time.")
+    parser.add_argument("--followups", type=int, default=2, help="Follow-up questions per session.")
+    parser.add_argument("--login-ratio", type=float, default=0.7, help="Share of sessions logging in and generating a report.")
+    parser.add_argument("--mix", type=float, nargs=3, default=(0.5, 0.3, 0.2), metavar=("TEXT", "VOICE", "IMAGE"),
+                        help="Weights of the text, voice and image queries.")
+    parser.add_argument("--patients", type=int, default=20, help="Registered patients the sessions log in as.")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="Seconds until a chat reply, or its first token.")
+    parser.add_argument("--token-interval", type=float, default=0.01, help="Seconds between streamed tokens.")
+    parser.add_argument("--stt-latency", type=float, default=0.4)
+    parser.add_argument("--tts-latency", type=float, default=0.3)
+    parser.add_argument("--image-latency", type=float, default=0.5, help="Pollinations image download latency.")
+    parser.add_argument("--pdf-latency", type=float, default=0.6, help="apitemplate latency, with --pdf remote.")
+    parser.add_argument("--db-latency", type=float, default=0.05, help="Firebase auth and Firestore call latency.")
+    parser.add_argument("--pdf", choices=("local", "remote"), default="local", help="The report PDF renderer.")
+    parser.add_argument("--poll", type=float, default=0.05, help="Report job polling interval.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write the results to this JSON file, to compare runs.")
+    parser.add_argument("--metrics", help="Also write the app's metrics to this file, in the Prometheus text format.")
+    args = parser.parse_args()
+
+    groq = GroqStub(args.llm_latency, args.token_interval, args.stt_latency, args.tts_latency)
+    image = BytesIO()
+    Image.effect_noise((256, 256), 40).convert("RGB").save(image, format="JPEG")
+    image_route = {("GET", "/p/*"): lambda body: (200, "image/jpeg", image.getvalue())}
+    pdf_routes = {("GET", "/download.pdf"): lambda body: (200, "application/pdf", b"%PDF-1.4\n%%EOF\n")}
+
+    with tempfile.TemporaryDirectory() as tmp, StubServer(groq.routes) as groq_server, \
+            StubServer(image_route, latency=args.image_latency) as image_server, \
+            StubServer(pdf_routes, latency=args.pdf_latency) as pdf_server:
+        pdf_routes[("POST", "/v2/create-pdf")] = lambda body: (
+            200, "application/json", json.dumps({"download_url": pdf_server.url + "/download.pdf"}).encode("utf-8"))
+        configure(args, (groq_server, image_server, pdf_server), tmp)
+        voice = os.path.join(tmp, "query.wav")
+        write_voice_query(voice)
+        inputs = {"voice": voice, "image": synthetic_photo(tmp, 1600, 1200)}
+
+        # Builds the interface, as the app does, without launching it
+        import gradio_ui as ui
+        install_fakes(args)
+        rss_before = peak_rss_mb()
+        recorder, elapsed, failed = asyncio.run(run_load(ui, args, inputs))
+        print_results(recorder, elapsed, failed, args, groq, rss_before)
+        if args.metrics:
+            from metrics import render_prometheus
+            with open(args.metrics, "w") as f:
+                f.write(render_prometheus())
+
+
+if __name__ == "__main__":
+    main()
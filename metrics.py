@@ -0,0 +1,288 @@
+import math
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Default histogram buckets (seconds) for upstream latencies
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Histogram buckets (bytes) for payload sizes, from 256 B to 16 MB
+SIZE_BUCKETS = tuple(256 * 4 ** i for i in range(9))
+
+# Content type of the Prometheus text exposition format
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Registry of every metric created in the process, keyed by metric name
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def _label_key(labels):
+    """
+    Converts keyword labels to a hashable, order independent key.
+
+    Args:
+        labels (dict): The label names and values.
+
+    Returns:
+        tuple: The sorted (name, value) pairs.
+    """
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Counter:
+    """A monotonically increasing counter, optionally split by labels."""
+
+    kind = "counter"
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        """
+        Increments the counter.
+
+        Args:
+            amount (float): The amount to add.
+            **labels: The label values for this sample.
+        """
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        """Returns the current value for the given labels."""
+        return self._values.get(_label_key(labels), 0)
+
+    def samples(self):
+        """Returns a copy of every (labels, value) pair."""
+        with self._lock:
+            return dict(self._values)
+
+
+class Gauge:
+    """A value that can go up and down, or be read from a callback when sampled."""
+
+    kind = "gauge"
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self._values = {}
+        self._callbacks = {}
+        self._lock = threading.Lock()
+
+    def set(self, value, **labels):
+        """Sets the gauge to the given value."""
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        """Increments the gauge."""
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        """Decrements the gauge."""
+        self.inc(-amount, **labels)
+
+    def set_function(self, fn, **labels):
+        """
+        Reads the gauge value from a callback, evaluated only when the gauge is sampled.
+
+        Args:
+            fn (callable): A function returning the current value.
+            **labels: The label values for this sample.
+        """
+        with self._lock:
+            self._callbacks[_label_key(labels)] = fn
+
+    def value(self, **labels):
+        """Returns the current value for the given labels."""
+        key = _label_key(labels)
+        if key in self._callbacks:
+            return self._callbacks[key]()
+        return self._values.get(key, 0)
+
+    def samples(self):
+        """Returns a copy of every (labels, value) pair."""
+        with self._lock:
+            values = dict(self._values)
+            callbacks = dict(self._callbacks)
+        for key, fn in callbacks.items():
+            try:
+                values[key] = fn()
+            except Exception:
+                # A broken callback must never break sampling of the other gauges
+                continue
+        return values
+
+
+class Histogram:
+    """
+    A bucketed histogram, optionally split by labels.
+
+    An observation increments the one bucket it falls in; the counts are only made cumulative
+    when the histogram is sampled.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, description, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        """
+        Records one observation.
+
+        Args:
+            value (float): The observed value.
+            **labels: The label values for this sample.
+        """
+        key = _label_key(labels)
+        # The first bucket whose bound is at least the value, len(buckets) for the +Inf bucket
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"buckets": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            state["buckets"][index] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes the wall-clock duration of the wrapped block, in seconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        """Returns a copy of every (labels, state) pair, with the cumulative count of each bucket."""
+        with self._lock:
+            values = {k: (list(v["buckets"]), v["sum"], v["count"]) for k, v in self._values.items()}
+        samples = {}
+        for key, (counts, total, count) in values.items():
+            cumulative, running = [], 0
+            for bucket_count in counts[:-1]:
+                running += bucket_count
+                cumulative.append(running)
+            samples[key] = {"buckets": cumulative, "sum": total, "count": count}
+        return samples
+
+
+def _get_or_create(cls, name, description, **kwargs):
+    """
+    Returns the metric registered under name, creating it on first use.
+
+    Args:
+        cls (type): The metric class.
+        name (str): The metric name.
+        description (str): A one-line description of the metric.
+
+    Returns:
+        Counter | Gauge | Histogram: The registered metric.
+
+    Raises:
+        ValueError: If the name is already registered with a different type.
+    """
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = cls(name, description, **kwargs)
+        elif not isinstance(metric, cls):
+            raise ValueError(f"Metric {name} is already registered as a {metric.kind}.")
+        return metric
+
+
+def counter(name, description):
+    """Returns the process-wide counter with the given name."""
+    return _get_or_create(Counter, name, description)
+
+
+def gauge(name, description):
+    """Returns the process-wide gauge with the given name."""
+    return _get_or_create(Gauge, name, description)
+
+
+def histogram(name, description, buckets=DEFAULT_BUCKETS):
+    """Returns the process-wide histogram with the given name."""
+    return _get_or_create(Histogram, name, description, buckets=buckets)
+
+
+def snapshot():
+    """
+    Returns the current value of every registered metric.
+
+    Returns:
+        dict: Metric name to {labels: value} mapping.
+    """
+    with _registry_lock:
+        metrics = list(_registry.values())
+    return {m.name: m.samples() for m in metrics}
+
+
+def _format_value(value):
+    """Formats a sample value for the Prometheus text format."""
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, int):
+        return str(value)
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value)
+
+
+def _escape_label(value):
+    """Escapes a label value: backslashes, double quotes and newlines."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key, extra=()):
+    """Formats a label key, and any extra (name, value) pairs, as a Prometheus label set."""
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label(value)}"' for name, value in pairs) + "}"
+
+
+def render_prometheus():
+    """
+    Renders every registered metric in the Prometheus text exposition format.
+
+    The metrics are only read here, so recording them costs nothing more when no one scrapes.
+
+    Returns:
+        str: The metrics, to serve with PROMETHEUS_CONTENT_TYPE.
+    """
+    with _registry_lock:
+        metrics = sorted(_registry.values(), key=lambda m: m.name)
+    lines = []
+    for metric in metrics:
+        description = metric.description.replace("\\", "\\\\").replace("\n", "\\n")
+        lines.append(f"# HELP {metric.name} {description}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for key, value in sorted(metric.samples().items()):
+            if metric.kind != "histogram":
+                lines.append(f"{metric.name}{_format_labels(key)} {_format_value(value)}")
+                continue
+            for bound, count in zip(metric.buckets, value["buckets"]):
+                lines.append(f"{metric.name}_bucket{_format_labels(key, [('le', _format_value(bound))])} {count}")
+            lines.append(f"{metric.name}_bucket{_format_labels(key, [('le', '+Inf')])} {value['count']}")
+            lines.append(f"{metric.name}_sum{_format_labels(key)} {_format_value(value['sum'])}")
+            lines.append(f"{metric.name}_count{_format_labels(key)} {value['count']}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,407 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from bisect import insort
+from concurrent.futures import ThreadPoolExecutor
+from metrics import counter, histogram
+
+# Backend holding patients and report metadata: "firestore", "sqlite" or "memory"
+PATIENT_STORE = os.environ.get("PATIENT_STORE", "firestore")
+
+# SQLite file used by the "sqlite" backend
+PATIENT_DB = os.environ.get("PATIENT_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "patients.db"))
+
+# Field of the patient document listing the kept reports, oldest first
+RING_FIELD = "recent_reports"
+
+# Firestore accepts at most 500 writes per batch
+MAX_BATCH_WRITES = 500
+
+# Threads running independent Firestore reads at the same time
+FIRESTORE_READ_WORKERS = int(os.environ.get("FIRESTORE_READ_WORKERS", 8))
+
+repository_call_seconds = histogram(
+    "repository_call_seconds", "Latency of patient repository calls, by backend, operation and outcome.")
+repository_errors = counter("repository_errors_total", "Failed patient repository calls, by backend, operation and error type.")
+
+
+def user_key(email):
+    """
+    Builds the key a patient and their reports are stored under, from their email.
+
+    Args:
+        email (str): The patient's email.
+
+    Returns:
+        str: The patient key, also the Firestore document id.
+    """
+    return email.replace(".com", "").lower()
+
+
+def _ring_entry(report_data):
+    """Returns the part of a report's metadata kept in the ring: enough to delete it without reading it."""
+    return {"report_id": report_data["report_id"], "blob_key": report_data.get("blob_key"),
+            "date": report_data.get("date")}
+
+
+class PatientRepository(ABC):
+    """
+    Stores patients and the metadata of their reports, independently of the database behind.
+
+    Reports are ordered by their "date", newest first. Saving a report keeps only the latest
+    ones of its patient, and returns the others so their PDFs can be deleted.
+    """
+
+    @abstractmethod
+    def get_patient(self, key):
+        """
+        Reads a patient.
+
+        Args:
+            key (str): The patient key, from user_key().
+
+        Returns:
+            dict: The patient data, or None if the patient does not exist.
+        """
+
+    @abstractmethod
+    def put_patient(self, key, data):
+        """
+        Creates or replaces a patient.
+
+        Args:
+            key (str): The patient key.
+            data (dict): The patient data, e.g. name and email.
+        """
+
+    @abstractmethod
+    def latest_reports(self, key, limit):
+        """
+        Reads a patient's latest reports.
+
+        Args:
+            key (str): The patient key.
+            limit (int): The number of reports to read, or None for all of them.
+
+        Returns:
+            list: The report metadata dicts, newest first.
+        """
+
+    def get_dashboard(self, key, limit):
+        """
+        Reads a patient and their latest reports in one call, as the login needs them.
+
+        Args:
+            key (str): The patient key.
+            limit (int): The number of reports to read.
+
+        Returns:
+            tuple: The patient data, or None if the patient does not exist, and the report metadata dicts.
+        """
+        patient = self.get_patient(key)
+        return patient, self.latest_reports(key, limit) if patient is not None else []
+
+    @abstractmethod
+    def save_report(self, key, report_data, keep):
+        """
+        Saves a report's metadata and deletes the patient's reports beyond the latest `keep`, atomically.
+
+        Args:
+            key (str): The patient key.
+            report_data (dict): The report metadata, with its report_id, date and blob_key.
+            keep (int): The number of reports kept.
+
+        Returns:
+            list: The evicted reports, with their report_id and blob_key, or None if the
+            backend could not tell and compact() must be run.
+        """
+
+    @abstractmethod
+    def put_reports(self, key, reports):
+        """
+        Writes several reports of a patient in batched writes, without any eviction.
+
+        Args:
+            key (str): The patient key.
+            reports (list): The report metadata dicts.
+        """
+
+    @abstractmethod
+    def delete_reports(self, key, report_ids):
+        """
+        Deletes several reports of a patient in batched writes.
+
+        Args:
+            key (str): The patient key.
+            report_ids (list): The ids of the reports.
+        """
+
+    def compact(self, key, keep):
+        """
+        Deletes a patient's reports beyond the latest `keep`, whatever their number.
+
+        Args:
+            key (str): The patient key.
+            keep (int): The number of reports kept.
+
+        Returns:
+            list: The evicted reports.
+        """
+        evicted = self.latest_reports(key, None)[keep:]
+        self.delete_reports(key, [report["report_id"] for report in evicted])
+        return evicted
+
+
+class MemoryPatientRepository(PatientRepository):
+    """Keeps patients and reports in memory; for development, benchmarks and load tests."""
+
+    def __init__(self):
+        self._patients = {}
+        self._reports = {}  # key -> [(date, report_id, report_data)], oldest first
+        self._lock = threading.Lock()
+
+    def get_patient(self, key):
+        with self._lock:
+            patient = self._patients.get(key)
+            return dict(patient) if patient is not None else None
+
+    def put_patient(self, key, data):
+        with self._lock:
+            self._patients[key] = dict(data)
+
+    def latest_reports(self, key, limit):
+        with self._lock:
+            reports = self._reports.get(key, [])
+            newest = reversed(reports[-limit:] if limit else reports)
+            return [dict(report_data) for _, _, report_data in newest]
+
+    def _insert(self, key, report_data):
+        """Adds a report in date order, replacing any report with the same id. The caller holds the lock."""
+        reports = self._reports.setdefault(key, [])
+        reports[:] = [r for r in reports if r[1] != report_data["report_id"]]
+        insort(reports, (str(report_data.get("date", "")), report_data["report_id"], dict(report_data)))
+        return reports
+
+    def save_report(self, key, report_data, keep):
+        with self._lock:
+            reports = self._insert(key, report_data)
+            evicted, reports[:] = reports[:-keep], reports[-keep:]
+            return [dict(report_data) for _, _, report_data in evicted]
+
+    def put_reports(self, key, reports):
+        with self._lock:
+            for report_data in reports:
+                self._insert(key, report_data)
+
+    def delete_reports(self, key, report_ids):
+        report_ids = set(report_ids)
+        with self._lock:
+            reports = self._reports.get(key, [])
+            reports[:] = [r for r in reports if r[1] not in report_ids]
+
+
+class SQLitePatientRepository(PatientRepository):
+    """
+    Keeps patients and reports in a SQLite file, to run the app without Firebase or keep hot reads local.
+
+    Reports are indexed by patient and date, so the latest reports are read, and the evicted
+    ones found, without scanning the patient's other reports.
+    """
+
+    def __init__(self, path=PATIENT_DB):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS patients (key TEXT PRIMARY KEY, data TEXT)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS reports (key TEXT, report_id TEXT, date TEXT, data TEXT, "
+                "PRIMARY KEY (key, report_id))")
+            conn.execute("CREATE INDEX IF NOT EXISTS reports_latest ON reports (key, date DESC)")
+
+    def _connect(self):
+        """Returns this thread's connection, sqlite3 connections can't be shared between threads."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def get_patient(self, key):
+        row = self._connect().execute("SELECT data FROM patients WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_patient(self, key, data):
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO patients VALUES (?, ?)", (key, json.dumps(data, default=str)))
+
+    def latest_reports(self, key, limit):
+        # LIMIT -1 reads every report
+        rows = self._connect().execute(
+            "SELECT data FROM reports WHERE key = ? ORDER BY date DESC LIMIT ?", (key, limit or -1)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def _rows(self, key, reports):
+        """Converts report metadata to table rows."""
+        return [(key, r["report_id"], str(r.get("date", "")), json.dumps(r, default=str)) for r in reports]
+
+    def save_report(self, key, report_data, keep):
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO reports VALUES (?, ?, ?, ?)", *self._rows(key, [report_data]))
+            # Walks the index past the kept reports, the rest are evicted
+            evicted = [json.loads(row[0]) for row in conn.execute(
+                "SELECT data FROM reports WHERE key = ? ORDER BY date DESC LIMIT -1 OFFSET ?", (key, keep))]
+            conn.executemany("DELETE FROM reports WHERE key = ? AND report_id = ?",
+                             [(key, r["report_id"]) for r in evicted])
+        return evicted
+
+    def put_reports(self, key, reports):
+        with self._connect() as conn:
+            conn.executemany("INSERT OR REPLACE INTO reports VALUES (?, ?, ?, ?)", self._rows(key, reports))
+
+    def delete_reports(self, key, report_ids):
+        with self._connect() as conn:
+            conn.executemany("DELETE FROM reports WHERE key = ? AND report_id = ?",
+                             [(key, report_id) for report_id in report_ids])
+
+
+class FirestorePatientRepository(PatientRepository):
+    """
+    Keeps patients in the Firestore "Patients" collection, and reports in each patient's "Reports" subcollection.
+
+    The patient document holds a ring of the kept reports. Saving a report reads that document,
+    and writes the new report, the updated ring and the deletion of the reports that fell out of
+    it in one transaction, without reading the Reports subcollection. New patients are created
+    with an empty ring by register(). Only patients saved before the ring existed lack it, and
+    are compacted once to create it: a one-off migration, not a path new users take.
+    """
+
+    def __init__(self, db, read_workers=FIRESTORE_READ_WORKERS):
+        self.db = db
+        self._read_pool = ThreadPoolExecutor(max_workers=read_workers, thread_name_prefix="firestore-read")
+
+    def _patient_ref(self, key):
+        """Returns the reference to a patient document."""
+        return self.db.collection("Patients").document(key)
+
+    def get_patient(self, key):
+        snapshot = self._patient_ref(key).get()
+        return snapshot.to_dict() if snapshot.exists else None
+
+    def put_patient(self, key, data):
+        self._patient_ref(key).set(data)
+
+    def latest_reports(self, key, limit):
+        query = self._patient_ref(key).collection("Reports").order_by("date", direction="DESCENDING")
+        if limit:
+            query = query.limit(limit)
+        # The document id is the report id, legacy reports may not repeat it in their fields
+        return [dict(r.to_dict(), report_id=r.id) for r in query.stream()]
+
+    def get_dashboard(self, key, limit):
+        # The reads are independent, so the login waits for the slower one instead of both in turn
+        patient_future = self._read_pool.submit(self.get_patient, key)
+        reports_future = self._read_pool.submit(self.latest_reports, key, limit)
+        patient = patient_future.result()
+        if patient is None:
+            reports_future.cancel()
+            return None, []
+        return patient, reports_future.result()
+
+    def save_report(self, key, report_data, keep):
+        from google.cloud import firestore
+        patient_ref = self._patient_ref(key)
+        reports_ref = patient_ref.collection("Reports")
+
+        @firestore.transactional
+        def save(transaction):
+            snapshot = patient_ref.get(transaction=transaction)
+            ring = (snapshot.to_dict() or {}).get(RING_FIELD) if snapshot.exists else None
+            transaction.set(reports_ref.document(report_data["report_id"]), report_data)
+            if ring is None:
+                # A patient from before the ring existed: the backlog is unknown until compact() has
+                # listed it once, which migrates them to the ring
+                return None
+            # Append the new report, and evict the oldest ones beyond the limit
+            ring = [entry for entry in ring if entry["report_id"] != report_data["report_id"]]
+            ring.append(_ring_entry(report_data))
+            evicted, ring = ring[:-keep], ring[-keep:]
+            for entry in evicted:
+                transaction.delete(reports_ref.document(entry["report_id"]))
+            transaction.set(patient_ref, {RING_FIELD: ring}, merge=True)
+            return evicted
+
+        return save(self.db.transaction())
+
+    def _batched(self, key, reports, write):
+        """Applies a write to each report in as few batched commits as Firestore allows."""
+        reports_ref = self._patient_ref(key).collection("Reports")
+        for start in range(0, len(reports), MAX_BATCH_WRITES):
+            batch = self.db.batch()
+            for report in reports[start:start + MAX_BATCH_WRITES]:
+                write(batch, reports_ref, report)
+            batch.commit()
+
+    def put_reports(self, key, reports):
+        self._batched(key, list(reports),
+                      lambda batch, ref, report_data: batch.set(ref.document(report_data["report_id"]), report_data))
+
+    def delete_reports(self, key, report_ids):
+        self._batched(key, list(report_ids), lambda batch, ref, report_id: batch.delete(ref.document(report_id)))
+
+    def compact(self, key, keep):
+        reports = self.latest_reports(key, None)
+        kept, evicted = reports[:keep], reports[keep:]
+        self.delete_reports(key, [report["report_id"] for report in evicted])
+        # Oldest first, like save_report keeps it
+        self._patient_ref(key).set({RING_FIELD: [_ring_entry(r) for r in reversed(kept)]}, merge=True)
+        return evicted
+
+
+class InstrumentedPatientRepository:
+    """Wraps a patient repository, recording the latency and the errors of each call."""
+
+    def __init__(self, repository, backend):
+        self.repository = repository
+        self.backend = backend
+
+    def __getattr__(self, name):
+        method = getattr(self.repository, name)
+        if name.startswith("_") or not callable(method):
+            return method
+
+        def call(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = method(*args, **kwargs)
+            except Exception as e:
+                repository_call_seconds.observe(time.perf_counter() - start, backend=self.backend, operation=name,
+                                                outcome="error")
+                repository_errors.inc(backend=self.backend, operation=name, error=type(e).__name__)
+                raise
+            repository_call_seconds.observe(time.perf_counter() - start, backend=self.backend, operation=name,
+                                            outcome="ok")
+            return result
+
+        # Cached, so the wrapper is built once per method
+        self.__dict__[name] = call
+        return call
+
+
+def create_patient_repository():
+    """
+    Creates the patient repository selected by PATIENT_STORE, instrumented.
+
+    Returns:
+        PatientRepository: The repository.
+    """
+    if PATIENT_STORE == "memory":
+        repository = MemoryPatientRepository()
+    elif PATIENT_STORE == "sqlite":
+        repository = SQLitePatientRepository()
+    else:
+        from API_Config import services
+        repository = FirestorePatientRepository(services.get("db"))
+    return InstrumentedPatientRepository(repository, PATIENT_STORE)
@@ -0,0 +1,408 @@
+import json
+import os
+import zlib
+from abc import ABC, abstractmethod
+from html.parser import HTMLParser
+from io import BytesIO
+from PIL import Image
+from API_Config import services, template_id
+from concurrency import upstream
+import http_client
+from metrics import histogram
+from response_cache import ContentCache, cache_key
+
+# Base URL of the remote PDF API, configurable so it can point to a local stub
+PDF_API_BASE_URL = os.environ.get("PDF_API_BASE_URL", "https://rest.apitemplate.io").rstrip("/")
+
+# Which renderer builds the report PDF: "local" renders in-process, "remote" calls the PDF API.
+# The local renderer only has Helvetica's WinAnsi characters, it hands reports with other
+# scripts over to the PDF API.
+PDF_RENDERER = os.environ.get("PDF_RENDERER", "local")
+
+# A4 page size and margins, in points
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842
+MARGIN = 56
+
+# Largest size of the image embedded in the report, in points
+MAX_IMAGE_WIDTH, MAX_IMAGE_HEIGHT = 320, 320
+
+# Glyph widths of Helvetica for the printable ASCII characters, in 1/1000 of the font size
+HELVETICA_WIDTHS = dict(zip(
+    (chr(c) for c in range(32, 127)),
+    (278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+     556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+     1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+     667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+     333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+     556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584)))
+
+# Report sections, in the order they appear in the PDF
+SECTIONS = ("Symptoms", "Observations", "Recommendations")
+
+pdf_render_seconds = histogram("pdf_render_seconds", "Time to render a report PDF, by renderer.")
+
+
+class PdfRenderer(ABC):
+    """Turns the report payload into PDF bytes."""
+
+    name = "base"
+
+    @abstractmethod
+    def render(self, payload, image=None):
+        """
+        Renders the report PDF.
+
+        Args:
+            payload (dict): The report fields: name, email, date, Symptoms, Observations,
+                Recommendations, and Image, the image as an HTML <img> tag or "".
+            image (ImageAsset): The image to include in the report, if any.
+
+        Returns:
+            bytes: The PDF file.
+        """
+
+
+class RemotePdfRenderer(PdfRenderer):
+    """Renders the report with the apitemplate.io template, and downloads the PDF."""
+
+    name = "remote"
+
+    def __init__(self, base_url=PDF_API_BASE_URL, template=template_id):
+        self.base_url = base_url
+        self.template = template
+
+    def render(self, payload, image=None):
+        with upstream("pdf"):
+            # Post the report data to the PDF API to generate the report PDF
+            response = http_client.post(
+                "pdf_create",
+                f"{self.base_url}/v2/create-pdf?template_id={self.template}",
+                headers={"X-API-KEY": services.get("pdf_api_key")},
+                json=payload
+            )
+
+            # Check if the API call was successful
+            if response.status_code != 200:
+                raise Exception(f"PDF API error: {response.text}")
+
+            # Get the download URL for the report
+            download_url = response.json().get("download_url")
+            if not download_url:
+                raise Exception("No download_url in API response")
+
+            # Fetch the PDF file content from the download URL
+            file_response = http_client.get("pdf_download", download_url)
+            file_response.raise_for_status()
+            return file_response.content
+
+
+class _TextExtractor(HTMLParser):
+    """Converts the HTML of a report section to paragraphs of plain text."""
+
+    BLOCK_TAGS = {"p", "div", "br", "ul", "ol", "li", "tr", "h1", "h2", "h3", "h4", "h5", "h6"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.paragraphs = []
+        self._current = []
+
+    def _flush(self):
+        """Ends the current paragraph."""
+        text = " ".join("".join(self._current).split())
+        if text:
+            self.paragraphs.append(text)
+        self._current = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.BLOCK_TAGS:
+            self._flush()
+        # List items start with a bullet
+        if tag == "li":
+            self._current.append("• ")
+
+    def handle_endtag(self, tag):
+        if tag in self.BLOCK_TAGS:
+            self._flush()
+
+    def handle_data(self, data):
+        self._current.append(data)
+
+    def close(self):
+        super().close()
+        self._flush()
+
+
+def html_to_paragraphs(html):
+    """
+    Extracts the paragraphs of text from an HTML fragment.
+
+    Args:
+        html (str): The HTML, or plain text.
+
+    Returns:
+        list: The paragraphs, as strings.
+    """
+    parser = _TextExtractor()
+    parser.feed(html or "")
+    parser.close()
+    return parser.paragraphs
+
+
+def text_width(text, size):
+    """Returns the width of the text set in Helvetica at the given size, in points."""
+    return sum(HELVETICA_WIDTHS.get(c, 556) for c in text) * size / 1000
+
+
+def wrap_text(text, size, width):
+    """
+    Breaks a paragraph into lines no wider than width.
+
+    Args:
+        text (str): The paragraph.
+        size (float): The font size.
+        width (float): The line width, in points.
+
+    Returns:
+        list: The lines.
+    """
+    lines, line = [], ""
+    for word in text.split():
+        candidate = f"{line} {word}" if line else word
+        if line and text_width(candidate, size) > width:
+            lines.append(line)
+            line = word
+        else:
+            line = candidate
+    if line:
+        lines.append(line)
+    return lines
+
+
+def winansi_encodable(text):
+    """Returns whether the text can be written with Helvetica's WinAnsiEncoding, e.g. has no Arabic or CJK letters."""
+    try:
+        text.encode("cp1252")
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+def pdf_string(text):
+    """Encodes text as a PDF literal string in WinAnsiEncoding."""
+    data = text.encode("cp1252", errors="replace")
+    return b"(" + data.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b")"
+
+
+class _PdfWriter:
+    """A minimal PDF writer for pages of Helvetica text and one JPEG image."""
+
+    def __init__(self):
+        self.pages = []  # content stream operators of each page
+        self._image = None  # (jpeg bytes, pixel width, pixel height, color space)
+        self._y = 0
+        self.new_page()
+
+    def new_page(self):
+        """Starts a new page, and moves the cursor to its top margin."""
+        self.pages.append([])
+        self._y = PAGE_HEIGHT - MARGIN
+
+    def _ensure_space(self, height):
+        """Starts a new page if the next height points do not fit on this one."""
+        if self._y - height < MARGIN:
+            self.new_page()
+
+    def space(self, height):
+        """Adds vertical space."""
+        self._y -= height
+
+    def text(self, text, size=11, bold=False, center=False, indent=0):
+        """
+        Adds a paragraph, wrapped to the page width.
+
+        Args:
+            text (str): The paragraph.
+            size (float): The font size.
+            bold (bool): Whether to set it in Helvetica-Bold.
+            center (bool): Whether to center each line.
+            indent (float): The left indent, in points.
+        """
+        leading = size * 1.35
+        width = PAGE_WIDTH - 2 * MARGIN - indent
+        for line in wrap_text(text, size, width):
+            self._ensure_space(leading)
+            self._y -= leading
+            x = MARGIN + indent
+            if center:
+                x = (PAGE_WIDTH - text_width(line, size)) / 2
+            font = b"/F2" if bold else b"/F1"
+            self.pages[-1].append(b"BT %s %g Tf %.2f %.2f Td %s Tj ET" % (font, size, x, self._y, pdf_string(line)))
+
+    def image(self, jpeg, pixel_width, pixel_height, color_space):
+        """
+        Adds the image, centered and scaled down to fit MAX_IMAGE_WIDTH x MAX_IMAGE_HEIGHT.
+
+        Args:
+            jpeg (bytes): The JPEG data, embedded as is.
+            pixel_width (int): The image width in pixels.
+            pixel_height (int): The image height in pixels.
+            color_space (str): The PDF color space, DeviceRGB or DeviceGray.
+        """
+        self._image = (jpeg, pixel_width, pixel_height, color_space)
+        scale = min(MAX_IMAGE_WIDTH / pixel_width, MAX_IMAGE_HEIGHT / pixel_height, 1.0)
+        width, height = pixel_width * scale, pixel_height * scale
+        self._ensure_space(height)
+        self._y -= height
+        x = (PAGE_WIDTH - width) / 2
+        self.pages[-1].append(b"q %.2f 0 0 %.2f %.2f %.2f cm /Im1 Do Q" % (width, height, x, self._y))
+
+    def tobytes(self):
+        """
+        Serializes the document.
+
+        Returns:
+            bytes: The PDF file.
+        """
+        # Object numbers: 1 catalog, 2 page tree, 3 and 4 fonts, 5 image, then a page and its content per page
+        first_page = 6
+        page_ids = [first_page + 2 * i for i in range(len(self.pages))]
+        objects = {
+            1: b"<< /Type /Catalog /Pages 2 0 R >>",
+            2: b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+                b" ".join(b"%d 0 R" % i for i in page_ids), len(page_ids)),
+            3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+            4: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>",
+        }
+        resources = b"/Font << /F1 3 0 R /F2 4 0 R >>"
+        if self._image:
+            jpeg, pixel_width, pixel_height, color_space = self._image
+            # A JPEG is embedded as is, PDF readers decode it with the DCTDecode filter
+            objects[5] = (b"<< /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace /%s "
+                          b"/BitsPerComponent 8 /Filter /DCTDecode /Length %d >>\nstream\n%s\nendstream" % (
+                              pixel_width, pixel_height, color_space.encode("ascii"), len(jpeg), jpeg))
+            resources += b" /XObject << /Im1 5 0 R >>"
+        for page_id, operators in zip(page_ids, self.pages):
+            content = zlib.compress(b"\n".join(operators))
+            objects[page_id] = (b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] /Resources << %s >> "
+                                b"/Contents %d 0 R >>" % (PAGE_WIDTH, PAGE_HEIGHT, resources, page_id + 1))
+            objects[page_id + 1] = (b"<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream" % (
+                len(content), content))
+
+        # Write the objects, then the cross-reference table of their byte offsets
+        size = max(objects) + 1
+        out = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        offsets = {}
+        for number in sorted(objects):
+            offsets[number] = len(out)
+            out += b"%d 0 obj\n%s\nendobj\n" % (number, objects[number])
+        xref = len(out)
+        out += b"xref\n0 %d\n0000000000 65535 f \n" % size
+        for number in range(1, size):
+            if number in offsets:
+                out += b"%010d 00000 n \n" % offsets[number]
+            else:
+                out += b"0000000000 65535 f \n"
+        out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (size, xref)
+        return bytes(out)
+
+
+class LocalPdfRenderer(PdfRenderer):
+    """
+    Renders the report PDF in-process, with no network round-trip.
+
+    Reports with text outside WinAnsiEncoding, e.g. non-Latin names, are rendered by the fallback
+    renderer instead, as they would come out as "????" with the standard Helvetica font.
+    """
+
+    name = "local"
+
+    def __init__(self, fallback=None):
+        self.fallback = fallback
+
+    def render(self, payload, image=None):
+        texts = [str(payload.get(label) or "") for label in ("name", "email", "date")]
+        texts += [paragraph for section in SECTIONS for paragraph in html_to_paragraphs(payload.get(section))]
+        if self.fallback is not None and not all(winansi_encodable(text) for text in texts):
+            return self.fallback.render(payload, image)
+
+        writer = _PdfWriter()
+
+        # Header, with the patient's details
+        writer.text("Medical Report", size=18, bold=True, center=True)
+        writer.space(8)
+        for label in ("name", "email", "date"):
+            writer.text(f"{label.capitalize()}: {payload.get(label) or ''}")
+
+        # The image, only if it could be included in the report
+        if image is not None and payload.get("Image"):
+            writer.space(12)
+            writer.text("Image", size=14, bold=True, center=True)
+            writer.space(6)
+            jpeg = image.jpeg_bytes
+            # The size and color space are read from the JPEG actually embedded, opening it only reads its header
+            embedded = Image.open(BytesIO(jpeg))
+            if embedded.mode not in ("RGB", "L"):
+                # jpeg_bytes keeps JPEGs as they are, so CMYK and other JPEGs are re-encoded to RGB here
+                buffered = BytesIO()
+                embedded.convert("RGB").save(buffered, format="JPEG")
+                jpeg = buffered.getvalue()
+                embedded = Image.open(BytesIO(jpeg))
+            color_space = "DeviceGray" if embedded.mode == "L" else "DeviceRGB"
+            writer.image(jpeg, embedded.width, embedded.height, color_space)
+
+        # The diagnosis, one section after the other
+        writer.space(12)
+        writer.text("Diagnosis", size=14, bold=True, center=True)
+        for section in SECTIONS:
+            writer.space(8)
+            writer.text(section, size=12, bold=True)
+            for paragraph in html_to_paragraphs(payload.get(section)):
+                indent = 12 if paragraph.startswith("•") else 0
+                writer.text(paragraph, indent=indent)
+                writer.space(3)
+        return writer.tobytes()
+
+
+class CachedPdfRenderer(PdfRenderer):
+    """Serves identical reports from a content-addressed cache instead of rendering them again."""
+
+    def __init__(self, renderer, cache):
+        self.renderer = renderer
+        self.cache = cache
+        self.name = renderer.name
+
+    def render(self, payload, image=None):
+        # The image is keyed by its digest, so its base64 HTML in the payload is not hashed again
+        fields = {k: v for k, v in payload.items() if k != "Image" or image is None}
+        key = cache_key(f"pdf-{self.name}", json.dumps(fields, sort_keys=True),
+                        image.digest if image is not None else None)
+        pdf_bytes = self.cache.get(key)
+        if pdf_bytes is None:
+            with pdf_render_seconds.time(renderer=self.name):
+                pdf_bytes = self.renderer.render(payload, image)
+            self.cache.put(key, pdf_bytes)
+        return pdf_bytes
+
+
+def create_pdf_renderer():
+    """
+    Creates the report PDF renderer selected by PDF_RENDERER, behind a PDF_CACHE_* configured cache.
+
+    Returns:
+        PdfRenderer: The renderer.
+
+    Raises:
+        ValueError: If PDF_RENDERER is neither "local" nor "remote".
+    """
+    # The local renderer hands reports it can't write over to the PDF API
+    renderers = {"local": lambda: LocalPdfRenderer(fallback=RemotePdfRenderer()), "remote": RemotePdfRenderer}
+    if PDF_RENDERER not in renderers:
+        raise ValueError(f"Unknown PDF_RENDERER {PDF_RENDERER!r}, expected 'local' or 'remote'.")
+    cache = ContentCache(
+        "pdf",
+        max_entries=int(os.environ.get("PDF_CACHE_MAX_ENTRIES", 64)),
+        max_bytes=int(os.environ.get("PDF_CACHE_MAX_BYTES", 32 * 1024 * 1024)),
+        ttl=float(os.environ.get("PDF_CACHE_TTL", 24 * 3600)),
+        disk_dir=os.environ.get("PDF_CACHE_DIR") or None,
+    )
+    return CachedPdfRenderer(renderers[PDF_RENDERER](), cache)
@@ -1,13 +1,100 @@
 from datetime import datetime
 import os
-import requests
-import json
-from PIL import Image
-from io import BytesIO
-import base64
+import uuid
+import logging
 import gradio as gr
-from firebase_admin import firestore
-from API_Config import PDF_API_KEY, client, db, template_id
+from groq import BadRequestError
+from API_Config import client, services
+from concurrency import upstream
+from groq_resilience import call_groq, record_payload
+import http_client
+from report_store import render_report_link, report_key
+from Database import invalidate_dashboard
+from patient_repository import user_key
+from image_asset import ImageAsset
+from report_schema import REPORT_FIELDS, parse_report, report_json_outcomes
+
+# Model writing the report
+REPORT_MODEL = "meta-llama/llama-4-maverick-17b-128e-instruct"
+
+# Small, fast model asked again for only the sections the report model got wrong
+REPAIR_MODEL = "llama-3.1-8b-instant"
+
+logger = logging.getLogger(__name__)
+
+
+def request_report_json(operation, model, prompt):
+    """
+    Asks a model for a JSON object in JSON mode.
+
+    Args:
+        operation (str): The operation name, for the resilience metrics.
+        model (str): The model to ask first.
+        prompt (str): The prompt.
+
+    Returns:
+        str: The reply, or the generation Groq rejected as invalid JSON, which is often near-valid.
+    """
+    def request(model):
+        with upstream("llm"):
+            return client.chat.completions.create(
+                model=model,
+                messages=[{"role": "user", "content": prompt}],
+                response_format={"type": "json_object"}
+            )
+
+    try:
+        # with retries and model fallback
+        response = call_groq(operation, model, request)
+        content = response.choices[0].message.content
+        record_payload(operation, len(prompt), len(content or ""))
+        return content
+    except BadRequestError as e:
+        # Groq rejects generations that fail its JSON validation, but returns them for a local repair
+        error = e.body.get("error", e.body) if isinstance(e.body, dict) else {}
+        if error.get("code") != "json_validate_failed":
+            raise
+        return error.get("failed_generation", "")
+
+
+def generate_report_fields(prompt):
+    """
+    Generates the report sections, repairing the reply locally and asking again only for broken sections.
+
+    Args:
+        prompt (str): The report prompt, with the conversation.
+
+    Returns:
+        dict: The HTML of each section in REPORT_FIELDS.
+
+    Raises:
+        ValueError: If no section could be generated.
+    """
+    fields, broken, repaired = parse_report(request_report_json("report", REPORT_MODEL, prompt))
+    if not broken:
+        report_json_outcomes.inc(outcome="repaired" if repaired else "valid")
+        return fields
+
+    # Ask the small model for the broken sections only, instead of failing the whole report
+    logger.warning("Report JSON missing %s, asking again for them", broken)
+    keys = ", ".join(f'"{field}"' for field in broken)
+    reask_prompt = f"{prompt}\nReturn ONLY a JSON object with the keys {keys}, each an HTML string."
+    try:
+        retried, _, _ = parse_report(request_report_json("report_repair", REPAIR_MODEL, reask_prompt))
+    except Exception:
+        # The sections already parsed are kept, the broken ones are marked as not available below
+        logger.warning("Asking again for the report sections %s failed", broken, exc_info=True)
+        retried = {}
+    fields.update({field: retried[field] for field in broken if field in retried})
+
+    still_broken = [field for field in REPORT_FIELDS if field not in fields]
+    if len(still_broken) == len(REPORT_FIELDS):
+        report_json_outcomes.inc(outcome="failed")
+        raise ValueError("The report model returned no usable section.")
+    report_json_outcomes.inc(outcome="incomplete" if still_broken else "reasked")
+    for field in still_broken:
+        fields[field] = "<p><i>Not available.</i></p>"
+    return fields
 
 
 def generate_report(history, name, email, img_input):
@@ -18,15 +105,15 @@ def generate_report(history, name, email, img_input):
     3. Recommendations
 
     Args:
-        history (list): A list of dictionaries containing the conversation history.
-            Each dictionary should contain the following keys:
-                - role (str): The role of the user (either "user" or "assistant").
+        history (Conversation or list): The conversation, or a list of its messages as dictionaries.
+            Each message should contain the following keys:
+                - role (str): The role of the user ("user", "assistant", or "system" for the summary of earlier follow-ups).
                 - content (str): The content of the message.
         name (str): The patient's name.
         email (str): The patient's email address.
-        img_input (str or bytes): The image input to include in the report.
-            If a string, it should be a URL pointing to the image.
-            If bytes, it should be the raw image data.
+        img_input (ImageAsset or str): The image input to include in the report.
+            If an ImageAsset, its cached JPEG encoding is embedded as is.
+            If a string, it should be a URL pointing to the image, or a base64 encoded image.
 
     Returns:
         str: The generated report as a string.
@@ -61,35 +148,33 @@ def generate_report(history, name, email, img_input):
         for msg in history:
             if msg["role"] == "user":
                 prompt += f"Patient: {msg['content']}\n"
+            elif msg["role"] == "system":
+                # The running summary of the older follow-ups
+                prompt += f"{msg['content']}\n"
             else:
                 prompt += f"Doctor: {msg['content']}\n"
 
-        # generate the report content
-        response = client.chat.completions.create(
-            model="meta-llama/llama-4-maverick-17b-128e-instruct",
-            messages=[{"role": "user", "content": prompt}]
-        )
-        generated_content = response.choices[0].message.content
-
-        report_json = json.loads(generated_content)
+        # generate the report content as JSON, validated and repaired against the report sections
+        report_json = generate_report_fields(prompt)
 
         img_html = ""
         img_base64 = ""
+        image = None
         try:
-            # convert the image to base64
-            if isinstance(img_input, str):
+            # wrap the image in an ImageAsset, so it is only decoded or re-encoded if it is not a JPEG
+            if isinstance(img_input, ImageAsset):
+                image = img_input
+            elif isinstance(img_input, str):
                 if img_input.startswith("http"):
-                    img_response = requests.get(img_input)
+                    img_response = http_client.get("image", img_input)
                     img_response.raise_for_status()
-                    image = Image.open(BytesIO(img_response.content))
+                    image = ImageAsset(img_response.content)
                 else:
-                    image_data = base64.b64decode(img_input)
-                    image = Image.open(BytesIO(image_data))
+                    image = ImageAsset.from_base64(img_input)
 
+            if image is not None:
                 # convert the image to base64
-                buffered = BytesIO()
-                image.save(buffered, format="JPEG")
-                img_base64 = base64.b64encode(buffered.getvalue()).decode("utf-8")
+                img_base64 = image.jpeg_base64
                 # add the image to the report
                 img_html = f'<img src="data:image/jpeg;base64,{img_base64}" style="max-width:100%; height:auto;"><br>'
 
@@ -122,57 +207,40 @@ def generate_report(history, name, email, img_input):
             "Image": img_html if img_base64 else ""
         }
 
-        # Post the report data to the PDF API to generate the report PDF
-        response = requests.post(
-            f"https://rest.apitemplate.io/v2/create-pdf?template_id={template_id}",
-            headers={"X-API-KEY": PDF_API_KEY},
-            json=payload
-        )
-
-        # Check if the API call was successful
-        if response.status_code != 200:
-            raise Exception(f"PDF API error: {response.text}")
-
-        # Get the download URL for the report
-        download_url = response.json().get("download_url")
-        if not download_url:
-            raise Exception("No download_url in API response")
-
-        # Fetch the PDF file content from the download URL
-        file_response = requests.get(download_url)
-
-        # Encode the PDF content into a base64 string
-        pdf_base64 = base64.b64encode(file_response.content).decode("utf-8")
+        # Render the report PDF, locally or with the PDF API, and reuse it if the same report was rendered before
+        pdf_bytes = services.get("pdf_renderer").render(payload, image if img_base64 else None)
 
         # Generate a timestamp for the report filename
-        timestamp = datetime.now().strftime("%d-%m-%Y_%I-%M-%p")
+        timestamp = datetime.now().strftime("%d-%m-%Y_%I-%M-%S-%p")
         safe_name = name.replace(" ", "_")
         filename = f"{safe_name}_Report_{timestamp}.pdf"
 
-        # Prepare the user document reference in Firestore
-        user_doc_name = email.replace(".com", "").lower()
-        user_ref = db.collection("Patients").document(user_doc_name)
-        report_id = f"Report_{timestamp}"
+        # The patient key the report is stored under
+        user_doc_name = user_key(email)
+        # The random suffix keeps two reports of the same second from replacing each other, orphaning the first PDF
+        report_id = f"Report_{timestamp}_{uuid.uuid4().hex[:8]}"
 
-        # Create a download link for the PDF report
-        download_link = f'<a download="{filename}" href="data:application/pdf;base64,{pdf_base64}" target="_blank">{report_id}</a>'
+        # Write the PDF once to the report store, the patient repository only keeps a small metadata record
+        store = services.get("report_store")
+        blob_key = report_key(user_doc_name, report_id)
+        store.put(blob_key, pdf_bytes)
 
-        # Save the report data to Firestore
+        # The report metadata kept in the patient repository
         report_data = {
             'report_id': report_id,
-            'report_link': download_link,
+            'filename': filename,
+            'blob_key': blob_key,
+            'size': len(pdf_bytes),
             'date': datetime.now().isoformat()
         }
-        user_ref.collection("Reports").document(report_id).set(report_data)
 
-        # Retrieve all reports and delete any beyond the latest 5
-        reports_ref = user_ref.collection("Reports").order_by("date", direction=firestore.Query.DESCENDING)
-        reports = reports_ref.stream()
+        # Save the report metadata, deleting the reports beyond the latest 5 in the same batched write
+        services.get("report_retention").save_report(user_doc_name, report_data)
+        # The user's next login must list the new report
+        invalidate_dashboard(user_doc_name)
 
-        report_docs = list(reports)
-        if len(report_docs) > 5:
-            for r in report_docs[5:]:
-                r.reference.delete()
+        # Create a download link for the PDF report
+        download_link = render_report_link(report_data, store)
 
         # Return the HTML content and download link for the report
         return report_html, download_link
@@ -0,0 +1,345 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from API_Config import services
+from image_asset import ImageAsset
+from metrics import counter, gauge, histogram
+from report import generate_report
+
+logger = logging.getLogger(__name__)
+
+# Number of reports generated at the same time in the background, also read from REPORT_CONCURRENCY_LIMIT,
+# the setting it had when reports ran as a limited Gradio event
+REPORT_WORKERS = int(os.environ.get("REPORT_WORKERS", os.environ.get("REPORT_CONCURRENCY_LIMIT", 2)))
+
+# SQLite file keeping the jobs across restarts, jobs are kept in memory only if unset
+REPORT_JOB_DB = os.environ.get("REPORT_JOB_DB") or None
+
+# Seconds between two status checks of the Report tab
+REPORT_JOB_POLL_SECONDS = float(os.environ.get("REPORT_JOB_POLL_SECONDS", 1.0))
+
+# Seconds a finished job whose result was never picked up is kept, e.g. after the user left the page
+REPORT_JOB_TTL = float(os.environ.get("REPORT_JOB_TTL", 3600))
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+report_jobs_total = counter("report_jobs_total", "Report jobs finished, by outcome.")
+report_job_seconds = histogram("report_job_seconds", "Time from submitting a report job until it finished.")
+report_jobs_pending = gauge("report_jobs_pending", "Report jobs queued or running.")
+report_jobs_expired = counter("report_jobs_expired_total", "Finished report jobs deleted before their result was picked up.")
+
+
+def encode_payload(history, name, email, img_input):
+    """
+    Converts the arguments of generate_report to JSON, so a job can be stored and resumed.
+
+    Args:
+        history (Conversation or list): The conversation.
+        name (str): The patient's name.
+        email (str): The patient's email address.
+        img_input (ImageAsset or str): The image for the report.
+
+    Returns:
+        str: The JSON payload.
+    """
+    if isinstance(img_input, ImageAsset):
+        # An ImageAsset is not JSON serializable, generate_report accepts the base64 encoded image as well
+        img_input = img_input.jpeg_base64
+    # A Conversation iterates over its messages, which are stored as a plain list
+    return json.dumps({"history": list(history or []), "name": name, "email": email, "img_input": img_input})
+
+
+class MemoryJobStore:
+    """Keeps report jobs in memory; they are lost when the process exits."""
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def add(self, job_id, payload):
+        """Records a new queued job."""
+        with self._lock:
+            self._jobs[job_id] = {"id": job_id, "status": QUEUED, "payload": payload, "result": None,
+                                  "error": None, "created": time.time(), "updated": time.time()}
+
+    def update(self, job_id, **fields):
+        """Updates the given fields of a job."""
+        with self._lock:
+            self._jobs[job_id].update(fields, updated=time.time())
+
+    def get(self, job_id):
+        """Returns a copy of a job, or None if it is unknown."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def unfinished(self):
+        """Returns the jobs that are queued or running."""
+        with self._lock:
+            return [dict(job) for job in self._jobs.values() if job["status"] in (QUEUED, RUNNING)]
+
+    def delete(self, job_id):
+        """Deletes a job, ignoring unknown ones."""
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def delete_finished(self, before):
+        """Deletes the jobs that finished before the given time, returns how many were deleted."""
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job["status"] in (DONE, FAILED) and job["updated"] < before]
+            for job_id in expired:
+                del self._jobs[job_id]
+            return len(expired)
+
+
+class SQLiteJobStore:
+    """Keeps report jobs in a SQLite file, so queued and running jobs survive a restart."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS report_jobs (id TEXT PRIMARY KEY, status TEXT, payload TEXT, "
+                "result TEXT, error TEXT, created REAL, updated REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS report_jobs_status ON report_jobs (status)")
+
+    def _connect(self):
+        """Returns this thread's connection, sqlite3 connections can't be shared between threads."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            # Deleted jobs hold patient data, overwrite it on disk instead of only unlinking the pages
+            conn.execute("PRAGMA secure_delete=ON")
+        return conn
+
+    def add(self, job_id, payload):
+        """Records a new queued job."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("INSERT INTO report_jobs VALUES (?, ?, ?, NULL, NULL, ?, ?)",
+                         (job_id, QUEUED, payload, now, now))
+
+    def update(self, job_id, **fields):
+        """Updates the given fields of a job."""
+        # The result is a (report_html, download_link) pair, stored as JSON
+        if "result" in fields:
+            fields["result"] = json.dumps(fields["result"])
+        fields["updated"] = time.time()
+        columns = ", ".join(f"{column} = ?" for column in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE report_jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def _row_to_job(self, row):
+        """Converts a row to the same dict MemoryJobStore returns."""
+        job = dict(row)
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def get(self, job_id):
+        """Returns a job, or None if it is unknown."""
+        row = self._connect().execute("SELECT * FROM report_jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def unfinished(self):
+        """Returns the jobs that are queued or running, oldest first."""
+        rows = self._connect().execute(
+            "SELECT * FROM report_jobs WHERE status IN (?, ?) ORDER BY created", (QUEUED, RUNNING)).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def delete(self, job_id):
+        """Deletes a job, ignoring unknown ones."""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM report_jobs WHERE id = ?", (job_id,))
+
+    def delete_finished(self, before):
+        """Deletes the jobs that finished before the given time, returns how many were deleted."""
+        with self._connect() as conn:
+            return conn.execute("DELETE FROM report_jobs WHERE status IN (?, ?) AND updated < ?",
+                                (DONE, FAILED, before)).rowcount
+
+
+class ReportJobQueue:
+    """
+    Generates reports on a background worker pool, so the report button returns a job id at once.
+
+    Jobs that were queued or running when the process stopped are resumed on start when a
+    persistent store is used. A job's payload, with the conversation and the image, is dropped
+    as soon as the job finishes, and the job itself once its result was delivered, or after
+    `ttl` seconds if it never is.
+    """
+
+    def __init__(self, run_report, store, workers=REPORT_WORKERS, ttl=REPORT_JOB_TTL):
+        self.run_report = run_report
+        self.store = store
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="report")
+        self._pending = 0
+        self._lock = threading.Lock()
+        # Sample the number of pending jobs only when the metrics are read
+        report_jobs_pending.set_function(lambda: self._pending)
+        # Pick up the jobs the previous process could not finish
+        self.recover()
+
+    def submit(self, history, name, email, img_input):
+        """
+        Queues a report.
+
+        Args:
+            history (Conversation or list): The conversation.
+            name (str): The patient's name.
+            email (str): The patient's email address.
+            img_input (ImageAsset or str): The image for the report.
+
+        Returns:
+            str: The id of the job.
+        """
+        job_id = uuid.uuid4().hex
+        # Each submission also deletes the finished jobs nobody picked up, so the store stays bounded
+        self.expire()
+        # Store the job before running it, so it can be resumed if the process stops
+        payload = encode_payload(history, name, email, img_input)
+        self.store.add(job_id, payload)
+        self._schedule(job_id, payload)
+        return job_id
+
+    def status(self, job_id):
+        """
+        Returns a job's record.
+
+        Args:
+            job_id (str): The id of the job.
+
+        Returns:
+            dict: The job, with its status and, once done, its result, or None if it is unknown.
+        """
+        return self.store.get(job_id)
+
+    def forget(self, job_id):
+        """
+        Deletes a job once its result was delivered, with the report it holds.
+
+        Args:
+            job_id (str): The id of the job.
+        """
+        self.store.delete(job_id)
+
+    def expire(self):
+        """Deletes the jobs that finished more than `ttl` seconds ago without their result being delivered."""
+        expired = self.store.delete_finished(time.time() - self.ttl)
+        if expired:
+            report_jobs_expired.inc(expired)
+
+    def recover(self):
+        """Resumes the jobs left unfinished by a previous process, and deletes the expired ones."""
+        self.expire()
+        for job in self.store.unfinished():
+            logger.info("Resuming report job %s", job["id"])
+            # A job that was running when the process stopped is started again from scratch
+            self.store.update(job["id"], status=QUEUED)
+            self._schedule(job["id"], job["payload"])
+
+    def _schedule(self, job_id, payload):
+        """Hands a job to the worker pool."""
+        with self._lock:
+            self._pending += 1
+        self._executor.submit(self._run, job_id, payload)
+
+    def _run(self, job_id, payload):
+        """Runs one job on a worker thread and records its outcome."""
+        start = time.perf_counter()
+        try:
+            self.store.update(job_id, status=RUNNING)
+            # generate_report reports its own errors as an error paragraph, which still completes the job
+            args = json.loads(payload)
+            report_html, download_link = self.run_report(**args)
+            # The payload is only needed to run the job, it is not kept once the report exists
+            self.store.update(job_id, status=DONE, result=[report_html, download_link], payload=None)
+            report_jobs_total.inc(outcome=DONE)
+        except Exception as e:
+            # Only unexpected errors, like a broken job store, fail the job
+            logger.exception("Report job %s failed", job_id)
+            self.store.update(job_id, status=FAILED, error=str(e), payload=None)
+            report_jobs_total.inc(outcome=FAILED)
+        finally:
+            report_job_seconds.observe(time.perf_counter() - start)
+            with self._lock:
+                self._pending -= 1
+
+
+def create_report_job_queue():
+    """
+    Creates the report job queue, persistent if REPORT_JOB_DB is set.
+
+    Returns:
+        ReportJobQueue: The job queue running report.generate_report.
+    """
+    store = SQLiteJobStore(REPORT_JOB_DB) if REPORT_JOB_DB else MemoryJobStore()
+    return ReportJobQueue(generate_report, store)
+
+
+def submit_report(history, name, email, img_input):
+    """
+    Queues a report for the Report tab and returns at once.
+
+    Args:
+        history (Conversation or list): The conversation.
+        name (str): The patient's name.
+        email (str): The patient's email address.
+        img_input (ImageAsset or str): The image for the report.
+
+    Returns:
+        str: The id of the job.
+        str: A placeholder for the report preview.
+        str: An empty download link.
+    """
+    job_id = services.get("report_jobs").submit(history, name, email, img_input)
+    return job_id, "<p><i>Your report is being generated...</i></p>", ""
+
+
+async def watch_report_async(job_id):
+    """
+    Polls a report job and streams its status to the Report tab until it is finished.
+
+    Args:
+        job_id (str): The id of the job returned by submit_report.
+
+    Yields:
+        tuple: The report preview and the download link.
+    """
+    if not job_id:
+        return
+    queue = services.get("report_jobs")
+    last_status = None
+    while True:
+        # The job store may be a SQLite file, so it is read off the event loop
+        job = await asyncio.to_thread(queue.status, job_id)
+        if job is None:
+            yield "<p>Report not found. Please try again.</p>", ""
+            return
+        if job["status"] == DONE:
+            report_html, download_link = job["result"]
+            yield report_html, download_link
+            # The result was delivered, the job is not needed anymore
+            await asyncio.to_thread(queue.forget, job_id)
+            return
+        if job["status"] == FAILED:
+            yield "<p>Error generating report. Please try again later.</p>", ""
+            await asyncio.to_thread(queue.forget, job_id)
+            return
+        # Only send an update when the status changes
+        if job["status"] != last_status:
+            last_status = job["status"]
+            message = "queued" if last_status == QUEUED else "being generated"
+            yield f"<p><i>Your report is {message}...</i></p>", ""
+        # Sleeping on the event loop keeps no worker thread busy while the report is generated
+        await asyncio.sleep(REPORT_JOB_POLL_SECONDS)
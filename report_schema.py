@@ -0,0 +1,126 @@
+import ast
+import json
+import re
+from metrics import counter
+
+# The sections of the report, each an HTML string
+REPORT_FIELDS = ("Symptoms", "Observations", "Recommendations")
+
+report_json_outcomes = counter(
+    "report_json_outcomes_total", "Report JSON parsed from the model, by outcome: valid, repaired, reasked or incomplete.")
+
+
+class ReportParseError(ValueError):
+    """Raised when a model reply holds no JSON object."""
+
+
+def _strip_wrapping(text):
+    """Drops code fences and any text around the outermost JSON object."""
+    text = re.sub(r"```(?:json)?", "", text or "", flags=re.IGNORECASE)
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1:
+        raise ReportParseError("No JSON object in the reply.")
+    # A reply cut short has no closing brace
+    return text[start:end + 1] if end > start else text[start:] + "}"
+
+
+def _escape_control_characters(text):
+    """Escapes raw newlines and tabs inside JSON strings, which models often leave in long HTML values."""
+    out, in_string, escaped = [], False, False
+    for char in text:
+        if in_string and not escaped and char in "\n\r\t":
+            char = {"\n": "\\n", "\r": "\\r", "\t": "\\t"}[char]
+        elif char == '"' and not escaped:
+            in_string = not in_string
+        escaped = char == "\\" and not escaped
+        out.append(char)
+    return "".join(out)
+
+
+def _repairs(text):
+    """Yields candidate repairs of near-valid JSON, the cheapest first."""
+    yield text
+    text = text.replace("“", '"').replace("”", '"')
+    # Trailing commas before a closing brace or bracket
+    text = re.sub(r",\s*([}\]])", r"\1", text)
+    yield text
+    text = _escape_control_characters(text)
+    yield text
+    # A reply cut off inside a string value
+    if text.count('"') % 2:
+        yield text[:-1] + '"}'
+
+
+def _loads(text):
+    """Parses an object from JSON, or from a Python literal, the other shape models reply with."""
+    try:
+        return json.loads(text), False
+    except json.JSONDecodeError:
+        value = ast.literal_eval(text)
+        if not isinstance(value, dict):
+            raise ValueError("Not an object.")
+        return value, True
+
+
+def _extract_fields(text):
+    """Pulls each field out of a reply too broken to parse, using the field names as anchors."""
+    fields = {}
+    for i, field in enumerate(REPORT_FIELDS):
+        others = "|".join(re.escape(f) for f in REPORT_FIELDS[i + 1:]) or "$^"
+        match = re.search(rf'"{field}"\s*:\s*"(.*?)"\s*(?:,\s*"(?:{others})"|}}|$)', text, re.DOTALL)
+        if match:
+            fields[field] = match.group(1).replace('\\"', '"').replace("\\n", "\n")
+    return fields
+
+
+def _normalize(value):
+    """Converts a field value to the HTML string the report expects, or None if it is unusable."""
+    if isinstance(value, str):
+        return value.strip() or None
+    if isinstance(value, list) and value:
+        # A list of findings becomes a bulleted list
+        return "<ul>" + "".join(f"<li>{item}</li>" for item in value) + "</ul>"
+    if isinstance(value, dict) and value:
+        return "".join(f"<p><b>{key}:</b> {item}</p>" for key, item in value.items())
+    return None
+
+
+def parse_report(text):
+    """
+    Parses and validates the report JSON replied by the model, repairing near-valid JSON locally.
+
+    Args:
+        text (str): The model reply.
+
+    Returns:
+        dict: The valid fields, as HTML strings.
+        list: The names of the fields that are missing or invalid.
+        bool: Whether the reply needed a repair.
+    """
+    data = None
+    repaired = True
+    try:
+        candidate = _strip_wrapping(text)
+        for i, attempt in enumerate(_repairs(candidate)):
+            try:
+                data, literal = _loads(attempt)
+            except (ValueError, SyntaxError, TypeError):
+                continue
+            # Valid as replied, unless wrapping text had to be dropped or a repair applied
+            repaired = literal or i > 0 or candidate != (text or "").strip()
+            break
+    except ReportParseError:
+        candidate = text or ""
+    if not isinstance(data, dict):
+        data = _extract_fields(candidate)
+
+    # Field names are matched case-insensitively, models sometimes change the case
+    by_name = {str(key).strip().lower(): value for key, value in data.items()}
+    fields, broken = {}, []
+    for field in REPORT_FIELDS:
+        value = _normalize(by_name.get(field.lower()))
+        if value is None:
+            broken.append(field)
+        else:
+            fields[field] = value
+    return fields, broken, repaired
@@ -0,0 +1,162 @@
+import os
+import secrets
+from abc import ABC, abstractmethod
+from datetime import timedelta
+from urllib.parse import quote
+
+# Where report PDFs are kept: "firebase" (Firebase Storage) or "local" (LOCAL_REPORT_DIR)
+REPORT_STORE = os.environ.get("REPORT_STORE", "firebase")
+
+# Directory used by the local report store, served by Gradio as an allowed path when REPORT_STORE is "local"
+LOCAL_REPORT_DIR = os.environ.get(
+    "REPORT_STORE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "reports"))
+
+# How long a signed download link to a stored report stays valid
+SIGNED_URL_EXPIRY = timedelta(hours=1)
+
+
+def report_key(user_doc_name, report_id):
+    """
+    Builds the blob key under which a report PDF is stored.
+
+    The key ends with a random token, so a report's URL can't be guessed from the patient's
+    email and the report time.
+
+    Args:
+        user_doc_name (str): The patient's document name in Firestore.
+        report_id (str): The id of the report.
+
+    Returns:
+        str: The blob key for the report PDF.
+    """
+    return f"reports/{user_doc_name}/{report_id}_{secrets.token_urlsafe(16)}.pdf"
+
+
+class ReportStore(ABC):
+    """
+    Stores report PDFs outside Firestore, so report documents only hold a small metadata record.
+    """
+
+    @abstractmethod
+    def put(self, key, data):
+        """
+        Writes the PDF bytes under the given key.
+
+        Args:
+            key (str): The blob key.
+            data (bytes): The PDF content.
+        """
+
+    @abstractmethod
+    def get(self, key):
+        """
+        Reads the PDF bytes stored under the given key.
+
+        Args:
+            key (str): The blob key.
+
+        Returns:
+            bytes: The PDF content.
+        """
+
+    @abstractmethod
+    def delete(self, key):
+        """
+        Deletes the PDF stored under the given key, ignoring missing blobs.
+
+        Args:
+            key (str): The blob key.
+        """
+
+    @abstractmethod
+    def url(self, key):
+        """
+        Returns a URL the browser can download the PDF from.
+
+        Args:
+            key (str): The blob key.
+
+        Returns:
+            str: The download URL.
+        """
+
+
+class LocalReportStore(ReportStore):
+    """Keeps report PDFs on the local filesystem and serves them through Gradio's file route."""
+
+    def __init__(self, root=LOCAL_REPORT_DIR):
+        self.root = os.path.abspath(root)
+
+    def _path(self, key):
+        """Maps a blob key to a path inside the store root."""
+        path = os.path.abspath(os.path.join(self.root, key))
+        if os.path.commonpath([path, self.root]) != self.root:
+            raise ValueError(f"Invalid report key: {key}")
+        return path
+
+    def put(self, key, data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first so readers never see a partial PDF
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def get(self, key):
+        with open(self._path(key), "rb") as f:
+            return f.read()
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def url(self, key):
+        return f"/gradio_api/file={quote(self._path(key))}"
+
+
+class FirebaseReportStore(ReportStore):
+    """Keeps report PDFs in the project's Firebase Storage bucket."""
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+
+    def put(self, key, data):
+        self.bucket.blob(key).upload_from_string(data, content_type="application/pdf")
+
+    def get(self, key):
+        return self.bucket.blob(key).download_as_bytes()
+
+    def delete(self, key):
+        from google.api_core.exceptions import NotFound
+        try:
+            self.bucket.blob(key).delete()
+        except NotFound:
+            pass
+
+    def url(self, key):
+        # Signing happens locally with the service account key, no network round-trip
+        return self.bucket.blob(key).generate_signed_url(expiration=SIGNED_URL_EXPIRY, version="v4")
+
+
+def render_report_link(report_data, store):
+    """
+    Builds the download link HTML for a report metadata record.
+
+    Reports saved before PDFs moved to the report store keep their full link in 'report_link',
+    which is returned as is.
+
+    Args:
+        report_data (dict): The report document from Firestore.
+        store (ReportStore): The store holding the report PDFs.
+
+    Returns:
+        str: The HTML anchor to download the report.
+    """
+    if "blob_key" not in report_data:
+        return report_data.get("report_link", "")
+    report_id = report_data.get("report_id", "Report")
+    filename = report_data.get("filename", f"{report_id}.pdf")
+    return f'<a download="{filename}" href="{store.url(report_data["blob_key"])}" target="_blank">{report_id}</a>'
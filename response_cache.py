@@ -0,0 +1,313 @@
+import hashlib
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from metrics import counter, gauge
+
+cache_hits = counter("cache_hits_total", "Cache lookups answered from the cache, by cache and tier.")
+cache_misses = counter("cache_misses_total", "Cache lookups that missed every tier, by cache.")
+cache_evictions = counter("cache_evictions_total", "Entries evicted from a cache, by cache, tier and reason.")
+cache_bytes = gauge("cache_memory_bytes", "Bytes held by the in-memory tier of a cache.")
+cache_hit_ratio = gauge("cache_hit_ratio", "Share of a cache's lookups answered from any tier, since start.")
+
+
+def cache_key(model, prompt, image=None):
+    """
+    Builds a content address for a model call.
+
+    Args:
+        model (str): The model name.
+        prompt (str): The full prompt sent to the model.
+        image (str or bytes): The image sent with the prompt, raw or base64 encoded, if any.
+
+    Returns:
+        str: The hex SHA-256 digest of the model, prompt and image.
+    """
+    digest = hashlib.sha256()
+    for part in (model, prompt, image or b""):
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        # Length prefix each part so different splits never hash the same
+        digest.update(struct.pack(">Q", len(part)))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class ContentCache:
+    """
+    A content-addressed bytes cache with an LRU in-memory tier and an optional on-disk tier.
+
+    Entries expire after ttl seconds. The memory tier evicts least recently used entries beyond
+    max_entries or max_bytes, and the disk tier evicts its oldest files beyond max_disk_bytes.
+    The disk tier's size is kept as a running total, so it is only walked when it goes over budget.
+    """
+
+    def __init__(self, name, max_entries=256, max_bytes=64 * 1024 * 1024, ttl=24 * 3600,
+                 disk_dir=None, max_disk_bytes=512 * 1024 * 1024):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()  # key -> (expires_at, data)
+        self._size = 0
+        self._disk_size = 0  # bytes of the disk tier, seeded from the files left by a previous run
+        self._lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._disk_size = sum(size for _, size, _ in self._disk_files())
+        cache_bytes.set_function(lambda: self._size, cache=name)
+        cache_hit_ratio.set_function(self.hit_ratio, cache=name)
+
+    def get(self, key):
+        """
+        Looks a key up in the memory tier, then in the disk tier.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            bytes: The cached data, or None on a miss.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, data = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    cache_hits.inc(cache=self.name, tier="memory")
+                    return data
+                self._remove(key)
+                cache_evictions.inc(cache=self.name, tier="memory", reason="ttl")
+
+        data = self._disk_get(key, now)
+        if data is not None:
+            cache_hits.inc(cache=self.name, tier="disk")
+            # Promote the entry so the next lookup is served from memory
+            self._memory_put(key, data, now)
+            return data
+
+        cache_misses.inc(cache=self.name)
+        return None
+
+    def put(self, key, data):
+        """
+        Stores data under a key in every tier.
+
+        Args:
+            key (str): The cache key.
+            data (bytes): The data to cache.
+        """
+        now = time.time()
+        self._memory_put(key, data, now)
+        self._disk_put(key, data)
+
+    def delete(self, key):
+        """
+        Removes a key from every tier, when the data it caches has changed.
+
+        Args:
+            key (str): The cache key.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+        if self.disk_dir:
+            self._disk_remove(self._disk_path(key))
+
+    def hit_ratio(self):
+        """Returns the share of lookups answered from any tier, or 0 before the first lookup."""
+        hits = cache_hits.value(cache=self.name, tier="memory") + cache_hits.value(cache=self.name, tier="disk")
+        lookups = hits + cache_misses.value(cache=self.name)
+        return hits / lookups if lookups else 0.0
+
+    def stats(self):
+        """
+        Returns the cache counters.
+
+        Returns:
+            dict: Hits per tier, misses, entry count, memory bytes and disk bytes.
+        """
+        return {
+            "memory_hits": cache_hits.value(cache=self.name, tier="memory"),
+            "disk_hits": cache_hits.value(cache=self.name, tier="disk"),
+            "misses": cache_misses.value(cache=self.name),
+            "hit_ratio": self.hit_ratio(),
+            "entries": len(self._entries),
+            "memory_bytes": self._size,
+            "disk_bytes": self._disk_size,
+        }
+
+    def _remove(self, key):
+        """Removes a key from the memory tier. The caller holds the lock."""
+        _, data = self._entries.pop(key)
+        self._size -= len(data)
+
+    def _memory_put(self, key, data, now):
+        """Adds an entry to the memory tier and evicts the least recently used ones."""
+        # Entries larger than the whole tier are only kept on disk
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (now + self.ttl, data)
+            self._size += len(data)
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                cache_evictions.inc(cache=self.name, tier="memory", reason="size")
+
+    def _disk_path(self, key):
+        """Maps a key to its file in the disk tier."""
+        return os.path.join(self.disk_dir, key[:2], key)
+
+    def _disk_get(self, key, now):
+        """Reads an entry from the disk tier, dropping it if it has expired."""
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            if os.path.getmtime(path) + self.ttl <= now:
+                if self._disk_remove(path):
+                    cache_evictions.inc(cache=self.name, tier="disk", reason="ttl")
+                return None
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _disk_put(self, key, data):
+        """Writes an entry to the disk tier and trims the tier to its size budget."""
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            try:
+                # The entry being replaced, if any, no longer counts towards the tier's size
+                replaced = os.path.getsize(path)
+            except OSError:
+                replaced = 0
+            os.replace(tmp_path, path)
+        except OSError:
+            # The disk tier is best effort, the memory tier still holds the entry
+            return
+        with self._lock:
+            self._disk_size += len(data) - replaced
+            over_budget = self._disk_size > self.max_disk_bytes
+        if over_budget:
+            self._trim_disk()
+
+    def _disk_remove(self, path):
+        """Deletes a disk entry and takes it off the tier's size. Returns whether it was deleted."""
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return False
+        with self._lock:
+            self._disk_size -= size
+        return True
+
+    def _disk_files(self):
+        """Lists the files of the disk tier, as (mtime, size, path) tuples."""
+        files = []
+        for root, _, names in os.walk(self.disk_dir):
+            for file_name in names:
+                path = os.path.join(root, file_name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def _trim_disk(self):
+        """Deletes the oldest disk entries until the tier fits max_disk_bytes, once it went over budget."""
+        # The walk also resets the running total, which concurrent writers of the same key may skew
+        files = self._disk_files()
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            cache_evictions.inc(cache=self.name, tier="disk", reason="size")
+            total -= size
+        with self._lock:
+            self._disk_size = total
+
+
+class ResponseCache(ContentCache):
+    """Caches the doctor's reply text together with its TTS mp3."""
+
+    def get_response(self, key):
+        """
+        Looks up a cached reply.
+
+        Args:
+            key (str): The cache key, see cache_key().
+
+        Returns:
+            tuple: The reply text and its mp3 bytes, or None on a miss.
+        """
+        data = self.get(key)
+        if data is None:
+            return None
+        (text_length,) = struct.unpack(">I", data[:4])
+        text = data[4:4 + text_length].decode("utf-8")
+        return text, data[4 + text_length:]
+
+    def put_response(self, key, text, audio):
+        """
+        Caches a reply and its mp3.
+
+        Args:
+            key (str): The cache key, see cache_key().
+            text (str): The reply text.
+            audio (bytes): The mp3 bytes of the spoken reply.
+        """
+        encoded = text.encode("utf-8")
+        self.put(key, struct.pack(">I", len(encoded)) + encoded + audio)
+
+
+def create_response_cache():
+    """
+    Creates the reply cache configured by the RESPONSE_CACHE_* environment variables.
+
+    Returns:
+        ResponseCache: The reply cache. The disk tier is only enabled when RESPONSE_CACHE_DIR is set.
+    """
+    return ResponseCache(
+        "response",
+        max_entries=int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", 256)),
+        max_bytes=int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+        ttl=float(os.environ.get("RESPONSE_CACHE_TTL", 24 * 3600)),
+        disk_dir=os.environ.get("RESPONSE_CACHE_DIR") or None,
+        max_disk_bytes=int(os.environ.get("RESPONSE_CACHE_MAX_DISK_BYTES", 512 * 1024 * 1024)),
+    )
+
+
+def create_login_cache():
+    """
+    Creates the per-user cache of login dashboard data, configured by the LOGIN_CACHE_* environment variables.
+
+    Returns:
+        ContentCache: The memory only cache.
+    """
+    return ContentCache(
+        "login",
+        max_entries=int(os.environ.get("LOGIN_CACHE_MAX_ENTRIES", 4096)),
+        max_bytes=int(os.environ.get("LOGIN_CACHE_MAX_BYTES", 16 * 1024 * 1024)),
+        ttl=float(os.environ.get("LOGIN_CACHE_TTL", 600)),
+    )
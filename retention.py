@@ -0,0 +1,118 @@
+import logging
+import os
+import queue
+import threading
+from metrics import counter
+
+logger = logging.getLogger(__name__)
+
+# Number of reports kept per user, older reports are deleted
+REPORTS_TO_KEEP = int(os.environ.get("REPORTS_TO_KEEP", 5))
+
+reports_evicted = counter("reports_evicted_total", "Reports deleted by the retention policy, by path.")
+retention_compactions = counter("retention_compactions_total", "Legacy report backlogs compacted, by outcome.")
+
+
+class ReportRetention:
+    """
+    Keeps the latest reports of each user, and deletes the PDFs of the others.
+
+    The repository evicts the older reports in the same atomic write that saves a new one. When
+    it can't tell which reports to evict, as for Firestore users saved before the ring of kept
+    reports existed, their backlog is compacted once by a background worker. This is a one-off
+    migration of those users, new users are registered with an empty ring.
+    """
+
+    def __init__(self, repository, store, keep=REPORTS_TO_KEEP):
+        self.repository = repository
+        self.store = store
+        self.keep = keep
+        self._queue = queue.Queue()
+        self._scheduled = set()  # users waiting for, or being compacted
+        self._dirty = set()  # users who saved a report while being compacted
+        self._lock = threading.Lock()
+        self._worker = threading.Thread(target=self._compact_forever, name="retention-compactor", daemon=True)
+        self._worker.start()
+
+    def save_report(self, user_doc_name, report_data):
+        """
+        Saves a report's metadata and deletes the reports beyond the latest `keep`.
+
+        With Firestore, costs one document read and one batched commit, whatever the number of reports.
+
+        Args:
+            user_doc_name (str): The patient key.
+            report_data (dict): The report metadata, with its report_id and blob_key.
+
+        Returns:
+            list: The metadata of the evicted reports.
+        """
+        evicted = self.repository.save_report(user_doc_name, report_data, self.keep)
+        if evicted is None:
+            self.schedule_compaction(user_doc_name)
+            return []
+
+        # The PDFs live in the report store, outside the repository write
+        self._delete_blobs(evicted)
+        reports_evicted.inc(len(evicted), path="save")
+        return evicted
+
+    def schedule_compaction(self, user_doc_name):
+        """
+        Queues a legacy user for compaction, once even if they save several reports meanwhile.
+
+        Args:
+            user_doc_name (str): The patient key.
+        """
+        with self._lock:
+            if user_doc_name in self._scheduled:
+                # Compact again after the current run, to pick up the report saved meanwhile
+                self._dirty.add(user_doc_name)
+                return
+            self._scheduled.add(user_doc_name)
+        self._queue.put(user_doc_name)
+
+    def compact(self, user_doc_name):
+        """
+        Deletes a user's reports beyond the latest `keep` in batched writes.
+
+        Args:
+            user_doc_name (str): The patient key.
+
+        Returns:
+            int: The number of reports deleted.
+        """
+        evicted = self.repository.compact(user_doc_name, self.keep)
+        self._delete_blobs(evicted)
+        reports_evicted.inc(len(evicted), path="compaction")
+        return len(evicted)
+
+    def _delete_blobs(self, entries):
+        """Deletes the stored PDFs of evicted reports; a failure leaves an orphan blob, not a broken report."""
+        for entry in entries:
+            blob_key = entry.get("blob_key")
+            if not blob_key:
+                continue
+            try:
+                self.store.delete(blob_key)
+            except Exception:
+                logger.exception("Could not delete report blob %s", blob_key)
+
+    def _compact_forever(self):
+        """Compacts the queued users one after the other, on the background worker."""
+        while True:
+            user_doc_name = self._queue.get()
+            try:
+                deleted = self.compact(user_doc_name)
+                retention_compactions.inc(outcome="ok")
+                logger.info("Compacted the reports of %s, %d deleted", user_doc_name, deleted)
+            except Exception:
+                retention_compactions.inc(outcome="error")
+                logger.exception("Could not compact the reports of %s", user_doc_name)
+            with self._lock:
+                self._scheduled.discard(user_doc_name)
+                again = user_doc_name in self._dirty
+                self._dirty.discard(user_doc_name)
+            if again:
+                self.schedule_compaction(user_doc_name)
+            self._queue.task_done()
@@ -0,0 +1,89 @@
+import asyncio
+import logging
+from API_Config import async_client
+from concurrency import upstream_async
+from groq_resilience import call_groq_async, record_payload
+
+# Small, fast model used to fold older follow-ups into the running summary
+SUMMARY_MODEL = "llama-3.1-8b-instant"
+
+SUMMARY_PROMPT = """You maintain a running clinical summary of a conversation between a patient and a doctor.
+    Update the summary with the new exchanges below. Keep every symptom, duration, observation, medication,
+    advice and open question, drop small talk, and write at most 8 short sentences of plain text.
+    Output only the updated summary."""
+
+logger = logging.getLogger(__name__)
+
+# Running summary tasks, referenced so they are not garbage collected before they finish
+_background_tasks = set()
+
+
+async def summarize_async(conversation):
+    """
+    Folds the older follow-ups of a conversation into its running summary.
+
+    Args:
+        conversation (Conversation): The conversation to update in place.
+
+    Returns:
+        bool: Whether the summary was updated.
+    """
+    span = conversation.pending_fold()
+    if span is None:
+        return False
+    start, end = span
+
+    # Read the turns now, the conversation keeps growing while the summary is generated
+    exchanges = "\n".join(
+        f"{'Patient' if turn['role'] == 'user' else 'Doctor'}: {turn['content']}"
+        for turn in conversation.turns[start:end])
+    prompt = f"{SUMMARY_PROMPT}\n\nCurrent summary: {conversation.summary or 'None yet.'}\n\nNew exchanges:\n{exchanges}"
+
+    async def request(model):
+        async with upstream_async("llm"):
+            return await async_client.chat.completions.create(
+                model=model,
+                messages=[{"role": "user", "content": prompt}]
+            )
+
+    response = await call_groq_async("summary", SUMMARY_MODEL, request)
+    summary = response.choices[0].message.content.strip()
+    record_payload("summary", len(prompt), len(summary))
+    conversation.apply_summary(summary, end)
+    return True
+
+
+async def _summarize_in_background(conversation):
+    """Runs summarize_async, a failure only means the turns are sent as they are for a while longer."""
+    try:
+        await summarize_async(conversation)
+    except Exception:
+        logger.exception("Could not update the conversation summary")
+    finally:
+        conversation.summarizing = False
+
+
+def schedule_summary(conversation):
+    """
+    Updates the running summary of a conversation in the background, if older turns are due.
+
+    Must be called from the event loop serving the follow-ups, so the reply is returned
+    without waiting for the summary. A private loop, like run_sync's, must await
+    wait_for_summaries() before it closes, or the summary is cancelled with it.
+
+    Args:
+        conversation (Conversation): The conversation to update in place.
+    """
+    if conversation.summarizing or conversation.pending_fold() is None:
+        return
+    conversation.summarizing = True
+    task = asyncio.get_running_loop().create_task(_summarize_in_background(conversation))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+async def wait_for_summaries():
+    """Waits for the summaries scheduled on the running event loop to finish."""
+    loop = asyncio.get_running_loop()
+    # Failures are logged by the tasks themselves, they never raise
+    await asyncio.gather(*(task for task in _background_tasks if task.get_loop() is loop))
@@ -0,0 +1,41 @@
+import os
+import sys
+import pytest
+
+# The app's modules live at the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from API_Config import services  # noqa: E402
+from benchmark import StubServer  # noqa: E402
+
+# Credentials the app reads, none of them is needed by the tests
+CREDENTIAL_VARS = ("GROQ_API_KEY", "PYREBASE_API_KEY", "FIREBASE_CREDENTIALS", "PDF_API_KEY")
+
+
+@pytest.fixture(autouse=True)
+def no_credentials(monkeypatch):
+    """Runs every test without credentials, starting and ending with no service created."""
+    for name in CREDENTIAL_VARS:
+        monkeypatch.delenv(name, raising=False)
+    services.reset()
+    yield
+    services.reset()
+
+
+@pytest.fixture
+def groq_stub():
+    """
+    Starts a local server answering the Groq API from a route table, and points the Groq clients at it.
+
+    Yields:
+        dict: The routes, keyed by (method, path) as StubServer expects, filled in by the test.
+    """
+    from groq import AsyncGroq, Groq
+    import groq_resilience
+    # Every test starts with the circuits of every model closed
+    groq_resilience._breakers.clear()
+    routes = {}
+    with StubServer(routes) as server:
+        services.override("groq", Groq(api_key="test", base_url=server.url, max_retries=0))
+        services.override("async_groq", AsyncGroq(api_key="test", base_url=server.url, max_retries=0))
+        yield routes
@@ -0,0 +1,38 @@
+import json
+
+
+def sse(*events, done=True):
+    """
+    Encodes chat completion chunks as a server-sent events stream.
+
+    Args:
+        *events: The chunks, as dicts, or strings sent as they are, e.g. keep-alive comments.
+        done (bool): Whether to end the stream, False to send more events afterwards.
+
+    Yields:
+        bytes: The events, one at a time.
+    """
+    for event in events:
+        yield event.encode("utf-8") if isinstance(event, str) else f"data: {json.dumps(event)}\n\n".encode("utf-8")
+    if done:
+        yield b"data: [DONE]\n\n"
+
+
+def chunk(content=None, role=None, choices=True):
+    """Builds a chat completion chunk carrying some text, a role, or no choices at all like a usage chunk."""
+    delta = {key: value for key, value in (("role", role), ("content", content)) if value is not None}
+    return {"id": "stub", "object": "chat.completion.chunk", "created": 0, "model": "stub",
+            "choices": [{"index": 0, "delta": delta, "finish_reason": None}] if choices else []}
+
+
+def completion(content):
+    """Builds a chat completion body replying with the given text."""
+    return json.dumps({
+        "id": "stub", "object": "chat.completion", "created": 0, "model": "stub",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+    }).encode("utf-8")
+
+
+def error(message="stub error"):
+    """Builds an API error body, as Groq answers failed calls."""
+    return json.dumps({"error": {"message": message, "type": "stub_error"}}).encode("utf-8")
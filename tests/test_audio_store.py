@@ -0,0 +1,79 @@
+import os
+import time
+from types import SimpleNamespace
+from API_Config import services
+from audio_store import AudioStore, release_session_audio
+
+
+def store_in(tmp_path, **options):
+    """An audio store under tmp_path, without the background sweeper."""
+    return AudioStore(str(tmp_path), sweep_interval=0, **options)
+
+
+def test_releasing_a_session_deletes_only_its_files(tmp_path):
+    store = store_in(tmp_path)
+    mine = [store.write(b"a" * 10, "session-1") for _ in range(2)]
+    other = store.write(b"b" * 10, "session-2")
+
+    assert store.release_session("session-1") == 2
+
+    assert not any(os.path.exists(path) for path in mine)
+    assert not os.path.exists(os.path.dirname(mine[0]))
+    assert os.path.exists(other)
+    assert store._size == 10
+
+
+def test_closing_the_browser_tab_releases_the_session(tmp_path):
+    store = store_in(tmp_path)
+    services.override("audio_store", store)
+    path = store.write(b"a", "session-1")
+
+    release_session_audio(SimpleNamespace(session_hash="session-1"))
+
+    assert not os.path.exists(path)
+
+
+def test_session_hashes_never_leave_the_store_root(tmp_path):
+    store = store_in(tmp_path / "audio")
+
+    path = store.write(b"a", "../../escape")
+
+    assert os.path.dirname(os.path.dirname(path)) == store.root
+
+
+def test_sweep_deletes_only_expired_files(tmp_path):
+    store = store_in(tmp_path, max_age=60)
+    old = store.write(b"a" * 10, "session-1")
+    fresh = store.write(b"b" * 10, "session-1")
+    # Backdate the first file beyond max_age
+    store._files[old] = (10, time.time() - 120)
+
+    assert store.sweep() == 1
+
+    assert not os.path.exists(old) and os.path.exists(fresh)
+    assert store._size == 10
+
+
+def test_files_left_by_a_previous_run_are_swept(tmp_path):
+    leftover = tmp_path / "session-1" / "old.mp3"
+    leftover.parent.mkdir()
+    leftover.write_bytes(b"a" * 10)
+    os.utime(leftover, (time.time() - 120, time.time() - 120))
+
+    store = store_in(tmp_path, max_age=60)
+
+    assert store._size == 10
+    assert store.sweep() == 1
+    assert not leftover.exists()
+
+
+def test_oldest_files_are_evicted_beyond_max_bytes(tmp_path):
+    store = store_in(tmp_path, max_bytes=25)
+    first = store.write(b"a" * 10)
+    second = store.write(b"b" * 10)
+
+    third = store.write(b"c" * 10)
+
+    assert not os.path.exists(first)
+    assert os.path.exists(second) and os.path.exists(third)
+    assert store._size == 20
@@ -0,0 +1,14 @@
+import os
+from benchmark import bench_vision, synthetic_photo
+
+
+def test_vision_benchmark_reports_preprocessing_and_transfer(tmp_path, capsys):
+    path = synthetic_photo(str(tmp_path), 320, 240)
+
+    bench_vision([path], bandwidth_mbps=1000, runs=2, model_latency=0)
+
+    header, original, prepared = capsys.readouterr().out.splitlines()
+    assert "prep p50 s" in header and "send p50 s" in header
+    assert original.split()[1] == "original" and prepared.split()[1] == "prepared"
+    # The photo is only written to the given directory
+    assert os.listdir(tmp_path) == [os.path.basename(path)]
@@ -0,0 +1,44 @@
+import asyncio
+import time
+from types import SimpleNamespace
+import gradio as gr
+from concurrency import EVENT_CONCURRENCY, event_queue_depth, event_queue_wait_seconds, watch_event_queue
+
+
+def queued_demo():
+    """An app with one queued event per concurrency id, as gradio_ui builds it."""
+    with gr.Blocks() as demo:
+        button = gr.Button()
+        for concurrency_id, limit in EVENT_CONCURRENCY.items():
+            button.click(lambda: None, concurrency_limit=limit, concurrency_id=concurrency_id)
+    return demo.queue()
+
+
+def test_only_ids_used_by_events_are_watched():
+    watch_event_queue(queued_demo())
+
+    watched = {dict(labels)["concurrency_id"] for labels in event_queue_depth.samples()}
+    assert watched == set(EVENT_CONCURRENCY)
+
+
+def test_queue_wait_is_recorded_when_an_event_starts():
+    demo = queued_demo()
+    started = []
+
+    async def process_events(events, batch, begin_time):
+        started.extend(events)
+
+    demo._queue.process_events = process_events
+    watch_event_queue(demo)
+    labels = (("concurrency_id", "followup"),)
+    before = event_queue_wait_seconds.samples().get(labels, {"count": 0, "sum": 0.0})
+    event = SimpleNamespace(_id="event-1", concurrency_id="followup")
+    now = time.time()
+    demo._queue.event_analytics[event._id] = {"time": now - 0.5}
+
+    asyncio.run(demo._queue.process_events([event], False, now))
+
+    after = event_queue_wait_seconds.samples()[labels]
+    assert started == [event]
+    assert after["count"] == before["count"] + 1
+    assert abs(after["sum"] - before["sum"] - 0.5) < 0.01
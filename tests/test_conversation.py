@@ -0,0 +1,59 @@
+from conversation import HEAD_TURNS, Conversation, count_tokens
+
+
+def conversation_with_followups(count, budget):
+    """A diagnosis followed by the given number of follow-up exchanges, each turn 14 tokens long."""
+    conversation = Conversation.seeded("Q" * 40, "D" * 40, budget)
+    for number in range(count):
+        conversation.append("user", f"question {number:02}".ljust(40, "."))
+        conversation.append("assistant", f"answer {number:02}".ljust(40, "."))
+    return conversation
+
+
+def contents(messages):
+    """The first word of each message, enough to tell the turns apart."""
+    return [message["content"].split(".")[0].split(":")[0] for message in messages]
+
+
+def test_whole_conversation_is_sent_within_the_budget():
+    conversation = conversation_with_followups(2, budget=1000)
+
+    messages = conversation.context("new question")
+
+    assert len(messages) == 2 * HEAD_TURNS + 3
+    assert messages[-1] == {"role": "user", "content": "new question"}
+
+
+def test_oldest_followups_are_trimmed_first():
+    turn = count_tokens("x" * 40)
+    # Room for the query, the diagnosis exchange and the 3 latest turns
+    conversation = conversation_with_followups(5, budget=count_tokens("new question") + turn * (HEAD_TURNS + 3))
+
+    messages = conversation.context("new question")
+
+    # The diagnosis is always kept, then the newest turns, then the query
+    assert contents(messages) == ["Q" * 40, "D" * 40, "answer 03", "question 04", "answer 04", "new question"]
+
+
+def test_summary_replaces_the_folded_followups():
+    conversation = conversation_with_followups(4, budget=1000)
+    conversation.apply_summary("Sore throat for 3 days.", HEAD_TURNS + 4)
+
+    messages = conversation.context("new question")
+
+    assert messages[HEAD_TURNS] == {"role": "system", "content": "Summary of the earlier conversation: Sore throat for 3 days."}
+    # The summarized follow-ups are not sent again, the ones after them are
+    assert contents(messages[HEAD_TURNS + 1:]) == ["question 02", "answer 02", "question 03", "answer 03", "new question"]
+    # The report reads the same summary in place of the folded turns
+    assert [message["role"] for message in conversation][HEAD_TURNS] == "system"
+
+
+def test_summary_too_long_for_the_budget_is_left_out():
+    turn = count_tokens("x" * 40)
+    conversation = conversation_with_followups(4, budget=turn * (HEAD_TURNS + 2))
+    conversation.apply_summary("S" * 400, HEAD_TURNS + 4)
+
+    messages = conversation.context()
+
+    assert all(message["role"] != "system" for message in messages)
+    assert contents(messages) == ["Q" * 40, "D" * 40, "question 03", "answer 03"]
@@ -0,0 +1,72 @@
+import time
+import pytest
+import Database
+from API_Config import services
+from benchmark import FakeFirestore
+from patient_repository import RING_FIELD, FirestorePatientRepository, MemoryPatientRepository, user_key
+
+
+class FakeAuth:
+    """Accepts every registration and sign in, like the pyrebase auth client would."""
+
+    def create_user_with_email_and_password(self, email, password):
+        return {"email": email}
+
+    def sign_in_with_email_and_password(self, email, password):
+        return {"email": email}
+
+
+@pytest.fixture
+def patients():
+    repository = MemoryPatientRepository()
+    services.override("auth", FakeAuth())
+    services.override("patients", repository)
+    return repository
+
+
+def test_register_seeds_the_ring_of_kept_reports(patients):
+    assert Database.register("Jane", "jane@example.com", "pw", "pw") == ("Jane", "jane@example.com")
+
+    # An empty ring, so the first report is saved without the legacy compaction
+    assert patients.get_patient(user_key("jane@example.com"))[RING_FIELD] == []
+
+
+def test_dashboard_invalidated_during_a_miss_is_not_cached(patients, monkeypatch):
+    key = user_key("jane@example.com")
+    patients.put_patient(key, {"name": "Jane", "email": "jane@example.com"})
+    fetch = Database.fetch_dashboard
+
+    def racing_fetch(user_doc_name):
+        dashboard = fetch(user_doc_name)
+        # A report is saved and the dashboard invalidated while this login was reading
+        patients.save_report(key, {"report_id": "Report_1", "blob_key": "k", "date": "2026-01-01"}, 5)
+        Database.invalidate_dashboard(key)
+        return dashboard
+
+    monkeypatch.setattr(Database, "fetch_dashboard", racing_fetch)
+    assert Database.load_dashboard(key)["reports"] == []
+
+    monkeypatch.setattr(Database, "fetch_dashboard", fetch)
+    # The stale read was not cached, the next login sees the new report
+    assert [r["report_id"] for r in Database.load_dashboard(key)["reports"]] == ["Report_1"]
+    # Without an invalidation meanwhile, the dashboard is cached
+    patients.save_report(key, {"report_id": "Report_2", "blob_key": "k2", "date": "2026-01-02"}, 5)
+    assert [r["report_id"] for r in Database.load_dashboard(key)["reports"]] == ["Report_1"]
+
+
+def test_login_reads_the_patient_and_the_reports_in_parallel():
+    firestore = FakeFirestore(latency=0.2)
+    firestore.docs[("Patients", "jane@example")] = {"name": "Jane", "email": "jane@example.com"}
+    for number in range(7):
+        firestore.docs[("Patients", "jane@example", "Reports", f"Report_{number}")] = {
+            "report_id": f"Report_{number}", "date": f"2026-10-{number + 1:02}"}
+    services.override("patients", FirestorePatientRepository(firestore))
+
+    start = time.perf_counter()
+    dashboard = Database.fetch_dashboard("jane@example")
+    elapsed = time.perf_counter() - start
+
+    assert dashboard["name"] == "Jane"
+    assert [r["report_id"] for r in dashboard["reports"]] == [f"Report_{n}" for n in range(6, 1, -1)]
+    # Both reads ran at the same time, so the login waited for one read latency, not two
+    assert firestore.reads == 2 and elapsed < 0.35
@@ -0,0 +1,233 @@
+import asyncio
+import json
+import threading
+import time
+import pytest
+import groq_resilience
+from API_Config import async_client, client
+from groq_resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError, call_groq, call_groq_async
+from groq_stub import completion, error
+
+CHAT = ("POST", "/openai/v1/chat/completions")
+MESSAGES = [{"role": "user", "content": "hello"}]
+
+
+def chat(model):
+    """Makes a chat completion call, as the app's request callables do."""
+    return client.chat.completions.create(messages=MESSAGES, model=model)
+
+
+def async_chat(model):
+    """Makes an asyncio chat completion call."""
+    return async_client.chat.completions.create(messages=MESSAGES, model=model)
+
+
+def reply(response):
+    """Returns the text of a chat completion."""
+    return response.choices[0].message.content
+
+
+def install_breaker(model, **kwargs):
+    """Gives a model a circuit breaker with the given threshold and timeout."""
+    groq_resilience._breakers[model] = CircuitBreaker(model, **kwargs)
+    return groq_resilience._breakers[model]
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    # No fallbacks unless a test sets them, and no jittered waits between retries
+    monkeypatch.setattr(groq_resilience, "MODEL_FALLBACKS", {})
+    monkeypatch.setattr(groq_resilience, "BACKOFF_BASE", 0.0)
+
+
+def test_rate_limit_is_retried_after_retry_after(groq_stub):
+    calls = []
+
+    def route(body):
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            return 429, "application/json", error("rate limited"), {"retry-after": "0.3"}
+        return 200, "application/json", completion("ok")
+
+    groq_stub[CHAT] = route
+
+    assert reply(call_groq("test", "rate-limited-model", chat)) == "ok"
+    assert len(calls) == 2
+    # The retry waited as long as the API asked
+    assert calls[1] - calls[0] >= 0.3
+
+
+def test_retries_are_bounded(groq_stub, monkeypatch):
+    monkeypatch.setattr(groq_resilience, "MAX_RETRIES", 2)
+    calls = []
+
+    def route(body):
+        calls.append(body)
+        return 503, "application/json", error()
+
+    groq_stub[CHAT] = route
+
+    with pytest.raises(Exception) as failure:
+        call_groq("test", "unavailable-model", chat)
+    assert type(failure.value).__name__ == "InternalServerError"
+    assert len(calls) == 3
+
+
+def test_invalid_requests_are_not_retried(groq_stub):
+    calls = []
+
+    def route(body):
+        calls.append(body)
+        return 400, "application/json", error("bad request")
+
+    groq_stub[CHAT] = route
+    circuit = install_breaker("strict-model", failure_threshold=1)
+
+    with pytest.raises(Exception):
+        call_groq("test", "strict-model", chat)
+    assert len(calls) == 1
+    assert circuit.state == CLOSED
+
+
+def test_invalid_request_during_the_trial_keeps_the_circuit_open(groq_stub, monkeypatch):
+    monkeypatch.setattr(groq_resilience, "MAX_RETRIES", 0)
+    groq_stub[CHAT] = lambda body: (400, "application/json", error("bad request"))
+    circuit = install_breaker("tripped-model", failure_threshold=1, reset_timeout=0.05)
+    circuit.record_failure()
+    time.sleep(0.1)
+
+    with pytest.raises(Exception):
+        call_groq("test", "tripped-model", chat)
+
+    # The 400 says nothing about the model, so the circuit is not closed, but the next call may be the trial
+    assert circuit.state == HALF_OPEN and circuit.failures == 1
+    assert circuit.allow()
+
+
+def test_invalid_requests_dont_reset_the_failure_count(groq_stub, monkeypatch):
+    monkeypatch.setattr(groq_resilience, "MAX_RETRIES", 0)
+    statuses = iter([500, 400, 500, 400, 500])
+    groq_stub[CHAT] = lambda body: (next(statuses), "application/json", error())
+    circuit = install_breaker("mixed-model", failure_threshold=3)
+
+    for _ in range(5):
+        with pytest.raises(Exception):
+            call_groq("test", "mixed-model", chat)
+
+    assert circuit.state == OPEN
+
+
+def test_breaker_opens_then_half_opens_then_closes(groq_stub, monkeypatch):
+    monkeypatch.setattr(groq_resilience, "MAX_RETRIES", 0)
+    healthy = threading.Event()
+    calls = []
+
+    def route(body):
+        calls.append(body)
+        if healthy.is_set():
+            return 200, "application/json", completion("back")
+        return 500, "application/json", error()
+
+    groq_stub[CHAT] = route
+    circuit = install_breaker("flaky-model", failure_threshold=2, reset_timeout=0.2)
+
+    for _ in range(2):
+        with pytest.raises(Exception):
+            call_groq("test", "flaky-model", chat)
+    assert circuit.state == OPEN
+
+    # An open circuit fails fast, without calling the model
+    with pytest.raises(CircuitOpenError):
+        call_groq("test", "flaky-model", chat)
+    assert len(calls) == 2
+
+    # After the reset timeout one trial call goes through, and its success closes the circuit
+    time.sleep(0.25)
+    healthy.set()
+    assert reply(call_groq("test", "flaky-model", chat)) == "back"
+    assert circuit.state == CLOSED and circuit.failures == 0
+
+
+def test_failed_trial_opens_the_circuit_again(groq_stub, monkeypatch):
+    monkeypatch.setattr(groq_resilience, "MAX_RETRIES", 0)
+    groq_stub[CHAT] = lambda body: (500, "application/json", error())
+    circuit = install_breaker("broken-model", failure_threshold=1, reset_timeout=0.1)
+
+    with pytest.raises(Exception):
+        call_groq("test", "broken-model", chat)
+    time.sleep(0.15)
+    assert circuit.allow() and circuit.state == HALF_OPEN
+    circuit.release()
+
+    with pytest.raises(Exception):
+        call_groq("test", "broken-model", chat)
+    assert circuit.state == OPEN
+
+
+def test_falls_back_to_the_next_model(groq_stub, monkeypatch):
+    monkeypatch.setattr(groq_resilience, "MAX_RETRIES", 1)
+    monkeypatch.setattr(groq_resilience, "MODEL_FALLBACKS", {"big-model": ["small-model"]})
+    models = []
+
+    def route(body):
+        model = json.loads(body)["model"]
+        models.append(model)
+        if model == "big-model":
+            return 503, "application/json", error()
+        return 200, "application/json", completion(f"from {model}")
+
+    groq_stub[CHAT] = route
+    before = groq_resilience.groq_fallbacks.value(operation="test", model="small-model")
+
+    assert reply(call_groq("test", "big-model", chat)) == "from small-model"
+    assert models == ["big-model", "big-model", "small-model"]
+    assert groq_resilience.groq_fallbacks.value(operation="test", model="small-model") == before + 1
+
+
+def test_models_with_an_open_circuit_are_skipped(groq_stub, monkeypatch):
+    monkeypatch.setattr(groq_resilience, "MODEL_FALLBACKS", {"down-model": ["up-model"]})
+    models = []
+
+    def route(body):
+        models.append(json.loads(body)["model"])
+        return 200, "application/json", completion("ok")
+
+    groq_stub[CHAT] = route
+    circuit = install_breaker("down-model", failure_threshold=1, reset_timeout=60)
+    circuit.record_failure()
+
+    assert reply(call_groq("test", "down-model", chat)) == "ok"
+    assert models == ["up-model"]
+
+
+def test_cancelled_trial_frees_the_half_open_circuit(groq_stub, monkeypatch):
+    monkeypatch.setattr(groq_resilience, "MAX_RETRIES", 0)
+    slow = threading.Event()
+    slow.set()
+
+    def route(body):
+        if slow.is_set():
+            # Long enough for the caller to give up first
+            time.sleep(1)
+        return 200, "application/json", completion("ok")
+
+    groq_stub[CHAT] = route
+    circuit = install_breaker("cancelled-model", failure_threshold=1, reset_timeout=0.05)
+    circuit.record_failure()
+    time.sleep(0.1)
+
+    async def scenario():
+        # The trial call is cancelled, like a sibling task or a disconnected client would be
+        trial = asyncio.create_task(call_groq_async("test", "cancelled-model", async_chat))
+        await asyncio.sleep(0.2)
+        assert circuit.state == HALF_OPEN
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+
+        # The next call may be the trial instead of being rejected forever
+        slow.clear()
+        return reply(await call_groq_async("test", "cancelled-model", async_chat))
+
+    assert asyncio.run(scenario()) == "ok"
+    assert circuit.state == CLOSED
@@ -0,0 +1,55 @@
+import socket
+import pytest
+import requests
+import http_client
+from benchmark import StubServer
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(http_client, "backoff_delay", lambda attempt, retry_after=None: 0)
+
+
+def dropping_route(calls):
+    """Returns a route that reads the request, then drops the connection without answering."""
+    def route(body):
+        calls.append(body)
+        raise ConnectionAbortedError("dropped after reading the request")
+    return route
+
+
+def unused_port():
+    """Returns a local port nothing listens on."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_post_is_not_resent_after_the_connection_dropped():
+    calls = []
+    with StubServer({("POST", "/v2/create-pdf"): dropping_route(calls)}) as server:
+        with pytest.raises(requests.ConnectionError):
+            http_client.post("pdf_create", server.url + "/v2/create-pdf", json={"name": "Jane"})
+
+    # The server may have created the PDF, so it is asked only once
+    assert len(calls) == 1
+
+
+def test_get_is_retried_after_the_connection_dropped():
+    calls = []
+    with StubServer({("GET", "/download.pdf"): dropping_route(calls)}) as server:
+        with pytest.raises(requests.ConnectionError):
+            http_client.get("pdf_download", server.url + "/download.pdf")
+
+    assert len(calls) == http_client.MAX_RETRIES + 1
+
+
+def test_post_is_retried_when_it_never_reached_the_server():
+    url = f"http://127.0.0.1:{unused_port()}/v2/create-pdf"
+    before = http_client.http_retries.value(endpoint="pdf_create", reason="ConnectionError")
+
+    with pytest.raises(requests.ConnectionError):
+        http_client.post("pdf_create", url, json={"name": "Jane"})
+
+    after = http_client.http_retries.value(endpoint="pdf_create", reason="ConnectionError")
+    assert after - before == http_client.MAX_RETRIES
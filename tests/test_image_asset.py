@@ -0,0 +1,45 @@
+import base64
+import json
+from io import BytesIO
+from PIL import Image
+from image_asset import ImageAsset, has_metadata
+from report_jobs import encode_payload
+
+# EXIF tags: orientation, and the GPS IFD with a latitude reference
+ORIENTATION, GPS_IFD, GPS_LATITUDE_REF = 0x0112, 0x8825, 1
+
+
+def phone_photo(orientation=6):
+    """Returns a 40x30 JPEG with a GPS position, rotated by its EXIF orientation like phone photos are."""
+    exif = Image.Exif()
+    exif[ORIENTATION] = orientation
+    exif.get_ifd(GPS_IFD)[GPS_LATITUDE_REF] = "N"
+    buffered = BytesIO()
+    Image.new("RGB", (40, 30), "red").save(buffered, format="JPEG", exif=exif)
+    return buffered.getvalue()
+
+
+def test_report_jpeg_has_no_metadata_and_keeps_the_orientation():
+    asset = ImageAsset(phone_photo())
+
+    embedded = Image.open(BytesIO(asset.jpeg_bytes))
+
+    assert not has_metadata(embedded)
+    # Orientation 6 is a 90 degree rotation, applied to the pixels before the EXIF was dropped
+    assert embedded.size == (30, 40)
+    assert base64.b64decode(asset.jpeg_base64) == asset.jpeg_bytes
+
+
+def test_jpeg_without_metadata_is_embedded_as_is():
+    buffered = BytesIO()
+    Image.new("RGB", (40, 30), "red").save(buffered, format="JPEG")
+    asset = ImageAsset(buffered.getvalue())
+
+    assert asset.jpeg_bytes is asset.data
+    assert asset.jpeg_base64 == asset.base64
+
+
+def test_job_payload_carries_no_metadata():
+    payload = json.loads(encode_payload([], "Jane", "jane@example.com", ImageAsset(phone_photo())))
+
+    assert not has_metadata(Image.open(BytesIO(base64.b64decode(payload["img_input"]))))
@@ -0,0 +1,24 @@
+import json
+import os
+import subprocess
+import sys
+from conftest import CREDENTIAL_VARS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_small_load_replays_every_stage_without_failures(tmp_path):
+    env = {name: value for name, value in os.environ.items() if name not in CREDENTIAL_VARS}
+    results = tmp_path / "results.json"
+    # A fresh interpreter, the load test configures the app before importing it
+    command = [sys.executable, "load_test.py", "--sessions", "4", "--concurrency", "2", "--followups", "1",
+               "--llm-latency", "0", "--token-interval", "0", "--stt-latency", "0", "--tts-latency", "0",
+               "--image-latency", "0", "--pdf-latency", "0", "--db-latency", "0", "--poll", "0.01",
+               "--json", str(results)]
+    result = subprocess.run(command, cwd=ROOT, env=env, capture_output=True, text=True, timeout=300)
+
+    assert result.returncode == 0, result.stderr
+    summary = json.loads(results.read_text())
+    assert summary["failed"] == 0
+    for stage in ("login", "response", "followup", "report"):
+        assert summary["stages"][stage]["count"] > 0 and summary["stages"][stage]["errors"] == 0
@@ -0,0 +1,48 @@
+from fastapi.testclient import TestClient
+from metrics import PROMETHEUS_CONTENT_TYPE, counter, gauge, histogram, render_prometheus
+
+
+def test_every_metric_has_help_and_type_lines():
+    counter("test_render_calls_total", "Calls,\nby outcome.").inc(outcome="ok")
+    gauge("test_render_in_flight", "Calls running.").set(3)
+
+    text = render_prometheus()
+
+    assert "# HELP test_render_calls_total Calls,\\nby outcome.\n# TYPE test_render_calls_total counter\n" in text
+    assert "# HELP test_render_in_flight Calls running.\n# TYPE test_render_in_flight gauge\n" in text
+    assert 'test_render_calls_total{outcome="ok"} 1\n' in text
+    assert "test_render_in_flight 3\n" in text
+    assert text.endswith("\n")
+
+
+def test_label_values_are_escaped():
+    counter("test_render_escaped_total", "Escaped labels.").inc(path='C:\\tmp\\"a"\nb')
+
+    assert 'test_render_escaped_total{path="C:\\\\tmp\\\\\\"a\\"\\nb"} 1\n' in render_prometheus()
+
+
+def test_histograms_have_cumulative_buckets_sum_and_count():
+    latency = histogram("test_render_seconds", "Latency.", buckets=(0.1, 1.0))
+    for seconds in (0.05, 0.5, 5.0):
+        latency.observe(seconds, model="m")
+
+    lines = [line for line in render_prometheus().splitlines() if line.startswith("test_render_seconds")]
+
+    assert lines == [
+        'test_render_seconds_bucket{model="m",le="0.1"} 1',
+        'test_render_seconds_bucket{model="m",le="1.0"} 2',
+        'test_render_seconds_bucket{model="m",le="+Inf"} 3',
+        'test_render_seconds_sum{model="m"} 5.55',
+        'test_render_seconds_count{model="m"} 3',
+    ]
+
+
+def test_metrics_endpoint_is_served_next_to_the_interface():
+    import gradio_ui
+    counter("test_render_scraped_total", "Scrapes.").inc()
+
+    response = TestClient(gradio_ui.create_app()).get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == PROMETHEUS_CONTENT_TYPE
+    assert "# TYPE test_render_scraped_total counter\ntest_render_scraped_total 1\n" in response.text
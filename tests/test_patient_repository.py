@@ -0,0 +1,54 @@
+import pytest
+from patient_repository import MemoryPatientRepository, PatientRepository, SQLitePatientRepository
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def repository(request, tmp_path):
+    """Each backend that runs without Firebase."""
+    if request.param == "sqlite":
+        return SQLitePatientRepository(str(tmp_path / "patients.db"))
+    return MemoryPatientRepository()
+
+
+def report(number):
+    """The metadata of a report, dated in the order of its number."""
+    return {"report_id": f"Report_{number}", "blob_key": f"reports/jane/Report_{number}.pdf",
+            "date": f"2026-10-{number:02}"}
+
+
+def test_saving_a_report_evicts_the_oldest_beyond_the_kept_ones(repository):
+    for number in range(1, 5):
+        repository.save_report("jane", report(number), keep=3)
+
+    evicted = repository.save_report("jane", report(5), keep=3)
+
+    assert [r["report_id"] for r in evicted] == ["Report_2"]
+    assert [r["report_id"] for r in repository.latest_reports("jane", None)] == ["Report_5", "Report_4", "Report_3"]
+    assert [r["report_id"] for r in repository.latest_reports("jane", 2)] == ["Report_5", "Report_4"]
+
+
+def test_dashboard_of_a_missing_patient_is_empty(repository):
+    repository.save_report("jane", report(1), keep=5)
+
+    assert repository.get_dashboard("jane", 5) == (None, [])
+    repository.put_patient("jane", {"name": "Jane"})
+    patient, reports = repository.get_dashboard("jane", 5)
+    assert patient == {"name": "Jane"} and [r["report_id"] for r in reports] == ["Report_1"]
+
+
+def test_compact_evicts_a_backlog_written_without_eviction(repository):
+    repository.put_reports("jane", [report(number) for number in range(1, 8)])
+
+    evicted = repository.compact("jane", keep=5)
+
+    assert sorted(r["report_id"] for r in evicted) == ["Report_1", "Report_2"]
+    assert len(repository.latest_reports("jane", None)) == 5
+
+
+def test_repository_without_every_operation_cannot_be_created():
+    class Incomplete(PatientRepository):
+        def get_patient(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        Incomplete()
@@ -0,0 +1,77 @@
+import re
+import zlib
+from io import BytesIO
+import pytest
+from PIL import Image
+from image_asset import ImageAsset
+from pdf_renderer import LocalPdfRenderer, PdfRenderer
+
+PAYLOAD = {"name": "Jane Doe", "email": "jane@example.com", "date": "January 01, 2026",
+           "Symptoms": "<p>Itchy rash.</p>", "Observations": "<p>Mild redness.</p>",
+           "Recommendations": "<ul><li>Rest</li></ul>", "Image": "<img>"}
+
+
+class RecordingRenderer(PdfRenderer):
+    """Stands in for the PDF API, recording the reports it is asked to render."""
+
+    name = "recording"
+
+    def __init__(self):
+        self.payloads = []
+
+    def render(self, payload, image=None):
+        self.payloads.append(payload)
+        return b"%PDF-remote"
+
+
+def encoded(mode, image_format, size=(40, 30)):
+    """Returns an image of the given mode and size, encoded in the given format."""
+    buffered = BytesIO()
+    Image.new(mode, size, 128).save(buffered, format=image_format)
+    return buffered.getvalue()
+
+
+def embedded_image(pdf):
+    """Returns the image dictionary of a rendered PDF and the JPEG it embeds."""
+    match = re.search(rb"<< /Type /XObject /Subtype /Image (.*?) /Length (\d+) >>\nstream\n", pdf, re.S)
+    start = match.end()
+    return match.group(1).decode("ascii"), Image.open(BytesIO(pdf[start:start + int(match.group(2))]))
+
+
+@pytest.mark.parametrize("mode, image_format", [("L", "PNG"), ("L", "JPEG"), ("RGB", "PNG"), ("CMYK", "JPEG")])
+def test_color_space_matches_the_embedded_jpeg(mode, image_format):
+    pdf = LocalPdfRenderer().render(PAYLOAD, ImageAsset(encoded(mode, image_format)))
+
+    dictionary, jpeg = embedded_image(pdf)
+
+    expected = "/DeviceGray" if jpeg.mode == "L" else "/DeviceRGB"
+    assert jpeg.mode in ("L", "RGB")
+    assert f"/ColorSpace {expected}" in dictionary
+    assert f"/Width {jpeg.width} /Height {jpeg.height}" in dictionary
+
+
+def test_latin_text_is_rendered_locally():
+    fallback = RecordingRenderer()
+
+    pdf = LocalPdfRenderer(fallback=fallback).render(dict(PAYLOAD, name="Zoë Müller"))
+
+    assert pdf.startswith(b"%PDF-1.4") and not fallback.payloads
+    pages = b"".join(zlib.decompress(stream) for stream in re.findall(
+        rb"/Filter /FlateDecode >>\nstream\n(.*?)\nendstream", pdf, re.S))
+    assert "Zoë Müller".encode("cp1252") in pages
+
+
+def test_text_outside_winansi_goes_to_the_fallback():
+    fallback = RecordingRenderer()
+    payload = dict(PAYLOAD, name="محمد علي", Symptoms="<p>头痛</p>")
+
+    assert LocalPdfRenderer(fallback=fallback).render(payload) == b"%PDF-remote"
+    assert fallback.payloads == [payload]
+
+
+def test_renderer_without_render_cannot_be_created():
+    class Incomplete(PdfRenderer):
+        name = "incomplete"
+
+    with pytest.raises(TypeError):
+        Incomplete()
@@ -0,0 +1,70 @@
+import json
+from types import SimpleNamespace
+import pytest
+import report
+from API_Config import services
+from groq_resilience import CircuitOpenError
+from patient_repository import MemoryPatientRepository, user_key
+from report_store import LocalReportStore
+
+
+def replies(*answers):
+    """Stands in for request_report_json, answering each call with the next answer, or raising it."""
+    calls = []
+
+    def request(operation, model, prompt):
+        calls.append(operation)
+        answer = answers[len(calls) - 1]
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+    return request, calls
+
+
+def test_broken_sections_are_asked_again(monkeypatch):
+    request, calls = replies(json.dumps({"Symptoms": "<p>Rash</p>"}),
+                             json.dumps({"Observations": "<p>Red</p>", "Recommendations": "<p>Rest</p>"}))
+    monkeypatch.setattr(report, "request_report_json", request)
+
+    fields = report.generate_report_fields("prompt")
+
+    assert calls == ["report", "report_repair"]
+    assert fields == {"Symptoms": "<p>Rash</p>", "Observations": "<p>Red</p>", "Recommendations": "<p>Rest</p>"}
+
+
+def test_failed_reask_keeps_the_parsed_sections(monkeypatch):
+    request, _ = replies(json.dumps({"Symptoms": "<p>Rash</p>", "Observations": "<p>Red</p>"}),
+                         CircuitOpenError("All models for report_repair are unavailable."))
+    monkeypatch.setattr(report, "request_report_json", request)
+
+    fields = report.generate_report_fields("prompt")
+
+    assert fields["Symptoms"] == "<p>Rash</p>" and fields["Observations"] == "<p>Red</p>"
+    assert fields["Recommendations"] == "<p><i>Not available.</i></p>"
+
+
+def test_no_section_at_all_fails_the_report(monkeypatch):
+    request, _ = replies("not json", CircuitOpenError("unavailable"))
+    monkeypatch.setattr(report, "request_report_json", request)
+
+    with pytest.raises(ValueError):
+        report.generate_report_fields("prompt")
+
+
+def test_reports_of_the_same_second_are_both_kept(monkeypatch, tmp_path):
+    patients = MemoryPatientRepository()
+    services.override("patients", patients)
+    services.override("report_store", LocalReportStore(str(tmp_path)))
+    services.override("pdf_renderer", SimpleNamespace(render=lambda payload, image: b"%PDF-1.4"))
+    monkeypatch.setattr(report, "generate_report_fields", lambda prompt: {
+        "Symptoms": "<p>Rash</p>", "Observations": "<p>Red</p>", "Recommendations": "<p>Rest</p>"})
+    history = [{"role": "user", "content": "I have a rash"}]
+
+    first = report.generate_report(history, "Jane", "jane@example.com", None)
+    second = report.generate_report(history, "Jane", "jane@example.com", None)
+
+    assert first[1] and second[1] and first[1] != second[1]
+    # Neither report replaced the other, so both PDFs are still listed
+    reports = patients.latest_reports(user_key("jane@example.com"), None)
+    assert len({r["report_id"] for r in reports}) == 2
+    assert len({r["blob_key"] for r in reports}) == 2
@@ -0,0 +1,100 @@
+import asyncio
+import threading
+import time
+import pytest
+import report_jobs
+from API_Config import services
+from report_jobs import DONE, QUEUED, RUNNING, MemoryJobStore, ReportJobQueue, SQLiteJobStore, watch_report_async
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    return MemoryJobStore() if request.param == "memory" else SQLiteJobStore(str(tmp_path / "jobs.db"))
+
+
+@pytest.fixture(autouse=True)
+def fast_polling(monkeypatch):
+    monkeypatch.setattr(report_jobs, "REPORT_JOB_POLL_SECONDS", 0.01)
+
+
+def fake_report(history, name, email, img_input):
+    """Stands in for generate_report."""
+    return f"<p>Report of {name}</p>", "<a>download</a>"
+
+
+def wait_until_done(queue, job_id):
+    """Waits for a job to leave the queue."""
+    for _ in range(500):
+        if queue.status(job_id)["status"] not in (QUEUED, RUNNING):
+            return queue.status(job_id)
+        time.sleep(0.01)
+    raise AssertionError("The job did not finish")
+
+
+def watch(job_id):
+    """Runs the Report tab watcher to the end, returning its updates."""
+    async def run():
+        return [update async for update in watch_report_async(job_id)]
+    return asyncio.run(run())
+
+
+def test_payload_is_dropped_when_the_job_finishes(store):
+    queue = ReportJobQueue(fake_report, store, workers=1)
+
+    job = wait_until_done(queue, queue.submit([], "Jane", "jane@example.com", None))
+
+    assert job["status"] == DONE and job["payload"] is None
+    assert job["result"] == ["<p>Report of Jane</p>", "<a>download</a>"]
+
+
+def test_job_is_deleted_once_its_result_was_delivered(store):
+    queue = ReportJobQueue(fake_report, store, workers=1)
+    services.override("report_jobs", queue)
+    job_id = queue.submit([], "Jane", "jane@example.com", None)
+
+    assert watch(job_id)[-1] == ("<p>Report of Jane</p>", "<a>download</a>")
+    assert queue.status(job_id) is None
+
+
+def test_finished_jobs_expire_after_the_ttl(store):
+    release = threading.Event()
+
+    def blocked_report(**kwargs):
+        release.wait(5)
+        return fake_report(**kwargs)
+
+    queue = ReportJobQueue(blocked_report, store, workers=1, ttl=0.05)
+    finished = queue.submit([], "Jane", "jane@example.com", None)
+    release.set()
+    wait_until_done(queue, finished)
+    release.clear()
+    running = queue.submit([], "John", "john@example.com", None)
+    time.sleep(0.1)
+
+    # Submitting expires the finished job nobody picked up, not the one still running
+    queue.submit([], "Ann", "ann@example.com", None)
+    assert queue.status(finished) is None
+    assert queue.status(running) is not None
+    release.set()
+
+
+def test_watcher_reads_the_job_store_off_the_event_loop(store):
+    queue = ReportJobQueue(fake_report, store, workers=1)
+    threads = []
+
+    class RecordingQueue:
+        """Records the thread each job store call runs on."""
+
+        def status(self, job_id):
+            threads.append(threading.current_thread())
+            return queue.status(job_id)
+
+        def forget(self, job_id):
+            threads.append(threading.current_thread())
+            queue.forget(job_id)
+
+    services.override("report_jobs", RecordingQueue())
+
+    watch(queue.submit([], "Jane", "jane@example.com", None))
+
+    assert threads and threading.main_thread() not in threads
@@ -0,0 +1,45 @@
+import pytest
+from report_store import LocalReportStore, ReportStore, report_key
+
+
+def test_report_keys_are_not_guessable():
+    first = report_key("jane@example", "Report_01-01-2026_10-00-AM")
+    second = report_key("jane@example", "Report_01-01-2026_10-00-AM")
+
+    assert first != second
+    assert first.startswith("reports/jane@example/Report_01-01-2026_10-00-AM_")
+    assert first.endswith(".pdf")
+
+
+def test_local_store_round_trip(tmp_path):
+    store = LocalReportStore(str(tmp_path))
+    key = report_key("jane@example", "Report_1")
+
+    store.put(key, b"%PDF-1.4")
+
+    assert store.get(key) == b"%PDF-1.4"
+    assert store.url(key).startswith("/gradio_api/file=")
+    store.delete(key)
+    store.delete(key)
+    with pytest.raises(FileNotFoundError):
+        store.get(key)
+
+
+def test_local_store_rejects_keys_outside_its_root(tmp_path):
+    with pytest.raises(ValueError):
+        LocalReportStore(str(tmp_path)).put("../escape.pdf", b"")
+
+
+def test_store_without_url_cannot_be_created():
+    class Incomplete(ReportStore):
+        def put(self, key, data):
+            pass
+
+        def get(self, key):
+            return b""
+
+        def delete(self, key):
+            pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
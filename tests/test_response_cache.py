@@ -0,0 +1,48 @@
+import os
+import time
+from response_cache import ContentCache, cache_key
+
+
+def disk_cache(tmp_path, name, max_disk_bytes):
+    """A cache whose memory tier holds nothing, so every lookup goes to the disk tier."""
+    return ContentCache(name, max_bytes=0, disk_dir=str(tmp_path), max_disk_bytes=max_disk_bytes)
+
+
+def test_disk_tier_is_only_walked_once_over_budget(tmp_path, monkeypatch):
+    cache = disk_cache(tmp_path, "test-walk", max_disk_bytes=250)
+    walks = []
+    list_files = cache._disk_files
+    monkeypatch.setattr(cache, "_disk_files", lambda: walks.append(1) or list_files())
+
+    for number in range(2):
+        cache.put(cache_key("m", str(number)), b"x" * 100)
+    # Replacing an entry doesn't count it twice
+    cache.put(cache_key("m", "0"), b"x" * 100)
+
+    assert walks == [] and cache.stats()["disk_bytes"] == 200
+    cache.put(cache_key("m", "2"), b"x" * 100)
+    assert walks == [1] and cache.stats()["disk_bytes"] == 200
+
+
+def test_oldest_disk_entries_are_evicted_beyond_the_budget(tmp_path):
+    cache = disk_cache(tmp_path, "test-evict", max_disk_bytes=250)
+    keys = [cache_key("m", str(number)) for number in range(3)]
+    for age, key in zip((30, 20, 10), keys):
+        cache.put(key, b"x" * 100)
+        # Age the files so the oldest one is well defined
+        os.utime(cache._disk_path(key), (time.time() - age, time.time() - age))
+
+    cache.put(cache_key("m", "3"), b"x" * 100)
+
+    assert cache.get(keys[0]) is None and cache.get(keys[1]) is None
+    assert cache.get(keys[2]) == b"x" * 100
+
+
+def test_disk_size_is_seeded_from_a_previous_run_and_follows_deletes(tmp_path):
+    disk_cache(tmp_path, "test-seed", max_disk_bytes=1000).put(cache_key("m", "0"), b"x" * 100)
+
+    cache = disk_cache(tmp_path, "test-seed", max_disk_bytes=1000)
+    assert cache.stats()["disk_bytes"] == 100
+
+    cache.delete(cache_key("m", "0"))
+    assert cache.stats()["disk_bytes"] == 0
@@ -0,0 +1,63 @@
+from Response_voice import Mp3FrameSplitter, mp3_frame_length
+
+# A 128 kbps MPEG-1 Layer III frame at 44.1 kHz, 417 bytes without padding
+FRAME = b"\xff\xfb\x90\x64" + bytes(413)
+# The same frame with the padding bit set, one byte longer
+PADDED_FRAME = b"\xff\xfb\x92\x64" + bytes(414)
+
+
+def split(data, piece, min_bytes):
+    """Feeds data to a splitter in pieces of the given size, returning the chunks it cut and what flush() returned."""
+    splitter = Mp3FrameSplitter(min_bytes)
+    chunks = [splitter.feed(data[start:start + piece]) for start in range(0, len(data), piece)]
+    return [chunk for chunk in chunks if chunk], splitter.flush()
+
+
+def test_frame_lengths_come_from_the_header():
+    assert mp3_frame_length(FRAME[:4]) == len(FRAME) == 417
+    assert mp3_frame_length(PADDED_FRAME[:4]) == len(PADDED_FRAME)
+    assert mp3_frame_length(b"RIFF") is None
+
+
+def test_concatenated_frames_are_returned_once_min_bytes_is_reached():
+    data = (FRAME + PADDED_FRAME) * 5
+
+    chunks, rest = split(data, len(data), min_bytes=len(FRAME) * 4)
+
+    assert chunks == [data] and rest == b""
+
+
+def test_frames_cut_across_feeds_are_only_returned_whole():
+    data = (FRAME + PADDED_FRAME) * 6
+
+    chunks, rest = split(data, 100, min_bytes=1000)
+
+    assert b"".join(chunks) + rest == data
+    for chunk in chunks:
+        # Each chunk starts on a frame header and ends on a frame boundary
+        offset = 0
+        while offset < len(chunk):
+            offset += mp3_frame_length(chunk[offset:offset + 4])
+        assert offset == len(chunk)
+
+
+def test_trailing_partial_frame_is_returned_by_flush():
+    chunks, rest = split(FRAME * 3 + FRAME[:200], 1000, min_bytes=1)
+
+    assert chunks == [FRAME * 2, FRAME]
+    assert rest == FRAME[:200]
+
+
+def test_id3_tag_is_skipped_before_the_frames():
+    tag = b"ID3\x04\x00\x00\x00\x00\x00\x0a" + bytes(10)
+
+    chunks, rest = split(tag + FRAME * 2, 7, min_bytes=1)
+
+    assert b"".join(chunks) == tag + FRAME * 2 and rest == b""
+    assert chunks[0].startswith(tag)
+
+
+def test_data_that_is_not_mp3_is_held_back_until_flush():
+    chunks, rest = split(b"RIFF" + bytes(2000), 500, min_bytes=1)
+
+    assert chunks == [] and rest == b"RIFF" + bytes(2000)
@@ -0,0 +1,98 @@
+import asyncio
+import os
+import subprocess
+import sys
+from types import SimpleNamespace
+import gradio as gr
+import pytest
+import Database
+from API_Config import LazyService, LoopLocalService, ServiceRegistry, services
+from conftest import CREDENTIAL_VARS
+from patient_repository import MemoryPatientRepository, user_key
+from report_store import LocalReportStore
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeAuth:
+    """Accepts every sign in, like the pyrebase auth client would for a registered user."""
+
+    def sign_in_with_email_and_password(self, email, password):
+        return {"email": email}
+
+
+def test_app_imports_without_credentials_or_creating_services():
+    env = {name: value for name, value in os.environ.items() if name not in CREDENTIAL_VARS}
+    # A fresh interpreter, so no earlier test has imported or created anything
+    result = subprocess.run(
+        [sys.executable, "-c", "import gradio_ui; from API_Config import services; print(services.init_times())"],
+        cwd=ROOT, env=env, capture_output=True, text=True, timeout=120)
+
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip().splitlines()[-1] == "{}"
+
+
+def test_missing_credentials_fail_on_first_use():
+    with pytest.raises(gr.Error, match="GROQ_API_KEY"):
+        services.get("groq")
+
+
+def test_get_creates_a_service_once():
+    registry = ServiceRegistry()
+    created = []
+    registry.register("thing", lambda: created.append(object()) or created[-1])
+
+    first = registry.get("thing")
+
+    assert registry.get("thing") is first
+    assert len(created) == 1
+    assert "thing" in registry.init_times()
+
+
+def test_override_and_reset():
+    registry = ServiceRegistry()
+    registry.register("thing", object)
+    fake = object()
+
+    registry.override("thing", fake)
+    assert registry.get("thing") is fake
+
+    registry.reset("thing")
+    real = registry.get("thing")
+    assert real is not fake
+    # Resetting everything drops the created instances too
+    registry.reset()
+    assert registry.get("thing") is not real
+
+
+def test_lazy_service_resolves_the_override_on_use():
+    proxy = LazyService("auth")
+    services.override("auth", FakeAuth())
+
+    assert proxy.sign_in_with_email_and_password("a@b.com", "pw") == {"email": "a@b.com"}
+
+
+def test_loop_local_service_has_one_instance_per_loop(monkeypatch):
+    monkeypatch.setitem(services._factories, "test_loop_local", lambda: SimpleNamespace(token=object()))
+    proxy = LoopLocalService("test_loop_local")
+
+    async def resolve():
+        return proxy.token
+
+    assert asyncio.run(resolve()) is not asyncio.run(resolve())
+    # An override is shared by every loop
+    services.override("test_loop_local", SimpleNamespace(token="fake"))
+    assert asyncio.run(resolve()) == "fake"
+
+
+def test_login_runs_on_overridden_fakes(tmp_path):
+    patients = MemoryPatientRepository()
+    patients.put_patient(user_key("jane@example.com"), {"name": "Jane", "email": "jane@example.com"})
+    services.override("auth", FakeAuth())
+    services.override("patients", patients)
+    services.override("report_store", LocalReportStore(str(tmp_path)))
+
+    logged_in, email, name, links = Database.login_auth("jane@example.com", "password")
+
+    assert (logged_in, email, name) == (True, "jane@example.com", "Jane")
+    assert "No reports available." in links
@@ -0,0 +1,98 @@
+import asyncio
+import threading
+import time
+import Brain
+from groq_stub import chunk, sse
+
+CHAT = ("POST", "/openai/v1/chat/completions")
+SPEECH = ("POST", "/openai/v1/audio/speech")
+
+# A 128 kbps MPEG-1 Layer III frame, as the speech endpoint streams them
+MP3_FRAME = b"\xff\xfb\x90\x64" + bytes(413)
+
+
+def collect(async_generator, on_item=None):
+    """Runs an async generator to completion, returning its items and calling on_item after each one."""
+    async def run():
+        items = []
+        async for item in async_generator:
+            items.append(item)
+            if on_item:
+                on_item(item)
+        return items
+    return asyncio.run(run())
+
+
+def test_stream_yields_each_token_as_it_arrives(groq_stub):
+    release, finished = threading.Event(), threading.Event()
+
+    def stream():
+        yield from sse(chunk(role="assistant", content=""), chunk("Based"), done=False)
+        # The rest of the reply is held back until the test has seen the first token
+        release.wait(5)
+        yield from sse(chunk(" on"), chunk(" your description."))
+        finished.set()
+
+    groq_stub[CHAT] = lambda body: (200, "text/event-stream", stream())
+    seen_before_end = []
+
+    def on_token(token):
+        seen_before_end.append(not finished.is_set())
+        release.set()
+
+    tokens = collect(Brain.analyze_image_stream_async("query", "stub-model"), on_token)
+
+    assert tokens == ["Based", " on", " your description."]
+    # The first token was yielded while the server was still streaming the rest
+    assert seen_before_end[0]
+
+
+def test_stream_skips_keep_alive_and_empty_chunks(groq_stub):
+    events = [
+        ": keep-alive\n\n",
+        chunk(role="assistant"),
+        chunk("Hello"),
+        chunk(choices=False),
+        chunk(""),
+        ": keep-alive\n\n",
+        chunk(" there"),
+        chunk(choices=False),
+    ]
+    groq_stub[CHAT] = lambda body: (200, "text/event-stream", sse(*events))
+
+    assert collect(Brain.analyze_image_stream_async("query", "stub-model")) == ["Hello", " there"]
+
+
+def test_stream_records_time_to_first_token(groq_stub):
+    def stream():
+        time.sleep(0.1)
+        yield from sse(chunk("Hello"), chunk(" again"))
+
+    groq_stub[CHAT] = lambda body: (200, "text/event-stream", stream())
+    labels = (("model", "ttft-model"),)
+    before = Brain.time_to_first_token.samples().get(labels, {"count": 0, "sum": 0.0})
+
+    collect(Brain.analyze_image_stream_async("query", "ttft-model"))
+
+    after = Brain.time_to_first_token.samples()[labels]
+    # One observation per reply, not per token, covering the wait for the first one
+    assert after["count"] == before["count"] + 1
+    assert after["sum"] - before["sum"] >= 0.1
+
+
+def test_response_stream_grows_the_text_and_voices_it(groq_stub):
+    groq_stub[CHAT] = lambda body: (200, "text/event-stream", sse(
+        chunk("Based on your description, this looks mild. "), chunk("Rest and drink water. "),
+        chunk("See a doctor if it gets worse.")))
+    groq_stub[SPEECH] = lambda body: (200, "audio/mpeg", iter([MP3_FRAME * 10]))
+
+    updates = collect(Brain.generate_response_stream_async("my throat hurts", None))
+
+    texts = [text for _, text, _ in updates]
+    # The text box is updated as the reply streams in, ending with the whole reply
+    assert len(set(texts)) > 1
+    assert all(later.startswith(earlier) for earlier, later in zip(texts, texts[1:]))
+    assert texts[-1] == "Based on your description, this looks mild. Rest and drink water. See a doctor if it gets worse."
+    assert any(isinstance(audio, bytes) and audio for audio, _, _ in updates)
+    # The last update carries the conversation the follow-ups build on
+    assert isinstance(updates[-1][2], Brain.Conversation)
@@ -0,0 +1,32 @@
+import json
+import Brain
+from conversation import RECENT_TURNS, SUMMARY_TRIGGER_TOKENS, Conversation
+from groq_stub import completion
+from summarizer import SUMMARY_MODEL
+
+CHAT = ("POST", "/openai/v1/chat/completions")
+
+
+def long_conversation():
+    """A conversation whose older follow-ups are due to be folded into the summary."""
+    conversation = Conversation.seeded("My throat hurts", "It looks like a mild infection.")
+    for number in range(RECENT_TURNS):
+        conversation.append("user", f"Question {number} " + "detail " * SUMMARY_TRIGGER_TOKENS)
+        conversation.append("assistant", f"Answer {number}")
+    assert conversation.pending_fold() is not None
+    return conversation
+
+
+def test_sync_followup_waits_for_the_summary(groq_stub):
+    def reply(body):
+        model = json.loads(body)["model"]
+        return 200, "application/json", completion("Sore throat for 3 days." if model == SUMMARY_MODEL else "Rest.")
+
+    groq_stub[CHAT] = reply
+
+    conversation, text = Brain.generate_followup_response("Should I see a doctor?", long_conversation())
+
+    assert text == "Rest."
+    # The summary was not cancelled with the facade's private event loop
+    assert conversation.summary == "Sore throat for 3 days."
+    assert not conversation.summarizing